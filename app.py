@@ -1,17 +1,51 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, abort, g, render_template, jsonify, request, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import load_only, subqueryload
 from flask_migrate import Migrate
 from flask_cors import CORS
+import click
+import json
+import math
+import mimetypes
 import os
-from datetime import datetime
+from datetime import datetime, timezone
+from itertools import chain
+
+import autocomplete
+import catalog_mmap
+import catalog_snapshot
+import compression
+import dose_classifier
+import durations
+import formula
+import http_cache
+import mass_search
+import metabolite_search
+import read_model
+import search_index
+import units
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'forensic-tox-app-2024')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///forensic_toxicology.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['CATALOG_MAX_AGE'] = int(os.environ.get('CATALOG_MAX_AGE', 60))
+app.config['RESPONSE_CACHE_BYTES'] = int(os.environ.get('RESPONSE_CACHE_BYTES', 64 * 1024 * 1024))
+# Serve catalog reads from an in-memory snapshot built once, for catalogs that only change on deploy
+app.config['CATALOG_SNAPSHOT'] = os.environ.get('CATALOG_SNAPSHOT', '0') == '1'
+# Or map a binary catalog file written by `flask export-catalog`, one copy shared by every worker
+app.config['CATALOG_FILE'] = os.environ.get('CATALOG_FILE')
 
 db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+
+def include_in_migrations(name, type_, parent_names):
+    # The full-text search tables and the catalog revision are managed by the event listeners below,
+    # not by migrations
+    return not (type_ == 'table' and (name.startswith('substance_fts') or name == http_cache.REVISION_TABLE))
+
+migrate = Migrate(app, db, include_name=include_in_migrations)
 CORS(app)
 
 # Database Models
@@ -20,7 +54,7 @@ class Substance(db.Model):
     name = db.Column(db.String(200), nullable=False, unique=True)
     common_names = db.Column(db.Text)  # JSON string of alternative names
     chemical_formula = db.Column(db.String(100))
-    cas_number = db.Column(db.String(50))
+    cas_number = db.Column(db.String(50), index=True)
     category = db.Column(db.String(100), nullable=False)  # pharmaceutical, narcotic, synthetic
     description = db.Column(db.Text)
     mechanism_of_action = db.Column(db.Text)
@@ -32,15 +66,36 @@ class Substance(db.Model):
     half_life = db.Column(db.String(50))
     detection_window = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    content_hash = db.Column(db.String(64))  # Digest of the record as last synced by init_database.py
+    seeded = db.Column(db.Boolean, default=False)  # From init_database.py's catalog; only these are removed by a sync
+    # half_life in hours, parsed when the substance is written
+    half_life_min_hours = db.Column(db.Float)
+    half_life_max_hours = db.Column(db.Float)
+    # Thresholds converted from dose_unit to ng/mL, filled when the substance is written
+    therapeutic_dose_min_ng_ml = db.Column(db.Float)
+    therapeutic_dose_max_ng_ml = db.Column(db.Float)
+    toxic_dose_ng_ml = db.Column(db.Float, index=True)
+    lethal_dose_ng_ml = db.Column(db.Float)
+    # Masses of chemical_formula in daltons, filled when the substance is written
+    monoisotopic_mass = db.Column(db.Float, index=True)
+    average_mass = db.Column(db.Float)
+    
+    # Category filters and category listings sorted by name; also serves category alone
+    __table_args__ = (db.Index('ix_substance_category_name', 'category', 'name'),)
     
     # Relationships
-    metabolites = db.relationship('Metabolite', backref='parent_substance', lazy=True, cascade='all, delete-orphan')
+    metabolites = db.relationship('Metabolite', backref='parent_substance', lazy=True, cascade='all, delete-orphan',
+                                  order_by='Metabolite.id')
+    detection_windows = db.relationship('DetectionWindow', lazy=True, cascade='all, delete-orphan',
+                                        order_by='DetectionWindow.id')
 
 class Metabolite(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    substance_id = db.Column(db.Integer, db.ForeignKey('substance.id'), nullable=False)
+    substance_id = db.Column(db.Integer, db.ForeignKey('substance.id'), nullable=False, index=True)
     name = db.Column(db.String(200), nullable=False)
-    chemical_formula = db.Column(db.String(100))
+    normalized_name = db.Column(db.String(200), index=True)  # metabolite_search.normalize_name(name)
+    chemical_formula = db.Column(db.String(100), index=True)
     is_active = db.Column(db.Boolean, default=False)
     formation_pathway = db.Column(db.Text)
     detection_significance = db.Column(db.Text)
@@ -48,6 +103,370 @@ class Metabolite(db.Model):
     therapeutic_range_max = db.Column(db.Float)
     toxic_level = db.Column(db.Float)
     unit = db.Column(db.String(20), default='ng/mL')
+    # Thresholds converted from unit to ng/mL, filled when the metabolite is written
+    therapeutic_range_min_ng_ml = db.Column(db.Float)
+    therapeutic_range_max_ng_ml = db.Column(db.Float)
+    toxic_level_ng_ml = db.Column(db.Float, index=True)
+    # Masses of chemical_formula in daltons, filled when the metabolite is written
+    monoisotopic_mass = db.Column(db.Float, index=True)
+    average_mass = db.Column(db.Float)
+
+class DetectionWindow(db.Model):
+    # One "Matrix: range" part of Substance.detection_window in hours, parsed when the substance is written
+    id = db.Column(db.Integer, primary_key=True)
+    substance_id = db.Column(db.Integer, db.ForeignKey('substance.id'), nullable=False, index=True)
+    matrix = db.Column(db.String(50), nullable=False)  # lowercase: urine, blood, hair...
+    min_hours = db.Column(db.Float, nullable=False)
+    max_hours = db.Column(db.Float, nullable=False)
+    
+    # detectable_in= and hours= filters: a range scan within one matrix that never reads the table
+    __table_args__ = (db.Index('ix_detection_window_matrix_max_hours', 'matrix', 'max_hours', 'substance_id'),)
+
+class ImportCheckpoint(db.Model):
+    # Progress of `flask load-reference-data`, committed together with each chunk
+    source = db.Column(db.String(500), primary_key=True)
+    fingerprint = db.Column(db.String(100), nullable=False)
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Pagination of the substance list
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+STREAM_CHUNK_SIZE = 500
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Full-text search index, kept in sync with the tables by triggers
+FTS_TABLE = 'substance_fts'
+
+@event.listens_for(db.metadata, 'after_create')
+def create_search_index(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        search_index.create_fts(connection.connection, Substance.__tablename__,
+                                Metabolite.__tablename__, FTS_TABLE)
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_search_index(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for statement in search_index.drop_ddl(FTS_TABLE):
+            connection.exec_driver_sql(statement)
+
+# Revision row bumped by triggers on every write to the catalog tables, from any process
+REVISION_TABLES = ('substance', 'metabolite', 'detection_window')
+
+@event.listens_for(db.metadata, 'after_create')
+def create_catalog_revision(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for statement in http_cache.revision_ddl(REVISION_TABLES):
+            connection.exec_driver_sql(statement)
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_catalog_revision(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for statement in http_cache.drop_revision_ddl(REVISION_TABLES):
+            connection.exec_driver_sql(statement)
+
+def fts_enabled():
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    return db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': FTS_TABLE}
+    ).first() is not None
+
+# Catalog version behind the ETag/Last-Modified validators of the read endpoints
+CATALOG_ENDPOINTS = {'get_substances', 'get_substance_detail', 'get_categories', 'get_autocomplete',
+                     'search_metabolites', 'search_mass'}
+# Catalog reads whose compressed bodies are kept in the response cache; autocomplete answers are too varied
+COMPRESSED_CACHE_ENDPOINTS = {'get_substances', 'get_substance_detail', 'get_categories', 'search_metabolites'}
+
+def catalog_revision():
+    # (revision, changed_at) of the catalog, or None for databases without the revision row
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    try:
+        row = db.session.execute(text(http_cache.REVISION_QUERY)).first()
+    except OperationalError:
+        db.session.rollback()
+        return None
+    return None if row is None else tuple(row)
+
+def catalog_fingerprint():
+    substances = db.session.query(func.count(Substance.id), func.max(Substance.id),
+                                  func.max(Substance.created_at), func.max(Substance.updated_at)).one()
+    metabolites = db.session.query(func.count(Metabolite.id), func.max(Metabolite.id)).one()
+    revision = catalog_revision()
+    newest = max(filter(None, substances[2:]), default=None)
+    timestamps = [newest.replace(tzinfo=timezone.utc).timestamp()] if newest else []
+    if revision is not None:
+        timestamps.append(http_cache.parse_sqlite_timestamp(revision[1]))
+    return f'{tuple(substances)}{tuple(metabolites)}{revision}', max(timestamps, default=None)
+
+catalog_version = http_cache.CatalogVersion(catalog_fingerprint, catalog_revision)
+response_cache = http_cache.ResponseCache(app.config['RESPONSE_CACHE_BYTES'])
+
+@event.listens_for(db.session, 'after_flush')
+def track_catalog_changes(session, flush_context):
+    if any(isinstance(obj, (Substance, Metabolite)) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info['catalog_changed'] = True
+
+def reset_catalog_caches():
+    # Also called directly by writers that bypass the ORM session, like the bulk loader
+    catalog_version.invalidate()
+    response_cache.clear()
+    dose_thresholds.clear()
+    snapshot_loader.invalidate()
+    autocomplete_loader.invalidate()
+    mass_index_loader.invalidate()
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_catalog(session):
+    if session.info.pop('catalog_changed', False):
+        reset_catalog_caches()
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_catalog_changes(session):
+    session.info.pop('catalog_changed', None)
+
+def check_catalog_revision():
+    # Drop the caches when another process (the importer, init_database.py, another worker)
+    # wrote to the catalog since they were built
+    if catalog_version.changed():
+        reset_catalog_caches()
+
+# Endpoints answered from the dose threshold tables rather than from catalog_version's caches
+ANALYSIS_ENDPOINTS = {'analyze_dose', 'analyze_dose_batch'}
+
+def wants_ndjson():
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def catalog_headers():
+    # Validators of the plain body; http_cache.coded_headers adds the coding once one is applied
+    variant = 'ndjson' if wants_ndjson() else 'json'
+    return http_cache.validator_headers(catalog_version, variant, app.config['CATALOG_MAX_AGE'])
+
+def encode_json(payload):
+    return (app.json.dumps(payload, separators=(',', ':')) + '\n').encode()
+
+def cached_json_response(build):
+    # Serve pre-encoded JSON for repeated reads; build() only runs on a cache miss
+    key = http_cache.cache_key(request.path, request.args.items(multi=True))
+    body = response_cache.get(key)
+    if body is None:
+        generation = response_cache.generation
+        body = encode_json(build())
+        response_cache.put(key, body, generation)
+    return Response(body, mimetype='application/json')
+
+@app.before_request
+def refresh_catalog_caches():
+    if request.endpoint in CATALOG_ENDPOINTS or request.endpoint in ANALYSIS_ENDPOINTS:
+        check_catalog_revision()
+
+@app.before_request
+def answer_conditional_catalog_request():
+    # Revalidations are answered from the in-memory version after one revision lookup,
+    # without running the catalog queries
+    if request.method in ('GET', 'HEAD') and request.endpoint in CATALOG_ENDPOINTS:
+        g.cache_generation = response_cache.generation
+        encoding = compression.negotiate(request.headers.get('Accept-Encoding'))
+        headers = http_cache.not_modified_headers(request.headers, catalog_headers(), encoding,
+                                                  catalog_version.last_modified)
+        if headers is not None:
+            return Response(status=304, headers=headers)
+
+@app.after_request
+def add_catalog_validators(response):
+    is_catalog_read = request.method in ('GET', 'HEAD') and request.endpoint in CATALOG_ENDPOINTS
+    if is_catalog_read and response.status_code == 200:
+        # Runs after compress_response, so Content-Encoding is the coding actually applied
+        response.headers.update(http_cache.coded_headers(catalog_headers(), response.headers.get('Content-Encoding')))
+    return response
+
+# Response compression
+@app.after_request
+def compress_response(response):
+    encoding = compression.negotiate(request.headers.get('Accept-Encoding'))
+    if (encoding is None or response.status_code != 200 or response.direct_passthrough or
+            'Content-Encoding' in response.headers or not compression.is_compressible(response.mimetype)):
+        return response
+    
+    if response.is_streamed:
+        response.response = compression.compress_chunks(response.iter_encoded(), encoding)
+    else:
+        body = response.get_data()
+        if len(body) < compression.MIN_SIZE:
+            return response
+        if request.endpoint in COMPRESSED_CACHE_ENDPOINTS:
+            # Kept next to the plain body, so each catalog response is compressed once per catalog version
+            key = (http_cache.cache_key(request.path, request.args.items(multi=True)), encoding)
+            compressed = response_cache.get(key)
+            if compressed is None:
+                compressed = compression.compress(body, encoding)
+                response_cache.put(key, compressed, g.cache_generation)
+        else:
+            compressed = compression.compress(body, encoding)
+        response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def load_static_assets():
+    # Static files only change on deploy, so each is compressed once, at the highest levels
+    assets = {}
+    for root, _, files in os.walk(app.static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                body = f.read()
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            filename = os.path.relpath(path, app.static_folder).replace(os.sep, '/')
+            assets[filename] = compression.PrecompressedBody(body, content_type)
+    return assets
+
+static_assets = load_static_assets()
+
+def send_static_asset(filename):
+    asset = static_assets.get(filename)
+    # The debug server reads files from disk, so edits show up without a restart
+    if asset is None or app.debug:
+        return app.send_static_file(filename)
+    
+    body, encoding = asset.select(request.headers.get('Accept-Encoding'))
+    response = Response(body, mimetype=asset.content_type)
+    response.set_etag(f'{asset.tag}-{encoding}' if encoding else asset.tag)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if asset.variants:
+        response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
+
+app.view_functions['static'] = send_static_asset
+
+# Serialization helpers
+SUBSTANCE_FIELDS = (
+    'id', 'name', 'common_names', 'chemical_formula', 'cas_number', 'category',
+    'description', 'mechanism_of_action', 'therapeutic_dose_min', 'therapeutic_dose_max',
+    'toxic_dose', 'lethal_dose', 'dose_unit', 'half_life', 'detection_window'
+)
+
+METABOLITE_FIELDS = (
+    'id', 'name', 'chemical_formula', 'is_active', 'formation_pathway', 'detection_significance',
+    'therapeutic_range_min', 'therapeutic_range_max', 'toxic_level', 'unit'
+)
+
+def metabolite_to_dict(m):
+    return {field: getattr(m, field) for field in METABOLITE_FIELDS}
+
+def substance_to_dict(s, fields=None, include_metabolites=True):
+    data = {field: getattr(s, field) for field in fields or SUBSTANCE_FIELDS}
+    if include_metabolites:
+        data['metabolites'] = [metabolite_to_dict(m) for m in s.metabolites]
+    return data
+
+def parse_projection(args):
+    """Read the fields= and include= parameters into (fields, include_metabolites).
+
+    Without fields= every column and the metabolites are returned, as before.
+    Raises ValueError for unknown names.
+    """
+    include = {name.strip() for name in args.get('include', '').split(',') if name.strip()}
+    unknown = include - {'metabolites'}
+    if unknown:
+        raise ValueError(f"Unknown include: {', '.join(sorted(unknown))}")
+    
+    requested = {name.strip() for name in args.get('fields', '').split(',') if name.strip()}
+    if not requested:
+        return SUBSTANCE_FIELDS, True
+    unknown = requested - set(SUBSTANCE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    
+    # id is always returned so clients can page and fetch details
+    fields = tuple(field for field in SUBSTANCE_FIELDS if field in requested or field == 'id')
+    return fields, 'metabolites' in include
+
+def projection_options(fields, include_metabolites):
+    # Only SELECT the requested columns; load metabolites in one extra statement when asked
+    options = [load_only(*[getattr(Substance, field) for field in fields])]
+    if include_metabolites:
+        options.append(subqueryload(Substance.metabolites))
+    return options
+
+# In-memory catalog snapshot
+def build_catalog_snapshot():
+    metabolites = {}
+    query = db.session.query(Metabolite.substance_id, *[getattr(Metabolite, field) for field in METABOLITE_FIELDS])
+    for substance_id, *values in query.order_by(Metabolite.substance_id, Metabolite.id):
+        metabolites.setdefault(substance_id, []).append(tuple(values))
+    
+    substances = db.session.query(*[getattr(Substance, field) for field in SUBSTANCE_FIELDS]).all()
+    rows = ((tuple(values), metabolites.get(values[0], ())) for values in substances)
+    return catalog_snapshot.CatalogSnapshot(SUBSTANCE_FIELDS, METABOLITE_FIELDS, rows, encode_json)
+
+def load_catalog_snapshot():
+    # The catalog file when it matches the database, otherwise a snapshot built in memory
+    path = app.config['CATALOG_FILE']
+    if path:
+        try:
+            catalog = catalog_mmap.MappedCatalog(path, encode_json, 'flask', catalog_fingerprint()[0])
+            # A file written by a version with other fields would serve them
+            if (catalog.fields, catalog.metabolite_fields) == (SUBSTANCE_FIELDS, METABOLITE_FIELDS):
+                return catalog
+            catalog.close()
+            raise ValueError(f'{path} was written with other substance or metabolite fields')
+        except (OSError, ValueError) as exc:
+            app.logger.warning('Not mapping the catalog file: %s; building the snapshot in memory', exc)
+    return build_catalog_snapshot()
+
+snapshot_loader = catalog_snapshot.SnapshotLoader(load_catalog_snapshot,
+                                                  app.config['CATALOG_SNAPSHOT'] or bool(app.config['CATALOG_FILE']))
+
+# Name and street name autocomplete, always served from memory
+def load_autocomplete_index():
+    return autocomplete.AutocompleteIndex(db.session.query(Substance.id, Substance.name, Substance.common_names))
+
+autocomplete_loader = catalog_snapshot.SnapshotLoader(load_autocomplete_index, enabled=True)
+
+# Substances and metabolites sorted by monoisotopic mass, for accurate-mass screening
+def load_mass_index():
+    substances = db.session.query(Substance.id, Substance.name, Substance.chemical_formula,
+                                  Substance.monoisotopic_mass).filter(Substance.monoisotopic_mass.isnot(None))
+    metabolites = db.session.query(Metabolite.id, Metabolite.name, Metabolite.chemical_formula,
+                                   Metabolite.monoisotopic_mass, Substance.id, Substance.name).join(
+        Substance, Substance.id == Metabolite.substance_id).filter(Metabolite.monoisotopic_mass.isnot(None))
+    entries = chain(
+        ((mass, {'kind': 'substance', 'id': substance_id, 'name': name, 'chemical_formula': chemical_formula,
+                 'monoisotopic_mass': mass})
+         for substance_id, name, chemical_formula, mass in substances),
+        ((mass, {'kind': 'metabolite', 'id': metabolite_id, 'name': name, 'chemical_formula': chemical_formula,
+                 'monoisotopic_mass': mass, 'substance_id': substance_id, 'substance_name': substance_name})
+         for metabolite_id, name, chemical_formula, mass, substance_id, substance_name in metabolites)
+    )
+    return mass_search.MassIndex(entries)
+
+mass_index_loader = catalog_snapshot.SnapshotLoader(load_mass_index, enabled=True)
+
+def detection_filter(args):
+    # detectable_in= and hours= as (matrix, hours), or None without either; raises ValueError
+    if not args.get('detectable_in') and not args.get('hours'):
+        return None
+    return durations.parse_detection_filter(args.get('detectable_in'), args.get('hours'))
+
+def threshold_filter(args):
+    # toxic_min= and toxic_max= in unit= (ng/mL by default) as ng/mL bounds, or None without either;
+    # raises ValueError
+    if not args.get('toxic_min') and not args.get('toxic_max'):
+        return None
+    return units.parse_threshold_filter(args.get('toxic_min') or None, args.get('toxic_max') or None,
+                                        args.get('unit'))
+
+def exact_filters(args):
+    # category=, name= and cas= as keyword arguments for the snapshot lookups
+    filters = {}
+    for param, field in (('category', 'category'), ('name', 'name'), ('cas', 'cas_number')):
+        if args.get(param):
+            filters[field] = args.get(param)
+    return filters
 
 # API Routes
 @app.route('/')
@@ -56,123 +475,430 @@ def index():
 
 @app.route('/api/substances')
 def get_substances():
-    category = request.args.get('category')
-    search = request.args.get('search')
+    try:
+        fields, include_metabolites = parse_projection(request.args)
+        detectable = detection_filter(request.args)
+        toxic_range = threshold_filter(request.args)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    
+    snapshot = snapshot_loader.get()
+    if snapshot is not None and not request.args.get('search') and detectable is None and toxic_range is None:
+        return snapshot_listing(snapshot, request.args, fields, include_metabolites)
+    
+    # Paged and streamed results walk the primary key instead of the search rank
+    if wants_ndjson():
+        query, _ = filtered_substance_query(request.args, fields, include_metabolites)
+        return Response(stream_with_context(
+            iter_substance_lines(query, fields, include_metabolites)), mimetype=NDJSON_MIMETYPE)
+    
+    return cached_json_response(lambda: substance_list_payload(request.args, fields, include_metabolites))
+
+def snapshot_listing(snapshot, args, fields, include_metabolites):
+    filters = exact_filters(args)
+    if wants_ndjson():
+        return Response(snapshot.ndjson_lines(fields, include_metabolites, **filters), mimetype=NDJSON_MIMETYPE)
+    
+    if 'limit' in args or 'after_id' in args:
+        after_id = args.get('after_id', 0, type=int)
+        limit = max(1, min(args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+        body = snapshot.page_body(fields, include_metabolites, after_id, limit, **filters)
+    else:
+        body = snapshot.listing_body(fields, include_metabolites, **filters)
+    return Response(body, mimetype='application/json')
+
+def filtered_substance_query(args, fields, include_metabolites):
+    # Returns the filtered query and the search rank column to order by, if any
+    search = args.get('search')
     
     query = Substance.query
+    rank = None
+    
+    for field, value in exact_filters(args).items():
+        query = query.filter(getattr(Substance, field) == value)
+    
+    detectable = detection_filter(args)
+    if detectable is not None:
+        # Still detectable `hours` after use: a window of the matrix that ends at or after it
+        matrix, hours = detectable
+        windows = db.session.query(DetectionWindow.substance_id)
+        if matrix is not None:
+            windows = windows.filter(DetectionWindow.matrix == matrix)
+        if hours is not None:
+            windows = windows.filter(DetectionWindow.max_hours >= hours)
+        query = query.filter(Substance.id.in_(windows))
     
-    if category:
-        query = query.filter(Substance.category == category)
+    toxic_range = threshold_filter(args)
+    if toxic_range is not None:
+        # Compared in ng/mL, whatever unit each substance's thresholds were published in
+        minimum, maximum = toxic_range
+        if minimum is not None:
+            query = query.filter(Substance.toxic_dose_ng_ml >= minimum)
+        if maximum is not None:
+            query = query.filter(Substance.toxic_dose_ng_ml <= maximum)
     
     if search:
-        query = query.filter(
-            Substance.name.contains(search) | 
-            Substance.common_names.contains(search) |
-            Substance.description.contains(search)
-        )
+        match = search_index.match_expression(search)
+        if match and fts_enabled():
+            ranked = text(
+                f"SELECT rowid AS substance_id, {search_index.rank_expression(FTS_TABLE)} AS rank "
+                f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+            ).bindparams(match=match).columns(substance_id=db.Integer, rank=db.Float).subquery()
+            query = query.join(ranked, Substance.id == ranked.c.substance_id)
+            rank = ranked.c.rank
+        else:
+            query = query.filter(
+                Substance.name.contains(search) | 
+                Substance.common_names.contains(search) |
+                Substance.description.contains(search)
+            )
     
+    return query.options(*projection_options(fields, include_metabolites)), rank
+
+def substance_list_payload(args, fields, include_metabolites):
+    query, rank = filtered_substance_query(args, fields, include_metabolites)
+    
+    if 'limit' in args or 'after_id' in args:
+        after_id = args.get('after_id', 0, type=int)
+        limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        
+        # Fetch one extra row to learn whether another page follows
+        substances = query.filter(Substance.id > after_id).order_by(Substance.id).limit(limit + 1).all()
+        next_cursor = substances[limit - 1].id if len(substances) > limit else None
+        
+        return {
+            'items': [substance_to_dict(s, fields, include_metabolites) for s in substances[:limit]],
+            'next_cursor': next_cursor
+        }
+    
+    if rank is not None:
+        query = query.order_by(rank)
     substances = query.all()
     
-    return jsonify([{
-        'id': s.id,
-        'name': s.name,
-        'common_names': s.common_names,
-        'chemical_formula': s.chemical_formula,
-        'cas_number': s.cas_number,
-        'category': s.category,
-        'description': s.description,
-        'mechanism_of_action': s.mechanism_of_action,
-        'therapeutic_dose_min': s.therapeutic_dose_min,
-        'therapeutic_dose_max': s.therapeutic_dose_max,
-        'toxic_dose': s.toxic_dose,
-        'lethal_dose': s.lethal_dose,
-        'dose_unit': s.dose_unit,
-        'half_life': s.half_life,
-        'detection_window': s.detection_window,
-        'metabolites': [{
-            'id': m.id,
-            'name': m.name,
-            'chemical_formula': m.chemical_formula,
-            'is_active': m.is_active,
-            'formation_pathway': m.formation_pathway,
-            'detection_significance': m.detection_significance,
-            'therapeutic_range_min': m.therapeutic_range_min,
-            'therapeutic_range_max': m.therapeutic_range_max,
-            'toxic_level': m.toxic_level,
-            'unit': m.unit
-        } for m in s.metabolites]
-    } for s in substances])
+    return [substance_to_dict(s, fields, include_metabolites) for s in substances]
+
+def iter_substance_lines(query, fields, include_metabolites, chunk_size=STREAM_CHUNK_SIZE):
+    # Keyset-paginate through the result so only one chunk is in memory at a time
+    after_id = 0
+    while True:
+        chunk = query.filter(Substance.id > after_id).order_by(Substance.id).limit(chunk_size).all()
+        if not chunk:
+            return
+        for s in chunk:
+            # Encoded like the snapshot's lines, so both paths serve the same bytes
+            yield encode_json(substance_to_dict(s, fields, include_metabolites))
+        after_id = chunk[-1].id
+        db.session.expunge_all()
 
 @app.route('/api/substances/<int:substance_id>')
 def get_substance_detail(substance_id):
-    substance = Substance.query.get_or_404(substance_id)
+    try:
+        fields, include_metabolites = parse_projection(request.args)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
     
-    return jsonify({
-        'id': substance.id,
-        'name': substance.name,
-        'common_names': substance.common_names,
-        'chemical_formula': substance.chemical_formula,
-        'cas_number': substance.cas_number,
-        'category': substance.category,
-        'description': substance.description,
-        'mechanism_of_action': substance.mechanism_of_action,
-        'therapeutic_dose_min': substance.therapeutic_dose_min,
-        'therapeutic_dose_max': substance.therapeutic_dose_max,
-        'toxic_dose': substance.toxic_dose,
-        'lethal_dose': substance.lethal_dose,
-        'dose_unit': substance.dose_unit,
-        'half_life': substance.half_life,
-        'detection_window': substance.detection_window,
-        'metabolites': [{
-            'id': m.id,
-            'name': m.name,
-            'chemical_formula': m.chemical_formula,
-            'is_active': m.is_active,
-            'formation_pathway': m.formation_pathway,
-            'detection_significance': m.detection_significance,
-            'therapeutic_range_min': m.therapeutic_range_min,
-            'therapeutic_range_max': m.therapeutic_range_max,
-            'toxic_level': m.toxic_level,
-            'unit': m.unit
-        } for m in substance.metabolites]
-    })
+    snapshot = snapshot_loader.get()
+    if snapshot is not None:
+        body = snapshot.substance_body(substance_id, fields, include_metabolites)
+        if body is None:
+            abort(404)
+        return Response(body, mimetype='application/json')
+    
+    def build():
+        query = Substance.query.options(load_only(*[getattr(Substance, field) for field in fields]))
+        substance = query.filter_by(id=substance_id).first_or_404()
+        return substance_to_dict(substance, fields, include_metabolites)
+    
+    return cached_json_response(build)
 
 @app.route('/api/categories')
 def get_categories():
-    categories = db.session.query(Substance.category).distinct().all()
-    return jsonify([cat[0] for cat in categories])
+    snapshot = snapshot_loader.get()
+    if snapshot is not None:
+        return Response(snapshot.categories_body, mimetype='application/json')
+    
+    def build():
+        categories = db.session.query(Substance.category).distinct().all()
+        return [cat[0] for cat in categories]
+    
+    return cached_json_response(build)
+
+@app.route('/api/autocomplete')
+def get_autocomplete():
+    # Not kept in the response cache: lookups are cheaper than the cache churn of one entry per keystroke
+    limit = max(1, min(request.args.get('limit', autocomplete.DEFAULT_LIMIT, type=int), autocomplete.MAX_LIMIT))
+    suggestions = autocomplete_loader.get().lookup(request.args.get('q', ''), limit)
+    return Response(encode_json(suggestions), mimetype='application/json')
+
+@app.route('/api/metabolites/search')
+def search_metabolites():
+    try:
+        name_keys, formula_keys = metabolite_search.parse_terms(request.args.getlist('name'),
+                                                                request.args.getlist('formula'))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    
+    def build():
+        # One query over the name and formula indexes for every detected metabolite
+        rows = db.session.query(
+            Substance.id, Substance.name, Substance.category,
+            Metabolite.id, Metabolite.name, Metabolite.chemical_formula, Metabolite.normalized_name
+        ).join(Metabolite, Metabolite.substance_id == Substance.id).filter(
+            Metabolite.normalized_name.in_(list(name_keys)) | Metabolite.chemical_formula.in_(list(formula_keys))
+        ).order_by(Metabolite.id)
+        return metabolite_search.rank_parents(rows, name_keys, formula_keys)
+    
+    return cached_json_response(build)
+
+@app.route('/api/search/mass', methods=['GET', 'POST'])
+def search_mass():
+    # GET takes a few repeated mz=; POST takes {"mz": [...], "ppm": ..., "adduct": ...} for whole peak lists
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        mz_values = data.get('mz')
+        mz_values = mz_values if isinstance(mz_values, list) else [mz_values] if mz_values is not None else []
+        ppm, adduct = data.get('ppm'), data.get('adduct')
+    else:
+        mz_values, ppm, adduct = request.args.getlist('mz'), request.args.get('ppm'), request.args.get('adduct')
+    
+    try:
+        mz_values, ppm, adduct = mass_search.parse_request(mz_values, ppm, adduct)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    
+    # Not kept in the response cache: peak lists rarely repeat
+    results = mass_index_loader.get().screen(mz_values, ppm, adduct)
+    return Response(encode_json({'adduct': adduct, 'ppm': ppm, 'results': results}), mimetype='application/json')
+
+@app.route('/api/cache-stats')
+def get_cache_stats():
+    return jsonify(response_cache.stats())
+
+# Dose interpretation
+def validate_level(measured_level, unit):
+    # The measured level and unit of a single or batch measurement; raises ValueError with the error to return
+    is_number = isinstance(measured_level, (int, float)) and not isinstance(measured_level, bool)
+    if not is_number or not math.isfinite(measured_level):
+        raise ValueError('measured_level must be a finite number')
+    if unit is not None and not isinstance(unit, str):
+        raise ValueError('unit must be a string')
+
+def dose_analysis(thresholds, measured_level, unit=None):
+    # `thresholds` is a read_model.Thresholds row. A measurement without a unit is in the substance's
+    # dose_unit; raises ValueError for units that cannot be converted
+    unit = unit or thresholds.unit
+    return {
+        'substance_name': thresholds.name,
+        'measured_level': measured_level,
+        'unit': unit,
+        'interpretation': thresholds.classify(units.convert(measured_level, unit, thresholds.unit))
+    }
 
 @app.route('/api/dose-analysis', methods=['POST'])
 def analyze_dose():
-    data = request.get_json()
-    substance_id = data.get('substance_id')
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
     measured_level = data.get('measured_level')
+    unit = data.get('unit')
+    # Ids sent as strings of digits, e.g. from a form, are looked up like numbers
+    try:
+        substance_id = read_model.parse_id(data.get('substance_id'))
+    except ValueError:
+        return jsonify({'error': 'substance_id must be an integer'}), 400
+    try:
+        validate_level(measured_level, unit)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
     
-    substance = Substance.query.get_or_404(substance_id)
+    thresholds = threshold_tables()['substance'].get(substance_id)
+    if thresholds is None:
+        abort(404)
     
-    analysis = {
-        'substance_name': substance.name,
-        'measured_level': measured_level,
-        'unit': substance.dose_unit,
-        'interpretation': 'Unknown'
+    try:
+        return jsonify(dose_analysis(thresholds, measured_level, unit))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+# Columnar thresholds of the whole catalog and their classifiers, rebuilt on first use after a catalog change
+dose_thresholds = {}
+
+def threshold_tables():
+    tables = dose_thresholds.get('tables')
+    if tables is not None:
+        return tables
+    
+    generation = response_cache.generation
+    # Streamed in id order into the columns, never held as rows
+    substances = db.session.query(Substance.id, Substance.name, Substance.dose_unit, Substance.category,
+                                  Substance.therapeutic_dose_min, Substance.therapeutic_dose_max,
+                                  Substance.toxic_dose, Substance.lethal_dose).order_by(Substance.id)
+    metabolites = db.session.query(Metabolite.id, Metabolite.name, Metabolite.unit,
+                                   Metabolite.therapeutic_range_min, Metabolite.therapeutic_range_max,
+                                   Metabolite.toxic_level).order_by(Metabolite.id)
+    tables = {
+        'substance': read_model.ThresholdTable(substances.yield_per(10000)),
+        # Metabolites have no category and no lethal threshold
+        'metabolite': read_model.ThresholdTable((m[0], m[1], m[2], None, m[3], m[4], m[5], None)
+                                                for m in metabolites.yield_per(10000))
     }
+    if generation == response_cache.generation:
+        dose_thresholds['tables'] = tables
+    return tables
+
+def threshold_classifiers():
+    classifiers = dose_thresholds.get('classifiers')
+    if classifiers is not None:
+        return classifiers
     
-    if substance.therapeutic_dose_min and substance.therapeutic_dose_max:
-        if measured_level < substance.therapeutic_dose_min:
-            analysis['interpretation'] = 'Sub-therapeutic'
-        elif measured_level <= substance.therapeutic_dose_max:
-            analysis['interpretation'] = 'Therapeutic range'
-        elif substance.toxic_dose and measured_level < substance.toxic_dose:
-            analysis['interpretation'] = 'Above therapeutic, potentially toxic'
-        elif substance.toxic_dose and measured_level >= substance.toxic_dose:
-            if substance.lethal_dose and measured_level >= substance.lethal_dose:
-                analysis['interpretation'] = 'Potentially lethal'
-            else:
-                analysis['interpretation'] = 'Toxic range'
-    
-    return jsonify(analysis)
+    generation = response_cache.generation
+    classifiers = {kind: dose_classifier.ThresholdClassifier(table) for kind, table in threshold_tables().items()}
+    if generation == response_cache.generation:
+        dose_thresholds['classifiers'] = classifiers
+    return classifiers
+
+def read_measurements():
+    # Accepts a JSON array, {"measurements": [...]}, or one JSON object per line (NDJSON);
+    # undecodable NDJSON lines become per-item errors instead of failing the batch
+    if request.mimetype == NDJSON_MIMETYPE:
+        items = []
+        for line in request.stream:
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    items.append(None)
+        return items
+    
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('measurements')
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON array of measurements')
+    return data
+
+def validate_measurement(item):
+    # Returns (kind, id, measured_level, unit) or raises ValueError with the per-item error
+    if not isinstance(item, dict):
+        raise ValueError('Measurement must be a JSON object')
+    kind = 'metabolite' if 'metabolite_id' in item else 'substance'
+    item_id = item.get(f'{kind}_id')
+    measured_level = item.get('measured_level')
+    if not isinstance(item_id, int) or isinstance(item_id, bool):
+        raise ValueError('substance_id or metabolite_id must be an integer')
+    if not -2 ** 63 <= item_id < 2 ** 63:
+        raise ValueError('substance_id or metabolite_id is out of range')
+    unit = item.get('unit')
+    validate_level(measured_level, unit)
+    if unit is not None:
+        units.factor(unit)
+    return kind, item_id, measured_level, unit
+
+@app.route('/api/dose-analysis/batch', methods=['POST'])
+def analyze_dose_batch():
+    try:
+        items = read_measurements()
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    
+    measurements = []
+    for item in items:
+        try:
+            measurements.append(validate_measurement(item))
+        except ValueError as exc:
+            measurements.append(exc)
+    
+    # Classify all measurements of each kind in one vectorized pass
+    classifiers = threshold_classifiers()
+    classified = {}
+    for kind, classifier in classifiers.items():
+        batch = [(index, m[1], m[2], m[3]) for index, m in enumerate(measurements)
+                 if isinstance(m, tuple) and m[0] == kind]
+        if batch:
+            indexes, ids, levels, measured_units = zip(*batch)
+            levels = list(levels)
+            # Measurements with a unit are converted to the unit of the thresholds they are compared with
+            for i, position in enumerate(classifier.positions(ids).tolist()):
+                unit = measured_units[i]
+                if unit is not None and position >= 0:
+                    try:
+                        levels[i] = units.convert(levels[i], unit, classifier.table.units[position])
+                    except ValueError:
+                        measurements[indexes[i]] = ValueError(
+                            f'Cannot convert {unit} to the {kind} unit {classifier.table.units[position]}')
+            positions, codes = classifier.classify(ids, levels)
+            classified.update(zip(indexes, zip(positions.tolist(), codes.tolist())))
+    
+    def analyses():
+        for index, measurement in enumerate(measurements):
+            if isinstance(measurement, ValueError):
+                yield {'index': index, 'error': str(measurement)}
+                continue
+            kind, item_id, measured_level, unit = measurement
+            position, code = classified[index]
+            if position < 0:
+                yield {'index': index, f'{kind}_id': item_id, 'error': f'{kind.capitalize()} not found'}
+                continue
+            table = classifiers[kind].table
+            yield {
+                f'{kind}_name': table.name(position),
+                'measured_level': measured_level,
+                'unit': unit or table.units[position],
+                'interpretation': dose_classifier.LABELS[code],
+                'index': index,
+                f'{kind}_id': item_id
+            }
+    
+    if wants_ndjson():
+        return Response(stream_with_context(json.dumps(result) + '\n' for result in analyses()),
+                        mimetype=NDJSON_MIMETYPE)
+    
+    results = list(analyses())
+    return jsonify({
+        'count': len(results),
+        'errors': sum(1 for result in results if 'error' in result),
+        'results': results
+    })
+
+@app.cli.command('load-reference-data')
+@click.argument('substances_file', required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option('--metabolites', 'metabolites_file', type=click.Path(exists=True, dir_okay=False),
+              help='Metabolites file; rows name their parent in a substance_name column.')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='Input format (default: from the file extension).')
+@click.option('--chunk-size', default=1000, show_default=True, type=click.IntRange(min=1),
+              help='Rows committed per transaction.')
+@click.option('--restart', is_flag=True, help='Ignore saved progress and read the files from the start.')
+def load_reference_data_command(substances_file, metabolites_file, file_format, chunk_size, restart):
+    """Stream substances and metabolites from CSV or JSON Lines files into the catalog."""
+    # Imported here because the loader builds on this module
+    import reference_data
+    if not substances_file and not metabolites_file:
+        raise click.UsageError('Give a substances file, a --metabolites file, or both.')
+    db.create_all()
+    reference_data.load_reference_data(substances_file, metabolites_file, file_format, chunk_size, restart)
+
+def build_catalog_caches():
+    # Build the snapshot, the in-memory indexes and the catalog version at boot rather than on the
+    # first request; under a preforking server, once before the fork (see wsgi.py)
+    catalog_version.etag()
+    snapshot_loader.get()
+    autocomplete_loader.get()
+    mass_index_loader.get()
+    threshold_classifiers()
+
+@app.cli.command('export-catalog')
+@click.argument('path', type=click.Path(dir_okay=False))
+def export_catalog_command(path):
+    """Write the catalog to a binary file that workers map with CATALOG_FILE."""
+    catalog_mmap.write(path, build_catalog_snapshot(), 'flask', catalog_fingerprint()[0])
+    click.echo(f'Catalog written to {path} ({os.path.getsize(path) / 1024:,.0f} KiB)')
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        build_catalog_caches()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,401 @@
+"""
+ASGI entry point for the read API of the Flask application
+
+Serves `/api/substances`, `/api/substances/<id>`, `/api/categories` and
+`/api/dose-analysis` from coroutines, with the same queries, snapshot,
+response cache, validators and compression as app.py:
+
+    uvicorn asgi:app --workers 4
+
+SQLite work runs in a bounded thread pool, each call in its own application
+context and session, so the event loop never waits on the database. Bodies
+are sent in SEND_CHUNK_BYTES pieces and NDJSON listings one keyset page at a
+time, so a slow client holds a suspended coroutine rather than a worker or a
+database connection, and a stream stops querying once its client is gone.
+The page, static files and the other endpoints stay on the WSGI app.
+"""
+
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qsl
+
+from sqlalchemy.orm import load_only
+from werkzeug.datastructures import Headers, MIMEAccept, MultiDict
+from werkzeug.http import parse_accept_header
+
+import app as flask_app
+import compression
+import http_cache
+import read_model
+
+# Threads running SQLite queries; more only queue on SQLite's locks
+DB_THREADS = int(os.environ.get('ASGI_DB_THREADS', 8))
+# Body bytes per ASGI message, so the server can apply backpressure to slow clients
+SEND_CHUNK_BYTES = 64 * 1024
+
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='asgi-db')
+
+
+class Request:
+    """The parts of an ASGI HTTP scope the handlers read"""
+
+    def __init__(self, scope, receive):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+        self.headers = Headers([(name.decode('latin-1'), value.decode('latin-1'))
+                                for name, value in scope['headers']])
+        self.receive = receive
+
+    @property
+    def wants_ndjson(self):
+        accept = parse_accept_header(self.headers.get('Accept'), MIMEAccept)
+        return accept.best_match(['application/json', flask_app.NDJSON_MIMETYPE]) == flask_app.NDJSON_MIMETYPE
+
+    @property
+    def encoding(self):
+        return compression.negotiate(self.headers.get('Accept-Encoding'))
+
+    async def body(self):
+        chunks = []
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    async def wait_for_disconnect(self):
+        while (await self.receive())['type'] != 'http.disconnect':
+            pass
+
+
+def in_app_context(func, *args):
+    with flask_app.app.app_context():
+        return func(*args)
+
+
+async def run_in_app(func, *args):
+    # Every call gets its own application context, and so its own session, removed on exit
+    return await asyncio.get_running_loop().run_in_executor(db_executor, partial(in_app_context, func, *args))
+
+
+def catalog_state(variant):
+    # The catalog version and the snapshot both query the database on first use after a change,
+    # including changes written by other processes
+    flask_app.check_catalog_revision()
+    generation = flask_app.response_cache.generation
+    headers = http_cache.validator_headers(flask_app.catalog_version, variant, flask_app.app.config['CATALOG_MAX_AGE'])
+    return headers, flask_app.snapshot_loader.get(), generation
+
+
+def encoded_payload(build):
+    payload = build()
+    return None if payload is None else flask_app.encode_json(payload)
+
+
+def substance_lines(args, fields, include_metabolites, after_id):
+    # One keyset page of the NDJSON listing, and the id to continue after or None at the end
+    query, _ = flask_app.filtered_substance_query(args, fields, include_metabolites)
+    chunk = query.filter(flask_app.Substance.id > after_id).order_by(
+        flask_app.Substance.id).limit(flask_app.STREAM_CHUNK_SIZE).all()
+    body = b''.join(flask_app.encode_json(flask_app.substance_to_dict(s, fields, include_metabolites))
+                    for s in chunk)
+    return body, chunk[-1].id if len(chunk) == flask_app.STREAM_CHUNK_SIZE else None
+
+
+def substance_detail(substance_id, fields, include_metabolites):
+    query = flask_app.Substance.query.options(load_only(*[getattr(flask_app.Substance, field) for field in fields]))
+    substance = query.filter_by(id=substance_id).first()
+    return None if substance is None else flask_app.substance_to_dict(substance, fields, include_metabolites)
+
+
+def categories():
+    return [category for category, in flask_app.db.session.query(flask_app.Substance.category).distinct()]
+
+
+def analyze_dose(substance_id, measured_level, unit):
+    # None for an unknown substance; raises ValueError for units that cannot be converted
+    flask_app.check_catalog_revision()
+    thresholds = flask_app.threshold_tables()['substance'].get(substance_id)
+    return None if thresholds is None else flask_app.dose_analysis(thresholds, measured_level, unit)
+
+
+async def start_response(send, status, content_type=None, headers=None, length=None):
+    headers = dict(headers or {})
+    # Same as Flask-CORS on the WSGI app
+    headers['Access-Control-Allow-Origin'] = '*'
+    if content_type:
+        headers['Content-Type'] = content_type
+    if length is not None:
+        headers['Content-Length'] = str(length)
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in headers.items()]})
+
+
+async def send_body(send, body, status=200, content_type='application/json', headers=None):
+    await start_response(send, status, content_type, headers, len(body))
+    for offset in range(0, len(body), SEND_CHUNK_BYTES):
+        await send({'type': 'http.response.body', 'body': body[offset:offset + SEND_CHUNK_BYTES],
+                    'more_body': offset + SEND_CHUNK_BYTES < len(body)})
+    if not body:
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+async def send_json(send, payload, status=200):
+    await send_body(send, flask_app.encode_json(payload), status)
+
+
+async def send_catalog_body(request, send, body, headers, key, generation):
+    """Send a catalog JSON body, compressed if the client accepts it.
+
+    The compressed body is kept next to the plain one in the response cache,
+    as the WSGI app does, so it is compressed once per catalog version.
+    """
+    encoding = request.encoding
+    if encoding is None or len(body) < compression.MIN_SIZE:
+        await send_body(send, body, headers=headers)
+        return
+
+    compressed = flask_app.response_cache.get((key, encoding))
+    if compressed is None:
+        compressed = await asyncio.get_running_loop().run_in_executor(
+            None, compression.compress, body, encoding)
+        flask_app.response_cache.put((key, encoding), compressed, generation)
+    headers = http_cache.coded_headers(headers, encoding)
+    await send_body(send, compressed, headers=dict(headers, **{'Content-Encoding': encoding}))
+
+
+async def send_stream(request, send, chunks, headers):
+    """Send an NDJSON body from an async iterator of byte chunks, until it ends or the client leaves"""
+    encoding = request.encoding
+    compressor = compression.StreamCompressor(encoding) if encoding else None
+    if encoding:
+        headers = dict(http_cache.coded_headers(headers, encoding), **{'Content-Encoding': encoding})
+    await start_response(send, 200, flask_app.NDJSON_MIMETYPE, headers)
+
+    disconnected = asyncio.ensure_future(request.wait_for_disconnect())
+    try:
+        async for chunk in chunks:
+            if disconnected.done():
+                return
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': compressor.finish() if compressor else b''})
+    finally:
+        disconnected.cancel()
+
+
+async def snapshot_lines(lines):
+    # Snapshot lines are already encoded; send them in SEND_CHUNK_BYTES batches
+    batch, size = [], 0
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if size >= SEND_CHUNK_BYTES:
+            yield b''.join(batch)
+            batch, size = [], 0
+    if batch:
+        yield b''.join(batch)
+
+
+async def queried_lines(args, fields, include_metabolites):
+    after_id = 0
+    while after_id is not None:
+        body, after_id = await run_in_app(substance_lines, args, fields, include_metabolites, after_id)
+        if body:
+            yield body
+
+
+async def catalog_read(request, send):
+    """Validators, snapshot and response cache state for a catalog read, or None once a 304 was sent"""
+    variant = 'ndjson' if request.wants_ndjson else 'json'
+    headers, snapshot, generation = await run_in_app(catalog_state, variant)
+    not_modified = http_cache.not_modified_headers(request.headers, headers, request.encoding,
+                                                   flask_app.catalog_version.last_modified)
+    if not_modified is not None:
+        await start_response(send, 304, headers=not_modified)
+        await send({'type': 'http.response.body', 'body': b''})
+        return None
+    return headers, snapshot, generation
+
+
+async def send_cached_json(request, send, headers, generation, build):
+    # Pre-encoded JSON for repeated reads; build() only runs, off the loop, on a cache miss
+    key = http_cache.cache_key(request.path, request.args.items(multi=True))
+    body = flask_app.response_cache.get(key)
+    if body is None:
+        body = await run_in_app(encoded_payload, build)
+        if body is None:
+            await send_json(send, {'error': 'Substance not found'}, 404)
+            return
+        flask_app.response_cache.put(key, body, generation)
+    await send_catalog_body(request, send, body, headers, key, generation)
+
+
+async def get_substances(request, send):
+    args = request.args
+    try:
+        fields, include_metabolites = flask_app.parse_projection(args)
+        detectable = flask_app.detection_filter(args)
+        toxic_range = flask_app.threshold_filter(args)
+    except ValueError as exc:
+        await send_json(send, {'error': str(exc)}, 400)
+        return
+
+    state = await catalog_read(request, send)
+    if state is None:
+        return
+    headers, snapshot, generation = state
+    key = http_cache.cache_key(request.path, args.items(multi=True))
+
+    if snapshot is not None and not args.get('search') and detectable is None and toxic_range is None:
+        filters = flask_app.exact_filters(args)
+        if request.wants_ndjson:
+            await send_stream(request, send,
+                              snapshot_lines(snapshot.ndjson_lines(fields, include_metabolites, **filters)), headers)
+        elif 'limit' in args or 'after_id' in args:
+            after_id = args.get('after_id', 0, type=int)
+            limit = max(1, min(args.get('limit', flask_app.DEFAULT_PAGE_SIZE, type=int), flask_app.MAX_PAGE_SIZE))
+            body = snapshot.page_body(fields, include_metabolites, after_id, limit, **filters)
+            await send_catalog_body(request, send, body, headers, key, generation)
+        else:
+            body = snapshot.listing_body(fields, include_metabolites, **filters)
+            await send_catalog_body(request, send, body, headers, key, generation)
+        return
+
+    if request.wants_ndjson:
+        await send_stream(request, send, queried_lines(args, fields, include_metabolites), headers)
+        return
+    await send_cached_json(request, send, headers, generation,
+                           partial(flask_app.substance_list_payload, args, fields, include_metabolites))
+
+
+async def get_substance_detail(request, send, substance_id):
+    try:
+        fields, include_metabolites = flask_app.parse_projection(request.args)
+    except ValueError as exc:
+        await send_json(send, {'error': str(exc)}, 400)
+        return
+
+    state = await catalog_read(request, send)
+    if state is None:
+        return
+    headers, snapshot, generation = state
+
+    if snapshot is not None:
+        body = snapshot.substance_body(substance_id, fields, include_metabolites)
+        if body is None:
+            await send_json(send, {'error': 'Substance not found'}, 404)
+            return
+        key = http_cache.cache_key(request.path, request.args.items(multi=True))
+        await send_catalog_body(request, send, body, headers, key, generation)
+        return
+    await send_cached_json(request, send, headers, generation,
+                           partial(substance_detail, substance_id, fields, include_metabolites))
+
+
+async def get_categories(request, send):
+    state = await catalog_read(request, send)
+    if state is None:
+        return
+    headers, snapshot, generation = state
+    if snapshot is not None:
+        await send_catalog_body(request, send, snapshot.categories_body, headers,
+                                http_cache.cache_key(request.path, ()), generation)
+        return
+    await send_cached_json(request, send, headers, generation, categories)
+
+
+async def post_dose_analysis(request, send):
+    try:
+        data = json.loads(await request.body())
+        substance_id = data.get('substance_id')
+        measured_level = data.get('measured_level')
+        unit = data.get('unit')
+    except (ValueError, AttributeError):
+        await send_json(send, {'error': 'Expected a JSON object'}, 400)
+        return
+    try:
+        substance_id = read_model.parse_id(substance_id)
+    except ValueError:
+        await send_json(send, {'error': 'substance_id must be an integer'}, 400)
+        return
+    try:
+        flask_app.validate_level(measured_level, unit)
+    except ValueError as exc:
+        await send_json(send, {'error': str(exc)}, 400)
+        return
+
+    try:
+        result = await run_in_app(analyze_dose, substance_id, measured_level, unit)
+    except ValueError as exc:
+        await send_json(send, {'error': str(exc)}, 400)
+        return
+    if result is None:
+        await send_json(send, {'error': 'Substance not found'}, 404)
+        return
+    await send_json(send, result)
+
+
+def route(path):
+    """The handler for a path with its extra arguments and allowed methods, or None"""
+    if path == '/api/substances':
+        return get_substances, (), ('GET', 'HEAD')
+    if path.startswith('/api/substances/') and path[len('/api/substances/'):].isdigit():
+        return get_substance_detail, (int(path[len('/api/substances/'):]),), ('GET', 'HEAD')
+    if path == '/api/categories':
+        return get_categories, (), ('GET', 'HEAD')
+    if path == '/api/dose-analysis':
+        return post_dose_analysis, (), ('POST',)
+    return None
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Build the snapshot, the catalog version and the dose thresholds at boot rather than on the first request
+            await run_in_app(catalog_state, 'json')
+            await run_in_app(flask_app.threshold_tables)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            db_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    request = Request(scope, receive)
+    found = route(request.path)
+    if found is None:
+        await send_json(send, {'error': 'Not found'}, 404)
+        return
+    handler, handler_args, methods = found
+    if request.method == 'OPTIONS':
+        # CORS preflight for the JSON POST
+        await start_response(send, 200, headers={
+            'Allow': ', '.join(methods), 'Access-Control-Allow-Methods': ', '.join(methods),
+            'Access-Control-Allow-Headers': request.headers.get('Access-Control-Request-Headers', '')
+        }, length=0)
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    if request.method not in methods:
+        await send_body(send, flask_app.encode_json({'error': 'Method not allowed'}), 405,
+                        headers={'Allow': ', '.join(methods)})
+        return
+    await handler(request, send, *handler_args)
@@ -0,0 +1,184 @@
+"""
+Prefix and typo-tolerant autocomplete over substance and street names
+
+The index holds every substance name and each of its comma-separated common
+names as folded keys in one sorted list, also starting from every later word
+("acid diethylamide" for "Lysergic acid diethylamide"). Folding lowercases,
+drops accents and punctuation, and merges common spelling variants (ph/f,
+th/t, y/i, c/k) and doubled letters, so "metamfetamine" is a plain prefix of
+the key of "Methamphetamine".
+
+Prefix matches are a bisect into the sorted keys. A query with one typo (a
+missing, extra or wrong character, or two swapped neighbours) is a prefix match
+for the query with that typo undone, so the typo search looks for those
+corrected prefixes. Typos in the first 7 characters go through a SymSpell-style
+deletion index: every key prefix of 4 to 7 characters is stored under itself
+and each of its one-character deletions, so the deletions of the query's first
+characters find the indexed prefixes one edit away without scanning the keys.
+Typos further on are tried position by position, with the characters that can
+follow the query up to that position read off the sorted keys.
+"""
+
+import bisect
+import re
+import unicodedata
+
+# Spellings merged by fold(), applied in order
+SPELLING_VARIANTS = (('ph', 'f'), ('th', 't'), ('y', 'i'), ('c', 'k'))
+
+# Queries shorter than this only get prefix matches
+MIN_FUZZY_LENGTH = 4
+# Key prefixes longer than this are not in the deletion index
+PREFIX_LENGTH = 7
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+_SEPARATOR_RE = re.compile(r'[^0-9a-z]+')
+_REPEAT_RE = re.compile(r'([a-z])\1+')
+
+
+def fold(text):
+    """The index key of a name or query: lowercase ASCII words with spelling variants merged"""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    text = _SEPARATOR_RE.sub(' ', text).strip()
+    for variant, replacement in SPELLING_VARIANTS:
+        text = text.replace(variant, replacement)
+    return _REPEAT_RE.sub(r'\1', text)
+
+
+def deletions(text):
+    """`text` and every string one deleted character away from it"""
+    return {text} | {text[:i] + text[i + 1:] for i in range(len(text))}
+
+
+def one_swap_or_substitution(a, b):
+    """Whether strings of the same length differ in one character or in two swapped neighbours"""
+    differences = [i for i in range(len(a)) if a[i] != b[i]]
+    if len(differences) == 1:
+        return True
+    if len(differences) != 2 or differences[1] != differences[0] + 1:
+        return False
+    first, second = differences
+    return a[first] == b[second] and a[second] == b[first]
+
+
+class AutocompleteIndex:
+    """Sorted folded keys of every name, with a deletion index over their first characters.
+
+    `entries` yields `(substance_id, name, common_names)` rows, where
+    `common_names` is the comma-separated text stored on the substance.
+    """
+
+    def __init__(self, entries):
+        terms = set()
+        substance_ids = set()
+        for substance_id, name, common_names in entries:
+            substance_ids.add(substance_id)
+            labels = [name] + [alias.strip() for alias in (common_names or '').split(',') if alias.strip()]
+            for label in labels:
+                words = fold(label).split(' ')
+                for start in range(len(words)):
+                    key = ' '.join(words[start:])
+                    if key:
+                        terms.add((key, name, substance_id, label))
+
+        terms = sorted(terms)
+        self.keys = [term[0] for term in terms]
+        self._terms = [term[1:] for term in terms]
+        self.substance_count = len(substance_ids)
+
+        prefixes = {key[:length] for key in self.keys
+                    for length in range(MIN_FUZZY_LENGTH, min(len(key), PREFIX_LENGTH) + 1)}
+        self._deletes = {}
+        for prefix in prefixes:
+            for deletion in deletions(prefix):
+                self._deletes.setdefault(deletion, []).append(prefix)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _key_range(self, prefix, start=0, stop=None):
+        """Indexes of the keys starting with `prefix`"""
+        stop = len(self.keys) if stop is None else stop
+        # Folded keys are ASCII, so this sorts after every key starting with `prefix`
+        return range(bisect.bisect_left(self.keys, prefix, start, stop),
+                     bisect.bisect_left(self.keys, prefix + '\uffff', start, stop))
+
+    def _next_chars(self, prefix, keys):
+        """The characters following `prefix` in the keys of the range `keys`, which all start with it"""
+        index = keys.start
+        while index < keys.stop:
+            key = self.keys[index]
+            if len(key) == len(prefix):
+                index += 1
+                continue
+            yield key[len(prefix)]
+            index = self._key_range(key[:len(prefix) + 1], index, keys.stop).stop
+
+    def _suggest(self, found, index, fuzzy):
+        name, substance_id, label = self._terms[index]
+        if substance_id not in found:
+            found[substance_id] = {'id': substance_id, 'name': name, 'matched': label, 'fuzzy': fuzzy}
+
+    def lookup(self, query, limit=DEFAULT_LIMIT):
+        """Up to `limit` suggestions for what the user typed, one per substance.
+
+        Keys starting with the folded query come first, in key order, then keys
+        starting with the query with one typo corrected.
+        """
+        key = fold(query)
+        found = {}
+        if not key:
+            return []
+
+        for index in self._key_range(key):
+            if len(found) >= limit:
+                break
+            self._suggest(found, index, False)
+
+        if len(found) < limit and len(key) >= MIN_FUZZY_LENGTH:
+            corrected = self._corrections_in_head(key) | self._corrections_after_head(key)
+            for prefix in sorted(corrected):
+                if prefix.startswith(key):
+                    # Already offered as prefix matches
+                    continue
+                for index in self._key_range(prefix):
+                    if len(found) >= limit:
+                        return list(found.values())
+                    self._suggest(found, index, True)
+        return list(found.values())
+
+    def _corrections_in_head(self, key):
+        """Key prefixes that are `key` with one typo in its first PREFIX_LENGTH characters undone"""
+        head, tail = key[:PREFIX_LENGTH], key[PREFIX_LENGTH:]
+        corrected = set()
+        for deletion in deletions(head):
+            for prefix in self._deletes.get(deletion, ()):
+                if len(prefix) != len(head):
+                    # One character more or less than the query: it is a deletion of the other
+                    corrected.add(prefix + tail)
+                    continue
+                if one_swap_or_substitution(head, prefix):
+                    corrected.add(prefix + tail)
+                if len(prefix) == PREFIX_LENGTH and head[:-1] in deletions(prefix):
+                    # A missing character pushed the last one of the head out of the indexed prefix
+                    corrected.add(prefix + key[PREFIX_LENGTH - 1:])
+        return corrected
+
+    def _corrections_after_head(self, key):
+        """Key prefixes that are `key` with one typo past its first PREFIX_LENGTH characters undone"""
+        corrected = set()
+        # The swap of the characters on either side of the head boundary is not in the head
+        for position in range(PREFIX_LENGTH - 1, len(key)):
+            start, rest = key[:position], key[position + 1:]
+            keys = self._key_range(start)
+            if not keys:
+                # A typo this late would leave `start` a prefix of some key
+                break
+            corrected.add(start + rest)
+            if rest:
+                corrected.add(start + rest[0] + key[position] + rest[1:])
+            for char in self._next_chars(start, keys):
+                corrected.add(start + char + rest)
+                corrected.add(start + char + key[position:])
+        return corrected
@@ -0,0 +1,894 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the Forensic Toxicology Database
+
+Each benchmark builds its own synthetic catalog in a temporary directory, so
+the real database is never touched.
+
+Usage:
+    python3 benchmark.py search [--substances 100000]
+    python3 benchmark.py dose-batch [--sizes 1000 10000 100000]
+    python3 benchmark.py load [--configs 1x1 1x8 2x8 4x8] [--clients 32]
+    python3 benchmark.py bulk-load [--sizes 10000 100000 1000000]
+    python3 benchmark.py snapshot [--substances 20000]
+    python3 benchmark.py autocomplete [--substances 100000]
+    python3 benchmark.py compression [--substances 20000]
+    python3 benchmark.py mass [--substances 100000] [--peaks 1000 10000]
+    python3 benchmark.py serving [--connections 1000] [--workers 4]
+    python3 benchmark.py gunicorn [--configs 1x1 2x1 4x1 1x8 2x8 4x8] [--clients 64]
+    python3 benchmark.py catalog-file [--substances 20000] [--workers 4]
+    python3 benchmark.py read-model [--metabolites 1000000]
+"""
+
+import argparse
+import asyncio
+import string
+import http.client
+import json
+import math
+import os
+import random
+import resource
+import signal
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import autocomplete
+import catalog_mmap
+import compression
+import mass_search
+import read_model
+import simple_app
+
+SYLLABLES = ['meth', 'amph', 'eta', 'mine', 'cod', 'eine', 'mor', 'phine', 'fen', 'tan', 'yl',
+             'diaz', 'epam', 'oxa', 'zep', 'keta', 'lor', 'caine', 'benz', 'oyl', 'ecg', 'onine',
+             'tram', 'adol', 'bup', 'reno', 'rphine', 'cath', 'inone', 'mdma', 'xyl', 'azine']
+WORDS = ['potent', 'opioid', 'stimulant', 'receptor', 'agonist', 'antagonist', 'hepatic', 'renal',
+         'metabolite', 'overdose', 'sedative', 'analgesic', 'dopamine', 'serotonin', 'reuptake',
+         'inhibitor', 'synthetic', 'derivative', 'clinical', 'forensic', 'toxicity', 'plasma',
+         'urine', 'detection', 'window', 'glucuronide', 'oxidation', 'hydrolysis', 'esterase']
+STREET_NAMES = ['Ice', 'Crystal', 'Snow', 'Blow', 'Molly', 'Spice', 'K2', 'Smack', 'Dope', 'Tabs',
+                'Bars', 'Blues', 'Percs', 'Lean', 'Special K', 'Bath Salts', 'Flakka', 'China White']
+CATEGORIES = ['pharmaceutical', 'narcotic', 'synthetic']
+
+
+def synthetic_name(rng, index):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize() + f'-{index}'
+
+
+def synthetic_text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def synthetic_substances(count, seed=42):
+    """Yield substance rows in the column order used by simple_app.init_database"""
+    rng = random.Random(seed)
+    for index in range(count):
+        tmin = round(rng.uniform(0.001, 10.0), 3)
+        yield (synthetic_name(rng, index), ', '.join(rng.sample(STREET_NAMES, 3)),
+               f'C{rng.randint(5, 40)}H{rng.randint(5, 60)}NO{rng.randint(1, 8)}',
+               f'{rng.randint(10, 99999)}-{rng.randint(10, 99)}-{rng.randint(0, 9)}',
+               rng.choice(CATEGORIES), synthetic_text(rng, 20), synthetic_text(rng, 15),
+               tmin, tmin * 2, tmin * 10, tmin * 40, 'mg/L', '2-6 hours',
+               'Urine: 1-3 days, Blood: 6-12 hours')
+
+
+def synthetic_metabolites(substance_count, per_substance=2, seed=7):
+    """Yield metabolite rows in the column order used by simple_app.init_database"""
+    rng = random.Random(seed)
+    for substance_id in range(1, substance_count + 1):
+        for _ in range(per_substance):
+            yield (substance_id, synthetic_name(rng, substance_id) + ' glucuronide',
+                   f'C{rng.randint(5, 40)}H{rng.randint(5, 60)}NO{rng.randint(1, 8)}',
+                   rng.randint(0, 1), synthetic_text(rng, 6), synthetic_text(rng, 8),
+                   None, None, round(rng.uniform(0.01, 5.0), 3), 'ng/mL')
+
+
+SUBSTANCE_COLUMNS = ('name', 'common_names', 'chemical_formula', 'cas_number', 'category', 'description',
+                     'mechanism_of_action', 'therapeutic_dose_min', 'therapeutic_dose_max', 'toxic_dose',
+                     'lethal_dose', 'dose_unit', 'half_life', 'detection_window')
+METABOLITE_COLUMNS = ('name', 'chemical_formula', 'is_active', 'formation_pathway', 'detection_significance',
+                      'therapeutic_range_min', 'therapeutic_range_max', 'toxic_level', 'unit')
+
+
+def synthetic_catalog(count, per_substance=2):
+    """Yield substance dicts with nested metabolites, as taken by init_database.bulk_load"""
+    metabolites = synthetic_metabolites(count, per_substance)
+    for values in synthetic_substances(count):
+        substance = dict(zip(SUBSTANCE_COLUMNS, values))
+        substance['metabolites'] = [dict(zip(METABOLITE_COLUMNS, next(metabolites)[1:]))
+                                    for _ in range(per_substance)]
+        yield substance
+
+
+def build_synthetic_database(path, substance_count):
+    """Create a simple_app-schema database filled with synthetic rows"""
+    conn = sqlite3.connect(path)
+    simple_app.create_schema(conn)
+    conn.executemany('''
+        INSERT INTO substances (name, common_names, chemical_formula, cas_number, category,
+                              description, mechanism_of_action, therapeutic_dose_min, therapeutic_dose_max,
+                              toxic_dose, lethal_dose, dose_unit, half_life, detection_window)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', synthetic_substances(substance_count))
+    conn.executemany('''
+        INSERT INTO metabolites (substance_id, name, chemical_formula, is_active, formation_pathway,
+                               detection_significance, therapeutic_range_min, therapeutic_range_max, toxic_level, unit)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', synthetic_metabolites(substance_count))
+    simple_app.store_derived_columns(conn)
+    simple_app.create_search_index(conn)
+    conn.commit()
+    return conn
+
+
+def time_queries(run, terms, repeat):
+    """Run every term `repeat` times and return per-call latencies in milliseconds"""
+    latencies = []
+    for _ in range(repeat):
+        for term in terms:
+            start = time.perf_counter()
+            run(term)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(label, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"  {label:<8} median {statistics.median(latencies):9.3f} ms   "
+          f"p95 {p95:9.3f} ms   max {latencies[-1]:9.3f} ms")
+
+
+def bench_search(args):
+    """Compare LIKE scans with the FTS5 index behind /api/substances?search="""
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        conn = build_synthetic_database(os.path.join(tmp, 'bench.db'), args.substances)
+        print(f"Built {args.substances} substances in {time.perf_counter() - start:.1f}s")
+
+        terms = ['meth', 'fentanyl', 'caine', 'molly', 'glucuronide', 'dopamine reuptake', 'Snow']
+
+        def like(term):
+            pattern = f'%{term}%'
+            conn.execute("SELECT id FROM substances WHERE name LIKE ? OR common_names LIKE ? "
+                         "OR description LIKE ?", (pattern, pattern, pattern)).fetchall()
+
+        def fts(term, limit=-1):
+            conn.execute(f"SELECT rowid FROM {simple_app.FTS_TABLE} WHERE {simple_app.FTS_TABLE} MATCH ? "
+                         f"ORDER BY {simple_app.search_index.rank_expression(simple_app.FTS_TABLE)} LIMIT ?",
+                         (simple_app.search_index.match_expression(term), limit)).fetchall()
+
+        print(f"Search latency over {len(terms)} terms x {args.repeat} runs:")
+        report('LIKE', time_queries(like, terms, args.repeat))
+        report('FTS5', time_queries(fts, terms, args.repeat))
+        report('FTS5@50', time_queries(lambda term: fts(term, 50), terms, args.repeat))
+        conn.close()
+
+
+def bench_dose_batch(args):
+    """Measure /api/dose-analysis/batch throughput against one request per measurement"""
+    with tempfile.TemporaryDirectory() as tmp:
+        # app.py reads its database location at import time
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        import app
+        from init_database import init_database
+        init_database()
+        client = app.app.test_client()
+
+        with app.app.app_context():
+            substance_ids = [s.id for s in app.Substance.query.all()]
+        rng = random.Random(1)
+
+        def measurements(count):
+            return [{'substance_id': rng.choice(substance_ids), 'measured_level': rng.uniform(0, 5)}
+                    for _ in range(count)]
+
+        items = measurements(args.single)
+        start = time.perf_counter()
+        for item in items:
+            client.post('/api/dose-analysis', json=item)
+        elapsed = time.perf_counter() - start
+        print(f"  single    {args.single:>7} items  {elapsed:8.2f}s  {args.single / elapsed:>10,.0f} items/s")
+
+        for size in args.sizes:
+            items = measurements(size)
+            start = time.perf_counter()
+            response = client.post('/api/dose-analysis/batch', json=items)
+            elapsed = time.perf_counter() - start
+            assert response.status_code == 200 and response.get_json()['errors'] == 0
+            print(f"  batch     {size:>7} items  {elapsed:8.2f}s  {size / elapsed:>10,.0f} items/s")
+
+
+def timed(items, spent):
+    """Pass items through, adding the time spent producing them to spent[0]"""
+    items = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        finally:
+            spent[0] += time.perf_counter() - start
+        yield item
+
+
+def bench_bulk_load(args):
+    """Time init_database.bulk_load against the one-flush-per-substance ORM path"""
+    with tempfile.TemporaryDirectory() as tmp:
+        # app.py reads its database location at import time
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        import app
+        from init_database import bulk_load
+
+        def orm_load(substances):
+            for data in substances:
+                metabolites = data.pop('metabolites')
+                substance = app.Substance(**data)
+                app.db.session.add(substance)
+                app.db.session.flush()
+                for metabolite in metabolites:
+                    app.db.session.add(app.Metabolite(substance_id=substance.id, **metabolite))
+            app.db.session.commit()
+
+        runs = [('orm', args.orm)] if args.orm else []
+        runs += [('bulk', size) for size in args.sizes]
+        with app.app.app_context():
+            for label, size in runs:
+                app.db.drop_all()
+                app.db.create_all()
+                # Generating the synthetic rows is not part of the load
+                generating = [0.0]
+                substances = timed(synthetic_catalog(size), generating)
+                start = time.perf_counter()
+                if label == 'orm':
+                    orm_load(substances)
+                else:
+                    bulk_load(substances)
+                elapsed = time.perf_counter() - start - generating[0]
+                rows = size * 3
+                print(f"  {label:<5} {size:>9,} substances + {size * 2:>9,} metabolites  {elapsed:8.1f}s  "
+                      f"{rows / elapsed:>10,.0f} rows/s")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def catalog_paths(substance_count, seed=3):
+    """A mix of page, detail, search and category reads of a synthetic catalog"""
+    rng = random.Random(seed)
+    return ([f'/api/substances?limit=100&after_id={rng.randint(0, substance_count)}' for _ in range(200)] +
+            [f'/api/substances/{rng.randint(1, substance_count)}' for _ in range(200)] +
+            [f'/api/substances?search={term}&limit=50' for term in ('meth', 'caine', 'opioid', 'molly')] +
+            ['/api/categories'])
+
+
+def build_flask_database(directory, substance_count):
+    """Point app.py, and the servers started from here, at a new synthetic database in `directory`"""
+    # app.py reads its database location at import time
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    import app
+    from init_database import bulk_load
+    with app.app.app_context():
+        app.db.create_all()
+        bulk_load(synthetic_catalog(substance_count))
+
+
+def run_clients(port, paths, clients, duration):
+    """Run keep-alive load clients in threads for `duration` seconds; returns (latencies, errors)"""
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=load_client, args=(port, paths, deadline, latencies, errors, seed))
+               for seed in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def summarize(latencies, errors, duration):
+    """Requests per second, median and p99 latency in milliseconds, and the error count of a run"""
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else float('nan')
+    median = statistics.median(latencies) if latencies else float('nan')
+    return len(latencies) / duration, median, p99, len(errors)
+
+
+def load_client(port, paths, deadline, latencies, errors, seed):
+    """Send requests over one keep-alive connection until the deadline"""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.perf_counter() < deadline:
+        path = rng.choice(paths)
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException) as exc:
+            errors.append(exc)
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+    conn.close()
+
+
+def bench_load(args):
+    """Load-test simple_app.py at several process x thread counts"""
+    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simple_app.py')
+    paths = catalog_paths(args.substances)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_synthetic_database(os.path.join(tmp, simple_app.DB_PATH), args.substances).close()
+        print(f"{args.substances} substances, {args.clients} keep-alive clients, {args.duration}s per run")
+
+        for config in args.configs:
+            processes, threads = parse_config(config)
+            port = free_port()
+            server = subprocess.Popen([sys.executable, server_script, '--port', str(port), '--no-init',
+                                       '--threads', str(threads), '--processes', str(processes)],
+                                      cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_server(port)
+                latencies, errors = run_clients(port, paths, args.clients, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+
+            rate, median, p99, error_count = summarize(latencies, errors, args.duration)
+            print(f"  {processes} proc x {threads:>2} threads  {rate:>8,.0f} req/s   "
+                  f"median {median:8.2f} ms   p99 {p99:8.2f} ms   errors {error_count}")
+
+
+async def async_load_client(port, paths, deadline, latencies, errors, seed):
+    """Send requests over one connection until the deadline, reconnecting whenever the server closes it"""
+    rng = random.Random(seed)
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        path = rng.choice(paths)
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+            head = (await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 60)).decode('latin-1').lower()
+            status = int(head.split(' ', 2)[1])
+            length = int(head.split('content-length:', 1)[1].split('\r\n', 1)[0])
+            await reader.readexactly(length)
+            if status != 200:
+                errors.append(status)
+            # Sync workers close the connection after every response
+            if 'connection: close' in head:
+                writer.close()
+                reader = writer = None
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError) as exc:
+            errors.append(exc)
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+    if writer is not None:
+        writer.close()
+
+
+async def run_async_clients(port, paths, connections, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(async_load_client(port, paths, deadline, latencies, errors, seed)
+                           for seed in range(connections)))
+    return latencies, errors
+
+
+def bench_serving(args):
+    """Load-test the Flask app under gunicorn sync workers (wsgi.py) against asgi.py under uvicorn"""
+    # One socket per connection, and the servers' sockets on top
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(max(soft, args.connections * 2 + 256), hard), hard))
+    paths = catalog_paths(args.substances)
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_flask_database(tmp, args.substances)
+        print(f"{args.substances} substances, {args.connections} concurrent connections, "
+              f"{args.workers} worker processes, {args.duration}s per run")
+
+        servers = {
+            'wsgi': ['-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(args.workers), '--threads', '1',
+                     '--bind', '127.0.0.1:{port}', '--backlog', str(args.connections * 2), 'wsgi:app'],
+            'asgi': ['-m', 'uvicorn', '--workers', str(args.workers), '--port', '{port}',
+                     '--backlog', str(args.connections * 2), '--no-access-log', 'asgi:app'],
+        }
+        for label in args.servers:
+            port = free_port()
+            command = [sys.executable] + [part.format(port=port) for part in servers[label]]
+            server = subprocess.Popen(command, cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_server(port)
+                latencies, errors = asyncio.run(run_async_clients(port, paths, args.connections, args.duration))
+            finally:
+                server.terminate()
+                server.wait()
+
+            rate, median, p99, error_count = summarize(latencies, errors, args.duration)
+            print(f"  {label}  {rate:>8,.0f} req/s   "
+                  f"median {median:8.2f} ms   p99 {p99:8.2f} ms   errors {error_count}")
+
+
+# Share of the best throughput a configuration must reach to count as the knee of the sweep
+KNEE_SHARE = 0.9
+
+
+def parse_config(config):
+    """`PROCESSESxTHREADS` as a pair of ints"""
+    processes, threads = (int(part) for part in config.split('x'))
+    return processes, threads
+
+
+def bench_gunicorn(args):
+    """Sweep gunicorn workers x threads for the Flask app to find where throughput stops growing"""
+    paths = catalog_paths(args.substances)
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_flask_database(tmp, args.substances)
+        print(f"{args.substances} substances, {args.clients} keep-alive clients, {args.duration}s per run")
+
+        rates = {}
+        # Smallest first, so the knee is the first configuration close enough to the best
+        for config in sorted(args.configs, key=lambda config: (math.prod(parse_config(config)), config)):
+            workers, threads = parse_config(config)
+            port = free_port()
+            env = dict(os.environ, GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads),
+                       GUNICORN_BIND=f'127.0.0.1:{port}')
+            server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                                      cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_server(port)
+                latencies, errors = run_clients(port, paths, args.clients, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+
+            rate, median, p99, error_count = summarize(latencies, errors, args.duration)
+            rates[config] = rate
+            worker_class = 'gthread' if threads > 1 else 'sync'
+            print(f"  {workers} workers x {threads:>2} threads ({worker_class:<7})  {rate:>8,.0f} req/s   "
+                  f"median {median:8.2f} ms   p99 {p99:8.2f} ms   errors {error_count}")
+
+        # The knee: the smallest configuration within KNEE_SHARE of the best throughput
+        best = max(rates.values())
+        knee = next(config for config, rate in rates.items() if rate >= best * KNEE_SHARE)
+        print(f"Knee: {knee} reaches {rates[knee] / best:.0%} of the best throughput ({best:,.0f} req/s)")
+
+
+def bench_snapshot(args):
+    """Measure the memory of the catalog snapshot and its speedup over per-request queries"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        build_synthetic_database(path, args.substances).close()
+        simple_app.DB_POOL = simple_app.ConnectionPool(path)
+        cursor = simple_app.DB_POOL.connection().cursor()
+
+        start = time.perf_counter()
+        simple_app.load_snapshot()
+        elapsed = time.perf_counter() - start
+        # Traced separately, since tracing slows the build down several times
+        tracemalloc.start()
+        snapshot = simple_app.load_snapshot()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Snapshot of {len(snapshot):,} substances built in {elapsed:.2f}s: "
+              f"{retained / 2**20:,.1f} MiB retained ({snapshot.encoded_bytes / 2**20:,.1f} MiB pre-encoded JSON), "
+              f"{peak / 2**20:,.1f} MiB peak")
+
+        fields = simple_app.SUBSTANCE_FIELDS
+        columns = simple_app.select_columns(fields)
+        rng = random.Random(3)
+        ids = [rng.randint(1, args.substances) for _ in range(args.requests)]
+        after_ids = [rng.randint(0, max(args.substances - 101, 0)) for _ in range(args.requests)]
+        categories = [rng.choice(CATEGORIES) for _ in range(max(args.requests // 100, 3))]
+
+        def query_detail(substance_id):
+            substances = simple_app.fetch_substances(cursor, f"SELECT {columns} FROM substances WHERE id = ?",
+                                                     (substance_id,))
+            return json.dumps(substances[0]).encode()
+
+        def query_page(after_id):
+            query, params = simple_app.keyset_query(f"SELECT {columns} FROM substances", [], [], after_id, 101)
+            substances = simple_app.fetch_substances(cursor, query, params)
+            next_cursor = substances[99]['id'] if len(substances) > 100 else None
+            return json.dumps({'items': substances[:100], 'next_cursor': next_cursor}).encode()
+
+        def query_category(category):
+            substances = simple_app.fetch_substances(
+                cursor, f"SELECT {columns} FROM substances WHERE category = ?", (category,))
+            return json.dumps(substances).encode()
+
+        runs = [
+            ('detail', ids, query_detail, lambda substance_id: snapshot.substance_body(substance_id, fields, True)),
+            ('page', after_ids, query_page, lambda after_id: snapshot.page_body(fields, True, after_id, 100)),
+            ('category', categories, query_category,
+             lambda category: snapshot.listing_body(fields, True, category=category)),
+        ]
+        print("Per-request latency, SQLite query + JSON encoding vs snapshot:")
+        for label, keys, query, lookup in runs:
+            queried = statistics.median(time_queries(query, keys, 1))
+            looked_up = statistics.median(time_queries(lookup, keys, 1))
+            print(f"  {label:<8} query {queried:9.3f} ms   snapshot {looked_up:9.4f} ms   "
+                  f"{queried / looked_up:>10,.0f}x")
+
+
+def memory_usage(pid):
+    """Rss, Pss and private (Private_Clean + Private_Dirty) bytes of a process, from /proc"""
+    usage = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                usage[name] = int(value.split()[0]) * 1024
+    return usage['Rss'], usage['Pss'], usage['Private_Clean'] + usage['Private_Dirty']
+
+
+def snapshot_worker(load, ready):
+    """Forked worker: load the snapshot, read every substance body once, report, then wait to be killed"""
+    snapshot = load()
+    for substance_id in range(1, len(snapshot) + 1):
+        snapshot.substance_body(substance_id, snapshot.fields, True)
+    snapshot.listing_body(snapshot.fields, True)
+    os.write(ready, b'.')
+    while True:
+        time.sleep(60)
+
+
+def run_in_child(func):
+    """Run func in a forked process and wait for it"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            func()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+
+def bench_catalog_file(args):
+    """Compare per-worker memory of the in-memory snapshot and the memory-mapped catalog file"""
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        print("Needs /proc/<pid>/smaps_rollup (Linux 4.14 or later)")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        catalog_path = os.path.join(tmp, 'catalog.bin')
+
+        def export():
+            build_synthetic_database(path, args.substances).close()
+            simple_app.DB_POOL = simple_app.ConnectionPool(path)
+            simple_app.export_catalog(catalog_path)
+
+        start = time.perf_counter()
+        # In a child, so the workers below do not inherit the memory it takes
+        run_in_child(export)
+        print(f"{args.substances:,} substances, catalog file of {os.path.getsize(catalog_path) / 2**20:,.1f} MiB "
+              f"built and written in {time.perf_counter() - start:.2f}s; {args.workers} workers each read every substance")
+
+        def build():
+            # Each worker opens its own connection, as a forked server process would
+            simple_app.DB_POOL = simple_app.ConnectionPool(path)
+            return simple_app.build_snapshot()
+
+        def mapped():
+            return catalog_mmap.MappedCatalog(catalog_path, simple_app.encode_snapshot_body, 'simple_app')
+
+        baseline = memory_usage(os.getpid())[0]
+        print(f"  parent before forking: {baseline / 2**20:,.1f} MiB RSS")
+        snapshots = {}
+        for label, load in (('in memory', build), ('mapped', mapped)):
+            ready_reader, ready_writer = os.pipe()
+            children = []
+            for _ in range(args.workers):
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        snapshot_worker(load, ready_writer)
+                    finally:
+                        os._exit(0)
+                children.append(pid)
+            try:
+                # Measured while every worker is alive, so shared pages are split between them in Pss
+                for _ in children:
+                    os.read(ready_reader, 1)
+                usage = [memory_usage(pid) for pid in children]
+            finally:
+                for pid in children:
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                os.close(ready_reader)
+                os.close(ready_writer)
+            rss, pss, private = (statistics.mean(values) / 2**20 for values in zip(*usage))
+            total = sum(values[1] for values in usage) / 2**20
+            print(f"  {label:<9}  per worker: RSS {rss:8.1f} MiB   PSS {pss:8.1f} MiB   private {private:8.1f} MiB"
+                  f"   all workers: PSS {total:8.1f} MiB")
+            snapshots[label] = load()
+
+        rng = random.Random(3)
+        ids = [rng.randint(1, args.substances) for _ in range(args.requests)]
+        fields = simple_app.SUBSTANCE_FIELDS
+        print("Per-request latency, in-memory snapshot vs mapped file:")
+        runs = [
+            ('detail', lambda snapshot: lambda substance_id: snapshot.substance_body(substance_id, fields, True)),
+            ('project', lambda snapshot: lambda substance_id: snapshot.substance_body(substance_id, ('id', 'name'),
+                                                                                     False)),
+            ('page', lambda snapshot: lambda after_id: snapshot.page_body(fields, True, after_id, 100)),
+        ]
+        for label, lookup in runs:
+            latencies = [statistics.median(time_queries(lookup(snapshots[mode]), ids, 1))
+                         for mode in ('in memory', 'mapped')]
+            print(f"  {label:<8} in memory {latencies[0]:9.4f} ms   mapped {latencies[1]:9.4f} ms")
+
+
+def misspell(rng, text):
+    """Delete, replace or swap one character of `text`"""
+    position = rng.randrange(len(text) - 1)
+    edit = rng.choice(('delete', 'replace', 'swap'))
+    if edit == 'delete':
+        return text[:position] + text[position + 1:]
+    if edit == 'replace':
+        return text[:position] + rng.choice(string.ascii_lowercase) + text[position + 1:]
+    return text[:position] + text[position + 1] + text[position] + text[position + 2:]
+
+
+def bench_autocomplete(args):
+    """Measure building the autocomplete index and its lookup latency for prefixes and typos"""
+    rows = [(substance_id, values[0], values[1])
+            for substance_id, values in enumerate(synthetic_substances(args.substances), 1)]
+
+    start = time.perf_counter()
+    autocomplete.AutocompleteIndex(rows)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    index = autocomplete.AutocompleteIndex(rows)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Index of {len(index):,} names of {index.substance_count:,} substances built in {elapsed:.2f}s, "
+          f"{retained / 2**20:,.1f} MiB retained")
+
+    rng = random.Random(5)
+    names = [rng.choice(rows)[1].lower() for _ in range(args.queries)]
+    prefixes = [name[:rng.randint(2, 12)] for name in names]
+    typos = [misspell(rng, name[:rng.randint(5, 14)]) for name in names]
+    for label, queries in (('prefix', prefixes), ('typo', typos)):
+        latencies = sorted(time_queries(index.lookup, queries, 1))
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        hits = sum(1 for query in queries if index.lookup(query)) / len(queries)
+        print(f"  {label:<8} median {statistics.median(latencies):9.4f} ms   p99 {p99:9.4f} ms   "
+              f"max {latencies[-1]:9.4f} ms   {hits:6.1%} with suggestions")
+
+
+def bench_compression(args):
+    """Measure the bytes saved and the CPU spent compressing static assets and API responses"""
+    static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    bodies = [('page (standalone)', simple_app.ForensicToxRequestHandler.INDEX_HTML.encode(), True)]
+    for name in ('css/style.css', 'js/app.js'):
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            bodies.append((name, f.read(), True))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        build_synthetic_database(path, args.substances).close()
+        simple_app.DB_POOL = simple_app.ConnectionPool(path)
+        snapshot = simple_app.load_snapshot()
+        fields = simple_app.SUBSTANCE_FIELDS
+        bodies += [
+            ('detail', snapshot.substance_body(1, fields, True), False),
+            ('page of 100', snapshot.page_body(fields, True, 0, 100), False),
+            (f'listing of {len(snapshot):,}', snapshot.list_body, False),
+        ]
+
+    print(f"Codings: {', '.join(compression.ENCODINGS)} (assets at the startup levels, API bodies per request)")
+    for label, body, static in bodies:
+        results = []
+        for encoding in compression.ENCODINGS:
+            repeat = max(1, min(args.repeat, 2**24 // len(body)))
+            start = time.perf_counter()
+            for _ in range(repeat):
+                compressed = compression.compress(body, encoding, static)
+            elapsed = (time.perf_counter() - start) / repeat * 1000
+            results.append(f"{encoding} {len(compressed):>10,} B ({len(compressed) / len(body):6.1%}) {elapsed:9.2f} ms")
+        print(f"  {label:<18} {len(body):>11,} B   " + '   '.join(results))
+
+
+def bench_mass(args):
+    """Measure screening peak lists against the mass index next to one indexed range query per peak"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        build_synthetic_database(path, args.substances).close()
+        simple_app.DB_POOL = simple_app.ConnectionPool(path)
+        conn = simple_app.DB_POOL.connection()
+
+        start = time.perf_counter()
+        index = simple_app.load_mass_index()
+        print(f"Mass index of {len(index):,} formulas built in {time.perf_counter() - start:.2f}s")
+
+        # Half the peaks are protonated catalog masses, half random noise in the same range
+        rng = random.Random(11)
+        proton = mass_search.ADDUCTS['[M+H]+'][1]
+        ppm = mass_search.DEFAULT_PPM
+
+        def query_peaks(peaks):
+            for mz in peaks:
+                mass = mz - proton
+                tolerance = mass * ppm / 1e6
+                for table in ('substances', 'metabolites'):
+                    conn.execute(f"SELECT id, name, chemical_formula, monoisotopic_mass FROM {table} "
+                                 f"WHERE monoisotopic_mass BETWEEN ? AND ?",
+                                 (mass - tolerance, mass + tolerance)).fetchall()
+
+        for size in args.peaks:
+            peaks = [rng.choice(index.masses) + proton if rng.random() < 0.5
+                     else rng.uniform(index.masses[0], index.masses[-1]) for _ in range(size)]
+            start = time.perf_counter()
+            results = index.screen(peaks, ppm, '[M+H]+')
+            screened = time.perf_counter() - start
+            start = time.perf_counter()
+            query_peaks(peaks)
+            queried = time.perf_counter() - start
+            matches = sum(len(result['matches']) for result in results)
+            print(f"  {size:>6,} peaks   index {screened * 1000:9.1f} ms   range queries {queried * 1000:9.1f} ms   "
+                  f"{matches:,} matches")
+
+
+def bench_read_model(args):
+    """Measure the memory and lookup time of metabolite thresholds as row dicts, __slots__ records and columns"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        conn = sqlite3.connect(path)
+        # Only the columns the analysis paths read, for twice as many metabolites as substances
+        conn.execute('''CREATE TABLE metabolites (id INTEGER PRIMARY KEY, name TEXT, unit TEXT,
+                        therapeutic_range_min REAL, therapeutic_range_max REAL, toxic_level REAL)''')
+        rows = synthetic_metabolites((args.metabolites + 1) // 2)
+        conn.executemany('INSERT INTO metabolites (name, unit, therapeutic_range_min, therapeutic_range_max, '
+                         'toxic_level) VALUES (?, ?, ?, ?, ?)',
+                         ((row[1], row[9], row[6], row[7], row[8]) for _, row in zip(range(args.metabolites), rows)))
+        conn.commit()
+        conn.row_factory = sqlite3.Row
+        query = ('SELECT id, name, unit, NULL AS category, therapeutic_range_min, therapeutic_range_max, '
+                 'toxic_level, NULL AS lethal FROM metabolites ORDER BY id')
+
+        # What each model is looked up by: a dict per row as simple_app builds them, the same rows as
+        # read_model.Thresholds records, and read_model.ThresholdTable
+        models = (
+            ('row dicts', lambda: {row['id']: dict(row) for row in conn.execute(query)}, dict.get),
+            ('__slots__', lambda: {row[0]: read_model.Thresholds(*row) for row in conn.execute(query)}, dict.get),
+            ('columns', lambda: read_model.ThresholdTable(conn.execute(query)), read_model.ThresholdTable.get),
+        )
+        rng = random.Random(13)
+        ids = [rng.randint(1, args.metabolites) for _ in range(args.lookups)]
+        print(f"{args.metabolites:,} metabolites, {args.lookups:,} lookups by id")
+        for label, build, get in models:
+            start = time.perf_counter()
+            model = build()
+            elapsed = time.perf_counter() - start
+            del model
+            tracemalloc.start()
+            model = build()
+            retained, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            start = time.perf_counter()
+            for item_id in ids:
+                get(model, item_id)
+            lookup = (time.perf_counter() - start) / len(ids) * 1e6
+            print(f"  {label:<10} {retained / 2**20:9.1f} MiB  {retained / args.metabolites:7.1f} B/row   "
+                  f"built in {elapsed:6.2f}s   lookup {lookup:6.2f} us")
+            del model
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subcommands = parser.add_subparsers(dest='benchmark', required=True)
+
+    search = subcommands.add_parser('search', help=bench_search.__doc__)
+    search.add_argument('--substances', type=int, default=100000)
+    search.add_argument('--repeat', type=int, default=5)
+    search.set_defaults(func=bench_search)
+
+    dose_batch = subcommands.add_parser('dose-batch', help=bench_dose_batch.__doc__)
+    dose_batch.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    dose_batch.add_argument('--single', type=int, default=1000,
+                            help='measurements sent one request at a time for comparison')
+    dose_batch.set_defaults(func=bench_dose_batch)
+
+    load = subcommands.add_parser('load', help=bench_load.__doc__)
+    load.add_argument('--configs', nargs='+', default=['1x1', '1x8', '2x8', '4x8'],
+                      help='server configurations as PROCESSESxTHREADS')
+    load.add_argument('--clients', type=int, default=32)
+    load.add_argument('--duration', type=float, default=5.0)
+    load.add_argument('--substances', type=int, default=20000)
+    load.set_defaults(func=bench_load)
+
+    bulk = subcommands.add_parser('bulk-load', help=bench_bulk_load.__doc__)
+    bulk.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    bulk.add_argument('--orm', type=int, default=2000,
+                      help='substances loaded through the ORM for comparison (0 to skip)')
+    bulk.set_defaults(func=bench_bulk_load)
+
+    snapshot = subcommands.add_parser('snapshot', help=bench_snapshot.__doc__)
+    snapshot.add_argument('--substances', type=int, default=20000)
+    snapshot.add_argument('--requests', type=int, default=2000)
+    snapshot.set_defaults(func=bench_snapshot)
+
+    autocomplete_parser = subcommands.add_parser('autocomplete', help=bench_autocomplete.__doc__)
+    autocomplete_parser.add_argument('--substances', type=int, default=100000)
+    autocomplete_parser.add_argument('--queries', type=int, default=5000)
+    autocomplete_parser.set_defaults(func=bench_autocomplete)
+
+    compression_parser = subcommands.add_parser('compression', help=bench_compression.__doc__)
+    compression_parser.add_argument('--substances', type=int, default=20000)
+    compression_parser.add_argument('--repeat', type=int, default=20)
+    compression_parser.set_defaults(func=bench_compression)
+
+    mass = subcommands.add_parser('mass', help=bench_mass.__doc__)
+    mass.add_argument('--substances', type=int, default=100000)
+    mass.add_argument('--peaks', type=int, nargs='+', default=[1000, 10000])
+    mass.set_defaults(func=bench_mass)
+
+    serving = subcommands.add_parser('serving', help=bench_serving.__doc__)
+    serving.add_argument('--servers', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+    serving.add_argument('--connections', type=int, default=1000)
+    serving.add_argument('--workers', type=int, default=4)
+    serving.add_argument('--duration', type=float, default=10.0)
+    serving.add_argument('--substances', type=int, default=20000)
+    serving.set_defaults(func=bench_serving)
+
+    gunicorn_parser = subcommands.add_parser('gunicorn', help=bench_gunicorn.__doc__)
+    gunicorn_parser.add_argument('--configs', nargs='+', default=['1x1', '2x1', '4x1', '1x8', '2x8', '4x8'],
+                                 help='gunicorn configurations as WORKERSxTHREADS')
+    gunicorn_parser.add_argument('--clients', type=int, default=64)
+    gunicorn_parser.add_argument('--duration', type=float, default=5.0)
+    gunicorn_parser.add_argument('--substances', type=int, default=20000)
+    gunicorn_parser.set_defaults(func=bench_gunicorn)
+
+    catalog_file = subcommands.add_parser('catalog-file', help=bench_catalog_file.__doc__)
+    catalog_file.add_argument('--substances', type=int, default=20000)
+    catalog_file.add_argument('--workers', type=int, default=4)
+    catalog_file.add_argument('--requests', type=int, default=2000)
+    catalog_file.set_defaults(func=bench_catalog_file)
+
+    read_model_parser = subcommands.add_parser('read-model', help=bench_read_model.__doc__)
+    read_model_parser.add_argument('--metabolites', type=int, default=1000000)
+    read_model_parser.add_argument('--lookups', type=int, default=100000)
+    read_model_parser.set_defaults(func=bench_read_model)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""
+Catalog snapshot in a memory-mapped binary file
+
+Every worker process builds its own in-memory snapshot (catalog_snapshot.py),
+so snapshot memory grows with the number of workers. This module writes the
+same catalog once, as a deploy step, into a compact file that every worker
+maps read-only: the operating system keeps a single copy in the page cache,
+shared by all of them, and a worker only decodes the records a response
+needs.
+
+Layout, little-endian, sections aligned to 8 bytes:
+
+- header: magic, format version and the length of the JSON metadata that
+  follows (field names and types, counts, section offsets, the server the
+  bodies were encoded for and the catalog fingerprint)
+- substance records, fixed width, in id order: numbers inline, strings as
+  string table indexes, the range of the substance's metabolite records and
+  the offset and length of its pre-encoded JSON body
+- metabolite records, fixed width, grouped by substance
+- string table: the offsets of every distinct string, then their UTF-8 bytes
+- indexes: record positions sorted by name, by CAS number then id, by
+  category then id and by category then name, for binary search
+- bodies: the pre-encoded JSON of every substance, the full listing, every
+  category listing and the category list
+
+MappedCatalog answers the same calls as CatalogSnapshot, with byte-identical
+bodies.
+"""
+
+import bisect
+import json
+import math
+import mmap
+import os
+import struct
+
+MAGIC = b'TOXCATLG'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+ALIGNMENT = 8
+
+# Column types: bool, int64, float64, string, any other JSON value stored as its text
+NULL_INT = -2 ** 63
+NULL_STRING = 2 ** 32 - 1
+TYPE_CODES = {'b': 'b', 'q': 'q', 'd': 'd', 's': 'I', 'j': 'I'}
+# Appended to every substance record: metabolite start and count, body offset and length
+SUBSTANCE_TAIL = 'IIQI'
+STRING_OFFSET = struct.Struct('<QQ')
+POSITION = struct.Struct('<I')
+INDEXES = ('name', 'cas_number', 'category', 'category_name')
+
+
+def column_type(values):
+    """The narrowest column type holding every value; None is allowed in all of them"""
+    present = [value for value in values if value is not None]
+    if not present or all(isinstance(value, str) for value in present):
+        return 's'
+    if all(isinstance(value, bool) for value in present):
+        return 'b'
+    if all(type(value) is int and NULL_INT < value < 2 ** 63 for value in present):
+        return 'q'
+    if all(type(value) is float and not math.isnan(value) for value in present):
+        return 'd'
+    return 'j'
+
+
+def record_struct(types, tail=''):
+    return struct.Struct('<' + ''.join(TYPE_CODES[column] for column in types) + tail)
+
+
+def _align(size):
+    return -size % ALIGNMENT
+
+
+class _StringTable:
+    def __init__(self):
+        self.indexes = {}
+
+    def add(self, text):
+        return self.indexes.setdefault(text, len(self.indexes))
+
+    def encode(self, value, column):
+        if value is None:
+            return {'b': -1, 'q': NULL_INT, 'd': math.nan}.get(column, NULL_STRING)
+        if column == 's':
+            return self.add(value)
+        if column == 'j':
+            return self.add(json.dumps(value))
+        return value
+
+    def section(self):
+        blobs = [text.encode() for text in self.indexes]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        return struct.pack(f'<{len(offsets)}Q', *offsets) + b''.join(blobs)
+
+
+def write(path, snapshot, label, fingerprint=None):
+    """Write a CatalogSnapshot to `path` for MappedCatalog.
+
+    `label` names the server whose encoding produced the bodies and
+    `fingerprint` the catalog version they were read from; MappedCatalog
+    checks both. The file is replaced atomically, so running workers keep
+    the file they mapped.
+    """
+    records = snapshot.records
+    fields, metabolite_fields = snapshot.fields, snapshot.metabolite_fields
+    positions = {field: index for index, field in enumerate(fields)}
+    substance_types = tuple(column_type([record.values[index] for record in records])
+                            for index in range(len(fields)))
+    metabolite_types = tuple(column_type([row[index] for record in records for row in record.metabolites])
+                             for index in range(len(metabolite_fields)))
+    substance_struct = record_struct(substance_types, SUBSTANCE_TAIL)
+    metabolite_struct = record_struct(metabolite_types)
+    strings = _StringTable()
+
+    # Bodies first, so the records can point into them
+    bodies = bytearray()
+    body_spans = []
+    for body in [record.body for record in records]:
+        body_spans.append((len(bodies), len(body)))
+        bodies += body
+
+    def span(body):
+        start = len(bodies)
+        bodies.extend(body)
+        return [start, len(body)]
+
+    substance_section = bytearray()
+    metabolite_section = bytearray()
+    metabolite_count = 0
+    for record, (body_offset, body_length) in zip(records, body_spans):
+        values = [strings.encode(value, column) for value, column in zip(record.values, substance_types)]
+        substance_section += substance_struct.pack(*values, metabolite_count, len(record.metabolites),
+                                                   body_offset, body_length)
+        for row in record.metabolites:
+            metabolite_section += metabolite_struct.pack(
+                *[strings.encode(value, column) for value, column in zip(row, metabolite_types)])
+        metabolite_count += len(record.metabolites)
+
+    def sort_key(*names):
+        # None sorts first; the lookups never search for it
+        return lambda position: tuple((records[position].values[positions[name]] is not None,
+                                       records[position].values[positions[name]] or '') for name in names)
+
+    everything = range(len(records))
+    with_cas = [position for position in everything if records[position].cas_number]
+    orders = {
+        'name': sorted(everything, key=sort_key('name')),
+        'cas_number': sorted(with_cas, key=sort_key('cas_number', 'id')),
+        'category': sorted(everything, key=sort_key('category', 'id')),
+        'category_name': sorted(everything, key=sort_key('category', 'name')),
+    }
+
+    metadata = {
+        'label': label,
+        'fingerprint': fingerprint,
+        'fields': fields,
+        'substance_types': substance_types,
+        'metabolite_fields': metabolite_fields,
+        'metabolite_types': metabolite_types,
+        'substances': len(records),
+        'metabolites': metabolite_count,
+        'strings': len(strings.indexes),
+        'list_body': span(snapshot.list_body),
+        'category_bodies': {category: span(body) for category, body in snapshot.category_bodies.items()},
+        'categories_body': span(snapshot.categories_body),
+        'encoded_bytes': snapshot.encoded_bytes,
+        'index_sizes': {name: len(order) for name, order in orders.items()},
+    }
+    sections = [('substances', substance_section), ('metabolites', metabolite_section),
+                ('strings', strings.section())]
+    sections += [(name, struct.pack(f'<{len(orders[name])}I', *orders[name])) for name in INDEXES]
+    sections.append(('bodies', bodies))
+
+    offsets, offset = {}, 0
+    for name, data in sections:
+        offsets[name] = offset
+        offset += len(data) + _align(len(data))
+    metadata['sections'] = offsets
+    encoded_metadata = json.dumps(metadata).encode()
+
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(encoded_metadata)))
+        f.write(encoded_metadata)
+        f.write(bytes(_align(HEADER.size + len(encoded_metadata))))
+        for _, data in sections:
+            f.write(data)
+            f.write(bytes(_align(len(data))))
+    os.replace(temporary, path)
+
+
+class _SortedColumn:
+    """The values of one string column in the order of an index, for bisect"""
+
+    def __init__(self, catalog, index, field):
+        self._catalog = catalog
+        self._index = index
+        self._field = field
+
+    def __len__(self):
+        return self._catalog._index_sizes[self._index]
+
+    def __getitem__(self, i):
+        value = self._catalog._field(self._catalog._position(self._index, i), self._field)
+        return (value is not None, value or '')
+
+
+class _Ids:
+    """The ids of a list of record positions, for bisect"""
+
+    def __init__(self, catalog, positions):
+        self._catalog = catalog
+        self._positions = positions
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __getitem__(self, i):
+        return self._catalog._field(self._positions[i], 'id')
+
+
+class _IndexRange:
+    """Record positions from a slice of an index"""
+
+    def __init__(self, catalog, index, start, stop):
+        self._catalog = catalog
+        self._index = index
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._catalog._position(self._index, self._start + i)
+
+
+class MappedCatalog:
+    """A catalog file written by `write`, mapped read-only.
+
+    Answers the same calls as CatalogSnapshot. `encode` must be the function
+    the bodies were encoded with, since projected responses are encoded on
+    the fly. Raises ValueError when the file is not a catalog file, was
+    written for another `label`, or was read from another catalog version
+    than `fingerprint`.
+    """
+
+    def __init__(self, path, encode, label, fingerprint=None):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, metadata_length = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} catalog file')
+        metadata = json.loads(self._map[HEADER.size:HEADER.size + metadata_length])
+        if metadata['label'] != label:
+            raise ValueError(f"{path} was written for {metadata['label']}, not {label}")
+        if fingerprint is not None and metadata['fingerprint'] != fingerprint:
+            raise ValueError(f'{path} is out of date with the database')
+
+        self.path = path
+        self._encode = encode
+        self.fields = tuple(metadata['fields'])
+        self.metabolite_fields = tuple(metadata['metabolite_fields'])
+        self._positions = {field: index for index, field in enumerate(self.fields)}
+        self._substance_types = metadata['substance_types']
+        self._metabolite_types = metadata['metabolite_types']
+        self._substance_struct = record_struct(self._substance_types, SUBSTANCE_TAIL)
+        self._metabolite_struct = record_struct(self._metabolite_types)
+        self._count = metadata['substances']
+        self._index_sizes = metadata['index_sizes']
+        self._encoded_bytes = metadata['encoded_bytes']
+
+        base = HEADER.size + metadata_length
+        base += _align(base)
+        self._sections = {name: base + offset for name, offset in metadata['sections'].items()}
+        self._string_offsets = self._sections['strings']
+        self._string_blob = self._string_offsets + 8 * (metadata['strings'] + 1)
+        self._list_span = metadata['list_body']
+        self.categories_body = self._body(self._sections['bodies'], *metadata['categories_body'])
+        self._category_spans = metadata['category_bodies']
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def encoded_bytes(self):
+        """Size of all pre-encoded response bodies"""
+        return self._encoded_bytes
+
+    @property
+    def list_body(self):
+        # Read from the mapping on every call rather than kept, since it holds every substance
+        return self._body(self._sections['bodies'], *self._list_span)
+
+    @property
+    def category_bodies(self):
+        bodies = self._sections['bodies']
+        return {category: self._body(bodies, *span) for category, span in self._category_spans.items()}
+
+    def close(self):
+        self._map.close()
+
+    def _body(self, bodies, offset, length):
+        return self._map[bodies + offset:bodies + offset + length]
+
+    def _string(self, index):
+        start, end = STRING_OFFSET.unpack_from(self._map, self._string_offsets + 8 * index)
+        return self._map[self._string_blob + start:self._string_blob + end].decode()
+
+    def _decode(self, value, column):
+        if column == 'b':
+            return None if value < 0 else bool(value)
+        if column == 'q':
+            return None if value == NULL_INT else value
+        if column == 'd':
+            return None if math.isnan(value) else value
+        if value == NULL_STRING:
+            return None
+        return self._string(value) if column == 's' else json.loads(self._string(value))
+
+    def _record(self, position):
+        return self._substance_struct.unpack_from(
+            self._map, self._sections['substances'] + position * self._substance_struct.size)
+
+    def _field(self, position, field):
+        index = self._positions[field]
+        return self._decode(self._record(position)[index], self._substance_types[index])
+
+    def _position(self, index, i):
+        return POSITION.unpack_from(self._map, self._sections[index] + 4 * i)[0]
+
+    def render(self, position, fields=None, include_metabolites=True):
+        """The JSON payload of the substance at a record position, optionally restricted to some fields"""
+        raw = self._record(position)
+        data = {}
+        for field in fields or self.fields:
+            index = self._positions[field]
+            data[field] = self._decode(raw[index], self._substance_types[index])
+        if include_metabolites:
+            start, count = raw[-4], raw[-3]
+            size = self._metabolite_struct.size
+            data['metabolites'] = [
+                dict(zip(self.metabolite_fields,
+                         (self._decode(value, column) for value, column in zip(
+                             self._metabolite_struct.unpack_from(self._map, self._sections['metabolites'] + i * size),
+                             self._metabolite_types))))
+                for i in range(start, start + count)
+            ]
+        return data
+
+    def is_default(self, fields, include_metabolites):
+        """Whether a projection is the full record, whose bodies are pre-encoded"""
+        return include_metabolites and tuple(fields) == self.fields
+
+    def _index_range(self, index, field, value):
+        column = _SortedColumn(self, index, field)
+        key = (True, value)
+        return _IndexRange(self, index, bisect.bisect_left(column, key), bisect.bisect_right(column, key))
+
+    def find(self, category=None, name=None, cas_number=None):
+        """Record positions matching every given exact filter, in id order, with their ids"""
+        if name is not None:
+            found = list(self._index_range('name', 'name', name))
+        elif cas_number is not None:
+            found = list(self._index_range('cas_number', 'cas_number', cas_number))
+        elif category is not None:
+            found = self._index_range('category', 'category', category)
+            return found, _Ids(self, found)
+        else:
+            found = range(self._count)
+            return found, _Ids(self, found)
+
+        found = [position for position in found
+                 if (category is None or self._field(position, 'category') == category) and
+                 (cas_number is None or self._field(position, 'cas_number') == cas_number)]
+        return found, _Ids(self, found)
+
+    def _substance_body(self, position):
+        offset, length = self._record(position)[-2:]
+        return self._body(self._sections['bodies'], offset, length)
+
+    def substance_body(self, substance_id, fields, include_metabolites):
+        """Encoded detail response for one substance, or None if there is no such id"""
+        ids = _Ids(self, range(self._count))
+        position = bisect.bisect_left(ids, substance_id)
+        if position == self._count or ids[position] != substance_id:
+            return None
+        if self.is_default(fields, include_metabolites):
+            return self._substance_body(position)
+        return self._encode(self.render(position, fields, include_metabolites))
+
+    def listing_body(self, fields, include_metabolites, category=None, name=None, cas_number=None):
+        """Encoded response listing every matching substance"""
+        by_category_only = name is None and cas_number is None
+        if by_category_only and self.is_default(fields, include_metabolites):
+            if category is None:
+                return self.list_body
+            if category in self._category_spans:
+                return self._body(self._sections['bodies'], *self._category_spans[category])
+
+        if category is not None and by_category_only:
+            # Category listings come back from SQLite in (category, name) index order
+            found = self._index_range('category_name', 'category', category)
+        else:
+            found, _ = self.find(category, name, cas_number)
+        return self._encode([self.render(position, fields, include_metabolites) for position in found])
+
+    def page_body(self, fields, include_metabolites, after_id, limit, category=None, name=None, cas_number=None):
+        """Encoded keyset page of matching substances in id order, like the SQL pagination"""
+        found, ids = self.find(category, name, cas_number)
+        start = bisect.bisect_right(ids, after_id)
+        page = found[start:start + limit + 1]
+        next_cursor = self._field(page[limit - 1], 'id') if len(page) > limit else None
+        return self._encode({
+            'items': [self.render(position, fields, include_metabolites) for position in page[:limit]],
+            'next_cursor': next_cursor
+        })
+
+    def ndjson_lines(self, fields, include_metabolites, category=None, name=None, cas_number=None):
+        """Yield one encoded NDJSON line per matching substance, in id order"""
+        found, _ = self.find(category, name, cas_number)
+        default = self.is_default(fields, include_metabolites)
+        for position in found:
+            if default:
+                body = self._substance_body(position)
+            else:
+                body = self._encode(self.render(position, fields, include_metabolites))
+            yield body.rstrip(b'\n') + b'\n'
@@ -0,0 +1,184 @@
+"""
+In-memory snapshot of the substance catalog
+
+For deployments where the catalog only changes on deploy, both servers can
+load every substance with its metabolites once and answer catalog reads from
+memory. Substances are compact `__slots__` records indexed by id, name, CAS
+number and category, and the JSON bodies of the common responses (every
+substance, the full listing, every category listing and the category list)
+are encoded once when the snapshot is built.
+
+Full-text search still runs against SQLite, since ranking needs the FTS index.
+"""
+
+import bisect
+import threading
+
+
+class SubstanceRecord:
+    """One substance: its column values, its metabolite rows and its encoded JSON body"""
+
+    __slots__ = ('id', 'name', 'cas_number', 'category', 'values', 'metabolites', 'body')
+
+    def __init__(self, values, metabolites, positions):
+        self.values = tuple(values)
+        self.metabolites = tuple(metabolites)
+        self.id = self.values[positions['id']]
+        self.name = self.values[positions['name']]
+        self.cas_number = self.values[positions['cas_number']]
+        self.category = self.values[positions['category']]
+        self.body = None
+
+
+class CatalogSnapshot:
+    """Immutable copy of the catalog with its lookup indexes and pre-encoded responses.
+
+    `rows` yields `(values, metabolites)` pairs: the substance's values in
+    `fields` order and its metabolite rows in `metabolite_fields` order.
+    `fields` must include id, name, cas_number and category. `encode` turns a
+    JSON payload into a response body, so the bytes match what the server
+    would have produced from a query.
+    """
+
+    def __init__(self, fields, metabolite_fields, rows, encode):
+        self.fields = tuple(fields)
+        self.metabolite_fields = tuple(metabolite_fields)
+        self._positions = {field: index for index, field in enumerate(self.fields)}
+        self._encode = encode
+
+        records = sorted((SubstanceRecord(values, metabolites, self._positions) for values, metabolites in rows),
+                         key=lambda record: record.id)
+        self.records = tuple(records)
+        self.ids = [record.id for record in records]
+        self.by_id = {record.id: record for record in records}
+        self.by_name = {record.name: record for record in records}
+
+        by_cas = {}
+        by_category = {}
+        for record in records:
+            if record.cas_number:
+                by_cas.setdefault(record.cas_number, []).append(record)
+            by_category.setdefault(record.category, []).append(record)
+        self.by_cas = {cas_number: tuple(found) for cas_number, found in by_cas.items()}
+        self.by_category = {category: tuple(found) for category, found in by_category.items()}
+        self._category_ids = {category: [record.id for record in found] for category, found in by_category.items()}
+
+        for record in records:
+            record.body = encode(self.render(record))
+        self.list_body = encode([self.render(record) for record in records])
+        # Category listings come back from SQLite in (category, name) index order
+        self.category_bodies = {
+            category: encode([self.render(record) for record in sorted(found, key=lambda record: record.name)])
+            for category, found in self.by_category.items()
+        }
+        self.categories_body = encode(sorted(self.by_category))
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def encoded_bytes(self):
+        """Size of all pre-encoded response bodies"""
+        return (sum(len(record.body) for record in self.records) + len(self.list_body) +
+                sum(len(body) for body in self.category_bodies.values()) + len(self.categories_body))
+
+    def render(self, record, fields=None, include_metabolites=True):
+        """The JSON payload of one substance, optionally restricted to some fields"""
+        data = {field: record.values[self._positions[field]] for field in fields or self.fields}
+        if include_metabolites:
+            data['metabolites'] = [dict(zip(self.metabolite_fields, row)) for row in record.metabolites]
+        return data
+
+    def is_default(self, fields, include_metabolites):
+        """Whether a projection is the full record, whose bodies are pre-encoded"""
+        return include_metabolites and tuple(fields) == self.fields
+
+    def find(self, category=None, name=None, cas_number=None):
+        """Records matching every given exact filter, in id order, with their ids"""
+        if name is not None:
+            found = (self.by_name[name],) if name in self.by_name else ()
+        elif cas_number is not None:
+            found = self.by_cas.get(cas_number, ())
+        elif category is not None:
+            return self.by_category.get(category, ()), self._category_ids.get(category, [])
+        else:
+            return self.records, self.ids
+
+        found = tuple(record for record in found
+                      if (category is None or record.category == category) and
+                      (cas_number is None or record.cas_number == cas_number))
+        return found, [record.id for record in found]
+
+    def substance_body(self, substance_id, fields, include_metabolites):
+        """Encoded detail response for one substance, or None if there is no such id"""
+        record = self.by_id.get(substance_id)
+        if record is None:
+            return None
+        if self.is_default(fields, include_metabolites):
+            return record.body
+        return self._encode(self.render(record, fields, include_metabolites))
+
+    def listing_body(self, fields, include_metabolites, category=None, name=None, cas_number=None):
+        """Encoded response listing every matching substance"""
+        by_category_only = name is None and cas_number is None
+        if by_category_only and self.is_default(fields, include_metabolites):
+            if category is None:
+                return self.list_body
+            if category in self.category_bodies:
+                return self.category_bodies[category]
+
+        found, _ = self.find(category, name, cas_number)
+        if category is not None and by_category_only:
+            found = sorted(found, key=lambda record: record.name)
+        return self._encode([self.render(record, fields, include_metabolites) for record in found])
+
+    def page_body(self, fields, include_metabolites, after_id, limit, category=None, name=None, cas_number=None):
+        """Encoded keyset page of matching substances in id order, like the SQL pagination"""
+        found, ids = self.find(category, name, cas_number)
+        start = bisect.bisect_right(ids, after_id)
+        page = found[start:start + limit + 1]
+        next_cursor = page[limit - 1].id if len(page) > limit else None
+        return self._encode({
+            'items': [self.render(record, fields, include_metabolites) for record in page[:limit]],
+            'next_cursor': next_cursor
+        })
+
+    def ndjson_lines(self, fields, include_metabolites, category=None, name=None, cas_number=None):
+        """Yield one encoded NDJSON line per matching substance, in id order"""
+        found, _ = self.find(category, name, cas_number)
+        default = self.is_default(fields, include_metabolites)
+        for record in found:
+            body = record.body if default else self._encode(self.render(record, fields, include_metabolites))
+            yield body.rstrip(b'\n') + b'\n'
+
+
+class SnapshotLoader:
+    """Builds the snapshot on first use and again after `invalidate()`.
+
+    `build` is called without arguments and returns a CatalogSnapshot, or any
+    other structure derived from the catalog, such as the autocomplete index.
+    While `enabled` is False, `get()` returns None and callers query the
+    database.
+    """
+
+    def __init__(self, build, enabled=False):
+        self._build = build
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.enabled = enabled
+
+    def get(self):
+        if not self.enabled:
+            return None
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._build()
+                snapshot = self._snapshot
+        return snapshot
+
+    def invalidate(self):
+        """Drop the snapshot after the catalog changed; the next `get()` rebuilds it"""
+        with self._lock:
+            self._snapshot = None
@@ -0,0 +1,141 @@
+"""
+Content-Encoding negotiation for both servers
+
+JSON responses are compressed with brotli when the optional `brotli` package
+is installed and the client accepts it, and with gzip otherwise. Bodies the
+servers keep anyway (cached catalog responses, snapshot bodies) have their
+compressed variants cached too, so each is compressed once per catalog
+version. Static assets and the standalone page never change while a server
+runs, so they are compressed once at startup at the highest levels.
+"""
+
+import gzip
+import hashlib
+import zlib
+from functools import lru_cache, partial
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Server preference when the client accepts several codings equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Below this size the saving does not pay for the compression
+MIN_SIZE = 1024
+
+# Levels for responses compressed while serving, and for assets compressed once at startup
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+
+# Input bytes between flushes of a compressed stream, so the client still receives it progressively
+STREAM_FLUSH_BYTES = 64 * 1024
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript',
+                      'image/svg+xml')
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding):
+    """The coding to send for an Accept-Encoding header, or None to send the body as it is"""
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        if coding:
+            weights[coding] = weight
+
+    wildcard = weights.get('*', 0.0)
+    best, best_weight = None, 0.0
+    for coding in ENCODINGS:
+        weight = weights.get(coding, wildcard)
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def is_compressible(content_type):
+    return content_type is not None and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(body, encoding, static=False):
+    """Compress a whole body; `static` trades CPU for size on bodies compressed only once"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=STATIC_BROTLI_QUALITY if static else BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # mtime=0 keeps the output, and so its ETag, the same across restarts
+        return gzip.compress(body, STATIC_GZIP_LEVEL if static else GZIP_LEVEL, mtime=0)
+    raise ValueError(f'unsupported content coding {encoding!r}')
+
+
+class StreamCompressor:
+    """Incremental compression of a streamed body, flushing every STREAM_FLUSH_BYTES of input"""
+
+    def __init__(self, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._compress, self._flush, self.finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            # wbits=31 writes the gzip container
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._compress, self.finish = compressor.compress, compressor.flush
+            self._flush = partial(compressor.flush, zlib.Z_SYNC_FLUSH)
+        self._pending = 0
+
+    def compress(self, chunk):
+        """Compressed bytes ready to send for `chunk`; may be empty"""
+        output = self._compress(chunk)
+        self._pending += len(chunk)
+        if self._pending >= STREAM_FLUSH_BYTES:
+            output += self._flush()
+            self._pending = 0
+        return output
+
+
+def compress_chunks(chunks, encoding):
+    """Compress a streamed body of byte chunks"""
+    compressor = StreamCompressor(encoding)
+    for chunk in chunks:
+        output = compressor.compress(chunk)
+        if output:
+            yield output
+    yield compressor.finish()
+
+
+class PrecompressedBody:
+    """A body that never changes, compressed once with every available coding.
+
+    Variants that would not be smaller than the body itself are not kept.
+    `tag` is a digest of the body, for building ETags.
+    """
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.tag = hashlib.sha1(body).hexdigest()[:20]
+        self.variants = {}
+        if len(body) >= MIN_SIZE and is_compressible(content_type):
+            for encoding in ENCODINGS:
+                compressed = compress(body, encoding, static=True)
+                if len(compressed) < len(body):
+                    self.variants[encoding] = compressed
+
+    def select(self, accept_encoding):
+        """The `(body, encoding)` to send for an Accept-Encoding header; encoding is None for the plain body"""
+        encoding = negotiate(accept_encoding)
+        if encoding in self.variants:
+            return self.variants[encoding], encoding
+        return self.body, None
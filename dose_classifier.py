@@ -0,0 +1,124 @@
+"""
+Dose interpretation against therapeutic, toxic and lethal thresholds
+
+`classify_level` is the reference rule set used for single measurements.
+`ThresholdClassifier` applies the same rules to whole arrays of measurements
+at once: it views the threshold columns of a read_model.ThresholdTable as
+NumPy arrays, finds each measurement's row with `searchsorted` and classifies
+everything with vectorized comparisons in a single pass.
+"""
+
+try:
+    import numpy as np
+except ImportError:  # simple_app.py only needs the scalar rules
+    np = None
+
+LABELS = (
+    'Unknown',
+    'Sub-therapeutic',
+    'Therapeutic range',
+    'Above therapeutic, potentially toxic',
+    'Toxic range',
+    'Potentially lethal',
+)
+UNKNOWN, SUB_THERAPEUTIC, THERAPEUTIC, ABOVE_THERAPEUTIC, TOXIC, LETHAL = range(len(LABELS))
+
+
+def classify_level(therapeutic_min, therapeutic_max, toxic, lethal, measured_level):
+    """Interpret one measured level; returns one of LABELS.
+
+    A threshold counts as missing when it is None or 0, and nothing is
+    concluded without both therapeutic bounds.
+    """
+    if therapeutic_min and therapeutic_max:
+        if measured_level < therapeutic_min:
+            return LABELS[SUB_THERAPEUTIC]
+        elif measured_level <= therapeutic_max:
+            return LABELS[THERAPEUTIC]
+        elif toxic and measured_level < toxic:
+            return LABELS[ABOVE_THERAPEUTIC]
+        elif toxic and measured_level >= toxic:
+            if lethal and measured_level >= lethal:
+                return LABELS[LETHAL]
+            else:
+                return LABELS[TOXIC]
+    return LABELS[UNKNOWN]
+
+
+class ThresholdClassifier:
+    """Thresholds of a whole catalog table, classified in bulk.
+
+    `table` is a read_model.ThresholdTable; its id column is used in place.
+    Zero thresholds become NaN like missing ones, with separate presence masks
+    that use the same truthiness rule as `classify_level`, so both give the
+    same label for every input.
+    """
+
+    def __init__(self, table):
+        if np is None:
+            raise RuntimeError('ThresholdClassifier requires numpy')
+        self.table = table
+        self.ids = np.frombuffer(table.ids, dtype=np.int64)
+
+        def column(values):
+            array = np.frombuffer(values, dtype=np.float64)
+            present = ~np.isnan(array) & (array != 0)
+            return np.where(present, array, np.nan), present
+
+        self.therapeutic_min, has_min = column(table.therapeutic_min)
+        self.therapeutic_max, has_max = column(table.therapeutic_max)
+        self.toxic, self.has_toxic = column(table.toxic)
+        self.lethal, self.has_lethal = column(table.lethal)
+        self.has_range = has_min & has_max
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, ids):
+        """Row index of every id, or -1 for ids that are not in the catalog"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return np.where(self.ids[positions] == ids, positions, -1)
+
+    def classify(self, ids, levels):
+        """Classify measurements of the given ids; returns (positions, label codes).
+
+        Codes index into LABELS. Measurements of unknown ids get position -1
+        and code UNKNOWN.
+        """
+        positions = self.positions(ids)
+        levels = np.asarray(levels, dtype=np.float64)
+        codes = np.full(len(levels), UNKNOWN, dtype=np.int8)
+        if not len(self.ids):
+            return positions, codes
+        known = positions >= 0
+        rows = np.where(known, positions, 0)
+
+        therapeutic_min = self.therapeutic_min[rows]
+        therapeutic_max = self.therapeutic_max[rows]
+        toxic = self.toxic[rows]
+        lethal = self.lethal[rows]
+        has_range = self.has_range[rows] & known
+
+        # NaN thresholds compare False, matching a missing threshold in classify_level
+        with np.errstate(invalid='ignore'):
+            sub = has_range & (levels < therapeutic_min)
+            therapeutic = has_range & ~sub & (levels <= therapeutic_max)
+            above = has_range & ~sub & ~therapeutic
+            potentially_toxic = above & self.has_toxic[rows] & (levels < toxic)
+            toxic_range = above & self.has_toxic[rows] & (levels >= toxic)
+            lethal_range = toxic_range & self.has_lethal[rows] & (levels >= lethal)
+
+        codes[sub] = SUB_THERAPEUTIC
+        codes[therapeutic] = THERAPEUTIC
+        codes[potentially_toxic] = ABOVE_THERAPEUTIC
+        codes[toxic_range] = TOXIC
+        codes[lethal_range] = LETHAL
+        return positions, codes
+
+    def labels(self, ids, levels):
+        """Classify measurements and return the label strings"""
+        _, codes = self.classify(ids, levels)
+        return [LABELS[code] for code in codes]
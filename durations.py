@@ -0,0 +1,95 @@
+"""
+Parsing of the free-text half-life and detection window columns
+
+Substances keep their half-life ("1-4 hours") and detection windows
+("Urine: 1-3 days, Blood: 4-8 hours") as text for display. Both servers also
+store them in hours, parsed whenever a substance is written, so filters such as
+"detectable in urine 72 hours after use" run as indexed SQL range queries.
+"""
+
+import re
+
+HOURS_PER_UNIT = {
+    'second': 1 / 3600,
+    'minute': 1 / 60,
+    'hour': 1,
+    'day': 24,
+    'week': 24 * 7,
+    'month': 24 * 30,
+    'year': 24 * 365,
+}
+UNIT_ALIASES = {'s': 'second', 'sec': 'second', 'min': 'minute', 'h': 'hour', 'hr': 'hour', 'd': 'day',
+                'wk': 'week', 'mo': 'month', 'yr': 'year'}
+
+# "30 minutes", "1-3 days", "0.5 to 1.5 h", "up to 90 days"
+_DURATION_RE = re.compile(r'(?P<up_to>up to|<)?\s*(?P<low>\d+(?:\.\d+)?)\s*(?:(?:-|–|to)\s*(?P<high>\d+(?:\.\d+)?))?'
+                          r'\s*(?P<unit>[a-z]+)\.?', re.IGNORECASE)
+_SEPARATOR_RE = re.compile(r'[,;]')
+
+
+def unit_hours(unit):
+    """Hours in one of a time unit, singular, plural or abbreviated; None if it is not one"""
+    unit = unit.lower()
+    unit = UNIT_ALIASES.get(unit, unit)
+    if unit not in HOURS_PER_UNIT and unit.endswith('s'):
+        unit = UNIT_ALIASES.get(unit[:-1], unit[:-1])
+    return HOURS_PER_UNIT.get(unit)
+
+
+def parse_duration(text):
+    """`(min_hours, max_hours)` of a duration or range like "1-4 hours", or None if it does not parse.
+
+    "up to N" ranges start at 0, and a single value is both bounds.
+    """
+    if not text:
+        return None
+    match = _DURATION_RE.fullmatch(text.strip())
+    if match is None:
+        return None
+    hours = unit_hours(match['unit'])
+    if hours is None:
+        return None
+
+    low = float(match['low'])
+    high = float(match['high']) if match['high'] else low
+    if match['up_to']:
+        low = 0.0
+    if low > high:
+        return None
+    return low * hours, high * hours
+
+
+def parse_detection_windows(text):
+    """`(matrix, min_hours, max_hours)` for every "Matrix: duration" part of a detection window.
+
+    Matrices are lowercased; parts that do not parse are left out.
+    """
+    windows = []
+    for part in _SEPARATOR_RE.split(text or ''):
+        matrix, colon, duration = part.partition(':')
+        parsed = parse_duration(duration) if colon else None
+        if parsed is not None and matrix.strip():
+            windows.append((matrix.strip().lower(), *parsed))
+    return windows
+
+
+def half_life_columns(half_life):
+    """The half_life_min_hours and half_life_max_hours values for a half_life text"""
+    parsed = parse_duration(half_life) or (None, None)
+    return {'half_life_min_hours': parsed[0], 'half_life_max_hours': parsed[1]}
+
+
+def parse_detection_filter(matrix, hours):
+    """Validate the detectable_in= and hours= query parameters; returns `(matrix, hours)`.
+
+    Either may be missing (None). Raises ValueError for an hours value that is
+    not a non-negative number.
+    """
+    if hours is not None:
+        try:
+            hours = float(hours)
+        except ValueError:
+            raise ValueError('hours must be a number')
+        if not hours >= 0:
+            raise ValueError('hours must be a non-negative number')
+    return (matrix.strip().lower() or None) if matrix else None, hours
@@ -0,0 +1,131 @@
+"""
+Molecular formula parsing and masses
+
+Parses formulas as written in the catalog (`C8H9NO2`, `C15H11ClN2O`), with
+parenthesised groups (`Ca(OH)2`) and salts or hydrates joined by a dot
+(`C17H19NO3.H2O`, `C21H27NO4·2HCl`), into element counts, and computes their
+monoisotopic mass (most abundant isotope of each element, what a mass
+spectrometer measures) and average mass (standard atomic weights). Both
+servers store the two masses when a substance or metabolite is written.
+"""
+
+import re
+from functools import lru_cache
+
+# (monoisotopic mass, standard atomic weight) in daltons
+ELEMENTS = {
+    'H': (1.00782503207, 1.00794),
+    'D': (2.0141017778, 2.0141017778),
+    'Li': (7.01600455, 6.941),
+    'B': (11.0093054, 10.811),
+    'C': (12.0, 12.0107),
+    'N': (14.0030740048, 14.0067),
+    'O': (15.99491461956, 15.9994),
+    'F': (18.99840322, 18.9984032),
+    'Na': (22.9897692809, 22.98976928),
+    'Mg': (23.985041700, 24.3050),
+    'Al': (26.98153863, 26.9815386),
+    'Si': (27.9769265325, 28.0855),
+    'P': (30.97376163, 30.973762),
+    'S': (31.97207100, 32.065),
+    'Cl': (34.96885268, 35.453),
+    'K': (38.96370668, 39.0983),
+    'Ca': (39.96259098, 40.078),
+    'Fe': (55.9349375, 55.845),
+    'Co': (58.9331950, 58.933195),
+    'Cu': (62.9295975, 63.546),
+    'Zn': (63.9291422, 65.38),
+    'As': (74.9215965, 74.92160),
+    'Se': (79.9165213, 78.96),
+    'Br': (78.9183371, 79.904),
+    'I': (126.904473, 126.90447),
+    'Ba': (137.9052472, 137.327),
+    'Pt': (194.9647911, 195.084),
+    'Au': (196.9665687, 196.966569),
+    'Hg': (201.970643, 200.59),
+    'Tl': (204.9744275, 204.3833),
+    'Pb': (207.9766521, 207.2),
+    'Bi': (208.9803987, 208.98040),
+}
+
+_TOKEN_RE = re.compile(r'([A-Z][a-z]?)|(\d+)|([(\[])|([)\]])|(\s+)')
+_COMPONENT_SEPARATORS = re.compile(r'[.·•*]')
+
+
+def _parse_component(text, formula):
+    """Element counts of one dot-free part of a formula, with an optional leading multiplier"""
+    multiplier_match = re.match(r'\d+', text)
+    multiplier = int(multiplier_match.group()) if multiplier_match else 1
+    position = multiplier_match.end() if multiplier_match else 0
+
+    stack = [{}]
+    last = None  # counts the next number multiplies: an element or a closed group
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if match is None:
+            raise ValueError(f'Unexpected {text[position]!r} in formula {formula!r}')
+        position = match.end()
+        element, number, opening, closing, _ = match.groups()
+        if element:
+            if element not in ELEMENTS:
+                raise ValueError(f'Unknown element {element!r} in formula {formula!r}')
+            last = {element: 1}
+            stack[-1][element] = stack[-1].get(element, 0) + 1
+        elif number:
+            if last is None:
+                raise ValueError(f'Misplaced count in formula {formula!r}')
+            for symbol, count in last.items():
+                stack[-1][symbol] += count * (int(number) - 1)
+            last = None
+        elif opening:
+            stack.append({})
+            last = None
+        elif closing:
+            if len(stack) == 1:
+                raise ValueError(f'Unbalanced brackets in formula {formula!r}')
+            group = stack.pop()
+            for symbol, count in group.items():
+                stack[-1][symbol] = stack[-1].get(symbol, 0) + count
+            last = group
+    if len(stack) != 1:
+        raise ValueError(f'Unbalanced brackets in formula {formula!r}')
+    return {symbol: count * multiplier for symbol, count in stack[0].items()}
+
+
+@lru_cache(maxsize=4096)
+def _element_counts(formula):
+    counts = {}
+    for component in _COMPONENT_SEPARATORS.split(formula):
+        if not component.strip():
+            raise ValueError(f'Empty part in formula {formula!r}')
+        for symbol, count in _parse_component(component.strip(), formula).items():
+            counts[symbol] = counts.get(symbol, 0) + count
+    counts = {symbol: count for symbol, count in counts.items() if count}
+    if not counts:
+        raise ValueError(f'No elements in formula {formula!r}')
+    # Hill order: carbon, hydrogen, then the rest alphabetically
+    order = sorted(counts, key=lambda symbol: ({'C': 0, 'H': 1}.get(symbol, 2) if 'C' in counts else 2, symbol))
+    return tuple((symbol, counts[symbol]) for symbol in order)
+
+
+def element_counts(formula):
+    """`{element: count}` of a formula in Hill order; raises ValueError for formulas that do not parse"""
+    return dict(_element_counts(formula.strip()))
+
+
+def monoisotopic_mass(formula):
+    return sum(ELEMENTS[symbol][0] * count for symbol, count in _element_counts(formula.strip()))
+
+
+def average_mass(formula):
+    return sum(ELEMENTS[symbol][1] * count for symbol, count in _element_counts(formula.strip()))
+
+
+def mass_columns(formula):
+    """The monoisotopic_mass and average_mass values for a chemical_formula; None for formulas that do not parse"""
+    try:
+        if formula:
+            return {'monoisotopic_mass': monoisotopic_mass(formula), 'average_mass': average_mass(formula)}
+    except ValueError:
+        pass
+    return {'monoisotopic_mass': None, 'average_mass': None}
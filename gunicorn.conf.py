@@ -0,0 +1,54 @@
+"""
+gunicorn settings for the Flask application
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+GUNICORN_PROFILE picks the worker model:
+
+- `io` (default): gthread workers, one process per core with several
+  threads each, for requests that mostly wait on SQLite or on slow clients
+- `cpu`: sync workers, one single-threaded process per core plus one, for
+  requests that mostly run Python (listing serialization, batch dose
+  analysis) and would only contend for the GIL in threads
+
+GUNICORN_WORKERS and GUNICORN_THREADS override the profile;
+`python3 benchmark.py gunicorn` sweeps both to find where throughput stops
+growing on a given machine. The app is preloaded, so the catalog caches are
+built once in the master and shared by the workers (see wsgi.py), and
+workers are recycled after GUNICORN_MAX_REQUESTS requests.
+"""
+
+import multiprocessing
+import os
+
+CORES = multiprocessing.cpu_count()
+
+PROFILES = {
+    'io': {'workers': CORES, 'threads': 8},
+    'cpu': {'workers': CORES + 1, 'threads': 1},
+}
+
+profile = PROFILES[os.environ.get('GUNICORN_PROFILE', 'io')]
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', profile['workers']))
+threads = int(os.environ.get('GUNICORN_THREADS', profile['threads']))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Build the catalog caches before forking so the workers share them
+preload_app = True
+
+# Recycle workers to bound the growth of per-process memory (response cache, fragmentation);
+# the jitter keeps them from all restarting at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+timeout = 30
+graceful_timeout = 30
+# Idle keep-alive connections only hold a gthread worker's thread for this long
+keepalive = 5
+backlog = 2048
+
+# The worker heartbeat file is touched every second; keep it off disk where possible
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
@@ -0,0 +1,293 @@
+"""
+HTTP caching support for the read-only reference catalog
+
+The catalog only changes when it is (re)loaded, so every read endpoint shares
+one catalog version. It is computed once from the database and then kept in
+memory, which lets conditional requests be answered with 304 Not Modified
+without running the catalog queries. Encoded response bodies are kept in a
+byte-bounded LRU cache that is cleared whenever the catalog changes.
+
+Writes can come from other processes (the importer, init_database.py, other
+workers), so the database keeps a revision row that triggers bump on every
+write to the catalog tables. Servers read that one row per request and drop
+their caches when it moved since they were built.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+
+REVISION_TABLE = 'catalog_revision'
+REVISION_QUERY = f"SELECT revision, changed_at FROM {REVISION_TABLE} WHERE id = 1"
+
+
+def revision_ddl(tables):
+    """Return the SQLite statements creating the revision row and the triggers bumping it.
+
+    The row starts at a random revision, so a database rebuilt from scratch
+    never repeats the revision of the file it replaced.
+    """
+    statements = [
+        f"""CREATE TABLE IF NOT EXISTS {REVISION_TABLE} (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            revision INTEGER NOT NULL,
+            changed_at TIMESTAMP NOT NULL
+        )""",
+        f"INSERT OR IGNORE INTO {REVISION_TABLE} (id, revision, changed_at) "
+        f"VALUES (1, abs(random() / 2), CURRENT_TIMESTAMP)",
+    ]
+    for table in tables:
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            statements.append(
+                f"""CREATE TRIGGER IF NOT EXISTS {table}_revision_{operation.lower()} AFTER {operation} ON {table} BEGIN
+                    UPDATE {REVISION_TABLE} SET revision = revision + 1, changed_at = CURRENT_TIMESTAMP WHERE id = 1;
+                END""")
+    return statements
+
+
+def drop_revision_ddl(tables):
+    """Return the statements removing the revision triggers and row"""
+    return ([f"DROP TRIGGER IF EXISTS {table}_revision_{operation}"
+             for table in tables for operation in ('insert', 'update', 'delete')] +
+            [f"DROP TABLE IF EXISTS {REVISION_TABLE}"])
+
+
+def parse_sqlite_timestamp(value):
+    """POSIX time of a CURRENT_TIMESTAMP value, which SQLite stores as UTC text"""
+    if value is None:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+
+
+class CatalogVersion:
+    """Current version of the catalog, used for ETag and Last-Modified headers.
+
+    `loader` is called without arguments and returns a `(fingerprint, timestamp)`
+    pair: any string that changes when the data changes (row counts, max ids,
+    max created_at, the database revision) and the POSIX time of the newest
+    row or write, or None. It runs lazily the first time a validator is needed
+    after startup or after `invalidate()`.
+
+    `revision`, when given, returns the database's revision (see
+    revision_ddl), or None for a database without one. `changed()` compares it
+    with the revision the validators were computed at.
+    """
+
+    def __init__(self, loader, revision=None):
+        self._loader = loader
+        self._revision = revision
+        self._lock = threading.Lock()
+        self._tag = None
+        self._last_modified = None
+        self._loaded_revision = None
+        self.generation = 0
+
+    def _ensure_loaded(self):
+        if self._tag is not None:
+            return
+        with self._lock:
+            if self._tag is not None:
+                return
+            revision = self._revision() if self._revision else None
+            fingerprint, timestamp = self._loader()
+            last_modified = int(timestamp or 0)
+            if revision is None:
+                # Without a shared revision only this process's writes are seen; they bump the
+                # generation, which moves the clock forward even when max(created_at) stays
+                fingerprint = f'{fingerprint}:{self.generation}'
+                if self.generation:
+                    last_modified = max(last_modified, int(time.time()))
+            digest = hashlib.sha1(fingerprint.encode()).hexdigest()
+            self._loaded_revision = revision
+            self._last_modified = last_modified
+            self._tag = digest[:20]
+
+    def changed(self):
+        """Whether the catalog was written, by any process, since the validators were computed.
+
+        Costs one revision lookup; always False without a revision.
+        """
+        if self._revision is None or self._tag is None:
+            return False
+        return self._revision() != self._loaded_revision
+
+    def invalidate(self):
+        """Mark the catalog as changed; the next validator lookup reloads it"""
+        with self._lock:
+            self.generation += 1
+            self._tag = None
+
+    def etag(self, variant='json'):
+        """Strong ETag for one representation (json, ndjson-gzip, ...) of a resource"""
+        self._ensure_loaded()
+        return f'"{self._tag}-{variant}"'
+
+    @property
+    def last_modified(self):
+        """POSIX timestamp of the last catalog change, in whole seconds"""
+        self._ensure_loaded()
+        return self._last_modified
+
+
+class ResponseCache:
+    """LRU cache of encoded response bodies, bounded by their total size in bytes.
+
+    `clear()` starts a new generation. A body built while a clear happened is
+    refused by `put()`, so a response computed from pre-change data can never
+    be cached after the invalidation.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body, generation=None):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+            }
+
+
+# Parameters holding comma-separated sets whose order does not change the response
+SET_PARAMS = ('fields', 'include')
+
+
+def cache_key(path, params, variant='json'):
+    """Build a response cache key from a path and its (name, value) query pairs.
+
+    Parameter order, empty values and the order of names inside fields= and
+    include= do not change the key.
+    """
+    normalized = []
+    for name, value in params:
+        if name in SET_PARAMS:
+            value = ','.join(sorted({item.strip() for item in value.split(',') if item.strip()}))
+        if value:
+            normalized.append((name, value))
+    return (path, variant, tuple(sorted(normalized)))
+
+
+def format_http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def etag_matches(if_none_match, etag):
+    """Evaluate an If-None-Match header value against an ETag.
+
+    Uses the weak comparison RFC 9110 prescribes for If-None-Match, so tags a
+    proxy marked with W/ still match.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = {_strip_weak(tag.strip()) for tag in if_none_match.split(',')}
+    return _strip_weak(etag) in candidates
+
+
+def _strip_weak(tag):
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def not_modified_since(if_modified_since, last_modified):
+    """Evaluate an If-Modified-Since header value against a POSIX timestamp"""
+    if not if_modified_since:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return last_modified <= since
+
+
+def is_not_modified(headers, etag, last_modified):
+    """Decide whether a conditional GET can be answered with 304.
+
+    If-None-Match takes precedence; If-Modified-Since is only consulted when the
+    client sent no ETag.
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    return not_modified_since(headers.get('If-Modified-Since'), last_modified)
+
+
+def validator_headers(version, variant, max_age):
+    """Response headers advertising the catalog version to clients and proxies"""
+    return {
+        'ETag': version.etag(variant),
+        'Last-Modified': format_http_date(version.last_modified),
+        'Cache-Control': f'public, max-age={max_age}',
+        'Vary': 'Accept, Accept-Encoding',
+    }
+
+
+def coded_headers(headers, encoding):
+    """Validator headers for a body sent with a content coding, or unchanged for a plain body.
+
+    Every coding actually applied is its own representation with its own
+    ETag. A body left uncompressed, such as one below compression.MIN_SIZE,
+    keeps the plain tag even when the client accepts a coding.
+    """
+    if not encoding or 'ETag' not in headers:
+        return headers
+    return dict(headers, ETag=f"{headers['ETag'][:-1]}-{encoding}\"")
+
+
+def not_modified_headers(request_headers, headers, encoding, last_modified):
+    """The validator headers to send with a 304, or None when the client's copy is stale.
+
+    `headers` are the plain representation's; `encoding` is the coding the
+    client accepts. Whether the body would be compressed depends on its size,
+    so a tag of either representation is current.
+    """
+    for candidate in (headers, coded_headers(headers, encoding)):
+        if is_not_modified(request_headers, candidate['ETag'], last_modified):
+            return candidate
+    return None
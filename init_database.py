@@ -11,15 +11,282 @@ This script populates the database with comprehensive information about:
 Data sources: Clinical toxicology references, forensic guidelines, and pharmacological databases
 """
 
-from app import app, db, Substance, Metabolite
+from app import (app, db, Substance, Metabolite, DetectionWindow, create_catalog_revision, create_search_index,
+                 drop_catalog_revision, drop_search_index, reset_catalog_caches)
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+import argparse
+import durations
+import formula
+import hashlib
 import json
+import metabolite_search
+import units
 
-def init_database():
-    """Initialize the database with comprehensive forensic toxicology data"""
+# Substances inserted per executemany round trip; their metabolites go in the same round
+BULK_BATCH_SIZE = 5000
+
+def column_defaults(table, now):
+    """Values for columns a row leaves out, so every row of an executemany has the same keys"""
+    defaults = {}
+    for column in table.columns:
+        if column.primary_key:
+            continue
+        default = column.default
+        if default is None:
+            defaults[column.name] = None
+        elif default.is_callable:
+            defaults[column.name] = now  # created_at, updated_at
+        else:
+            defaults[column.name] = default.arg
+    return defaults
+
+def set_bulk_pragmas(connection):
+    """Trade durability for speed while loading; returns the settings to restore"""
+    previous = {
+        'synchronous': connection.exec_driver_sql('PRAGMA synchronous').scalar(),
+        'journal_mode': connection.exec_driver_sql('PRAGMA journal_mode').scalar(),
+    }
+    connection.exec_driver_sql('PRAGMA synchronous = OFF')
+    # Leaving WAL needs exclusive access, and WAL is already cheap for a single big transaction
+    if previous['journal_mode'].lower() != 'wal':
+        connection.exec_driver_sql('PRAGMA journal_mode = MEMORY')
+    connection.commit()  # end the autobegun transaction; PRAGMAs are not transactional
+    return previous
+
+def restore_pragmas(connection, previous):
+    connection.exec_driver_sql(f"PRAGMA journal_mode = {previous['journal_mode']}")
+    connection.exec_driver_sql(f"PRAGMA synchronous = {previous['synchronous']}")
+    connection.commit()
+
+@contextmanager
+def bulk_connection():
+    """Engine connection tuned for bulk writes, used outside the ORM session.
+    
+    Must be used inside an application context. Callers manage their own
+    transactions and call reset_catalog_caches() once they are done.
+    """
+    db.session.close()
+    with db.engine.connect() as connection:
+        sqlite = connection.dialect.name == 'sqlite'
+        previous = set_bulk_pragmas(connection) if sqlite else None
+        try:
+            yield connection
+        finally:
+            if sqlite:
+                restore_pragmas(connection, previous)
+
+def content_hash(data):
+    """Digest of a substance dict including its metabolites, stored to detect changed records"""
+    data = {key: value for key, value in data.items() if key not in ('content_hash', 'seeded')}
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+def next_id(connection, table):
+    return connection.execute(func.coalesce(func.max(table.c.id), 0).select()).scalar() + 1
+
+def insert_metabolites(connection, metabolites):
+    """Insert metabolite dicts that already carry their substance_id; returns the row count"""
+    defaults = column_defaults(Metabolite.__table__, datetime.utcnow())
+    rows = []
+    for metabolite_id, metabolite in enumerate(metabolites, next_id(connection, Metabolite.__table__)):
+        row = dict(defaults, **metabolite)
+        row['id'] = metabolite_id
+        row['normalized_name'] = metabolite_search.normalize_name(row['name'])
+        row.update(formula.mass_columns(row['chemical_formula']))
+        row.update(units.canonical_columns(row, units.METABOLITE_THRESHOLDS, row['unit']))
+        rows.append(row)
+    if rows:
+        connection.execute(Metabolite.__table__.insert(), rows)
+    return len(rows)
+
+def derived_columns(row):
+    """Fill a substance row's ng/mL, mass and half-life hour columns; returns its detection window dicts.
+
+    The window dicts have no substance_id yet.
+    """
+    row.update(units.canonical_columns(row, units.SUBSTANCE_THRESHOLDS, row['dose_unit']))
+    row.update(formula.mass_columns(row['chemical_formula']))
+    row.update(durations.half_life_columns(row.get('half_life')))
+    return [{'matrix': matrix, 'min_hours': min_hours, 'max_hours': max_hours}
+            for matrix, min_hours, max_hours in durations.parse_detection_windows(row.get('detection_window'))]
+
+def insert_detection_windows(connection, windows):
+    if windows:
+        connection.execute(DetectionWindow.__table__.insert(), windows)
+
+def insert_substances(connection, substances, batch_size=BULK_BATCH_SIZE):
+    """Insert substance dicts, each with an optional 'metabolites' list, in the caller's transaction.
+    
+    Rows go through Core executemany with pre-assigned ids instead of one ORM
+    flush per substance, so the caller needs exclusive write access while it
+    runs. Returns (substance_count, metabolite_count).
+    """
+    defaults = column_defaults(Substance.__table__, datetime.utcnow())
+    substance_count = metabolite_count = 0
+    substance_id = next_id(connection, Substance.__table__)
+    
+    substances = iter(substances)
+    while True:
+        batch = list(islice(substances, batch_size))
+        if not batch:
+            break
+        
+        substance_rows = []
+        metabolite_rows = []
+        window_rows = []
+        for data in batch:
+            data = dict(data)
+            data.setdefault('content_hash', content_hash(data))
+            metabolites = data.pop('metabolites', None) or []
+            row = dict(defaults, **data)
+            row['id'] = substance_id
+            substance_rows.append(row)
+            metabolite_rows.extend(dict(metabolite, substance_id=substance_id) for metabolite in metabolites)
+            window_rows.extend(dict(window, substance_id=substance_id) for window in derived_columns(row))
+            substance_id += 1
+        
+        connection.execute(Substance.__table__.insert(), substance_rows)
+        substance_count += len(substance_rows)
+        metabolite_count += insert_metabolites(connection, metabolite_rows)
+        insert_detection_windows(connection, window_rows)
+    
+    return substance_count, metabolite_count
+
+def bulk_load(substances, batch_size=BULK_BATCH_SIZE):
+    """Load substance dicts with their metabolites in one transaction.
+    
+    The full-text index is dropped and rebuilt once at the end instead of
+    being updated by triggers for every row; the catalog revision is replaced
+    once the same way. Must be called inside an application context; returns
+    (substance_count, metabolite_count).
+    """
+    with bulk_connection() as connection:
+        sqlite = connection.dialect.name == 'sqlite'
+        with connection.begin():
+            if sqlite:
+                # pysqlite autocommits DDL outside an explicit transaction; keep the
+                # index rebuild atomic with the load
+                connection.exec_driver_sql('BEGIN')
+                drop_search_index(None, connection)
+                drop_catalog_revision(None, connection)
+            counts = insert_substances(connection, substances, batch_size)
+            if sqlite:
+                create_search_index(None, connection)
+                # A new row starts at a new random revision, which running servers see as a change
+                create_catalog_revision(None, connection)
+    
+    reset_catalog_caches()
+    return counts
+
+# INSERT ... ON CONFLICT DO UPDATE for the databases that support it
+UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+# Names per IN (...) query, well below SQLite's bound parameter limit
+NAME_BATCH_SIZE = 500
+
+def substance_ids(connection, names):
+    """Map substance names to ids, for the names that exist"""
+    names = list(names)
+    ids = {}
+    for start in range(0, len(names), NAME_BATCH_SIZE):
+        batch = names[start:start + NAME_BATCH_SIZE]
+        ids.update(connection.execute(select(Substance.name, Substance.id).where(Substance.name.in_(batch))).all())
+    return ids
+
+def upsert_substances(connection, substances):
+    """Insert or update substance dicts by name and replace their metabolites and detection windows.
+    
+    Runs in the caller's transaction. Existing substances keep their id.
+    Returns (substance_count, metabolite_count).
+    """
+    defaults = column_defaults(Substance.__table__, datetime.utcnow())
+    insert = UPSERT_DIALECTS[connection.dialect.name]
+    statement = insert(Substance.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Substance.name],
+        set_={name: statement.excluded[name] for name in defaults if name not in ('name', 'created_at')}
+    )
+    
+    rows = []
+    metabolites = {}
+    windows = {}
+    for data in substances:
+        data = dict(data)
+        data.setdefault('content_hash', content_hash(data))
+        metabolites[data['name']] = data.pop('metabolites', None) or []
+        row = dict(defaults, **data)
+        windows[data['name']] = derived_columns(row)
+        rows.append(row)
+    if not rows:
+        return 0, 0
+    connection.execute(statement, rows)
+    
+    ids = substance_ids(connection, metabolites)
+    connection.execute(delete(Metabolite).where(Metabolite.substance_id.in_(list(ids.values()))))
+    connection.execute(delete(DetectionWindow).where(DetectionWindow.substance_id.in_(list(ids.values()))))
+    metabolite_rows = [dict(metabolite, substance_id=ids[name])
+                       for name, children in metabolites.items() for metabolite in children]
+    insert_detection_windows(connection, [dict(window, substance_id=ids[name])
+                                          for name, children in windows.items() for window in children])
+    return len(rows), insert_metabolites(connection, metabolite_rows)
+
+def sync_catalog(substances):
+    """Make the catalog match the given substance dicts, writing only what changed.
+    
+    Each record's content hash is compared with the stored one: new and
+    changed substances are upserted by name with their metabolites replaced,
+    and substances a previous sync seeded that are no longer listed are
+    deleted. Rows loaded by other means, such as `flask load-reference-data`,
+    are left alone. An empty catalog is filled with bulk_load() instead. Must
+    be called inside an application context; returns (changed, removed) counts.
+    """
+    if db.engine.dialect.name not in UPSERT_DIALECTS:
+        raise RuntimeError(f'Incremental sync is not supported on {db.engine.dialect.name}; use --rebuild')
+    
+    substances = [dict(data, seeded=True) for data in substances]
+    stored = {name: (digest, bool(seeded)) for name, digest, seeded in
+              db.session.execute(select(Substance.name, Substance.content_hash, Substance.seeded))}
+    db.session.close()
+    if not stored:
+        bulk_load(substances)
+        return len(substances), 0
+    
+    changed = []
+    for data in substances:
+        digest = content_hash(data)
+        # Rows from before the seeded flag are marked by rewriting them once
+        if stored.pop(data['name'], None) != (digest, True):
+            changed.append(dict(data, content_hash=digest))
+    removed = [name for name, (_, seeded) in stored.items() if seeded]
+    if not changed and not removed:
+        return 0, 0
+    
+    with bulk_connection() as connection:
+        with connection.begin():
+            upsert_substances(connection, changed)
+            for start in range(0, len(removed), NAME_BATCH_SIZE):
+                ids = list(substance_ids(connection, removed[start:start + NAME_BATCH_SIZE]).values())
+                connection.execute(delete(Metabolite).where(Metabolite.substance_id.in_(ids)))
+                connection.execute(delete(DetectionWindow).where(DetectionWindow.substance_id.in_(ids)))
+                connection.execute(delete(Substance).where(Substance.id.in_(ids)))
+    
+    reset_catalog_caches()
+    return len(changed), len(removed)
+
+def init_database(rebuild=False):
+    """Initialize the database with comprehensive forensic toxicology data.
+    
+    By default the tables are created if needed and synced with the data
+    below, so an unchanged catalog is left untouched. With rebuild=True all
+    tables are dropped and reloaded.
+    """
     
     with app.app_context():
-        # Drop and recreate all tables
-        db.drop_all()
+        if rebuild:
+            db.drop_all()
         db.create_all()
         
         # Pharmaceutical substances
@@ -454,22 +721,17 @@ def init_database():
         # Combine all substances
         all_substances = pharmaceuticals + narcotics + synthetics
         
-        # Add substances to database
-        for substance_data in all_substances:
-            metabolites_data = substance_data.pop('metabolites', [])
-            
-            substance = Substance(**substance_data)
-            db.session.add(substance)
-            db.session.flush()  # Get the ID
-            
-            # Add metabolites
-            for metabolite_data in metabolites_data:
-                metabolite_data['substance_id'] = substance.id
-                metabolite = Metabolite(**metabolite_data)
-                db.session.add(metabolite)
-        
-        db.session.commit()
-        print(f"Successfully initialized database with {len(all_substances)} substances")
+        # Add new and changed substances and their metabolites to database
+        if rebuild:
+            bulk_load([dict(data, seeded=True) for data in all_substances])
+            print(f"Successfully initialized database with {len(all_substances)} substances")
+        else:
+            changed, removed = sync_catalog(all_substances)
+            print(f"Database synced with {len(all_substances)} substances "
+                  f"({changed} added or updated, {removed} removed)")
 
 if __name__ == "__main__":
-    init_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Create or sync the forensic toxicology database')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='drop all tables and load the catalog from scratch')
+    init_database(parser.parse_args().rebuild)
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+Accurate-mass screening of measured m/z values against the catalog
+
+Every substance and metabolite with a parseable formula is held in one list
+sorted by monoisotopic mass. A measured m/z is turned into a neutral mass
+for the chosen adduct, and the candidates within the ppm tolerance are the
+slice between two bisects. A peak list of thousands of masses costs two
+binary searches per peak.
+"""
+
+import bisect
+import math
+import re
+
+# Mass of a proton and of an electron, in daltons
+PROTON = 1.007276466812
+ELECTRON = 0.00054857990946
+
+# Adduct: (charge, mass added to the neutral molecule); m/z = (M + shift) / charge
+ADDUCTS = {
+    'M': (1, 0.0),
+    '[M+H]+': (1, PROTON),
+    '[M+Na]+': (1, 22.9897692809 - ELECTRON),
+    '[M+K]+': (1, 38.96370668 - ELECTRON),
+    '[M+NH4]+': (1, 14.0030740048 + 3 * 1.00782503207 + PROTON),
+    '[M+2H]2+': (2, 2 * PROTON),
+    '[M-H]-': (1, -PROTON),
+}
+DEFAULT_ADDUCT = '[M+H]+'
+# Short spellings without brackets and charge: M+H, M+Na, M-H...
+ADDUCT_ALIASES = {re.sub(r'^\[|\]\d*[+-]$', '', name): name for name in ADDUCTS}
+
+DEFAULT_PPM = 5.0
+MAX_PPM = 100.0
+# Peaks per request
+MAX_PEAKS = 10000
+
+
+def neutral_mass(mz, adduct):
+    """The neutral monoisotopic mass of a molecule observed at `mz` as `adduct`"""
+    charge, shift = ADDUCTS[adduct]
+    return mz * charge - shift
+
+
+def parse_request(mz_values, ppm, adduct):
+    """Validate the mz, ppm and adduct parameters; returns (mz list, ppm, adduct).
+
+    `mz_values` is a list of numbers or numeric strings; ppm and adduct may be
+    None for the defaults. Raises ValueError for anything else.
+    """
+    # An unescaped + in a query string arrives as a space, which no adduct contains
+    adduct = (adduct or DEFAULT_ADDUCT).replace(' ', '+')
+    adduct = ADDUCT_ALIASES.get(adduct, adduct)
+    if adduct not in ADDUCTS:
+        raise ValueError(f"Unknown adduct {adduct!r}; use one of {', '.join(ADDUCTS)}")
+    try:
+        ppm = DEFAULT_PPM if ppm is None else float(ppm)
+    except (TypeError, ValueError):
+        raise ValueError('ppm must be a number')
+    if not 0 < ppm <= MAX_PPM:
+        raise ValueError(f'ppm must be above 0 and at most {MAX_PPM:g}')
+
+    if not mz_values:
+        raise ValueError('Give at least one mz')
+    if len(mz_values) > MAX_PEAKS:
+        raise ValueError(f'At most {MAX_PEAKS} mz values per search')
+    masses = []
+    for value in mz_values:
+        if isinstance(value, bool):
+            raise ValueError('mz values must be positive numbers')
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError('mz values must be positive numbers')
+        if not math.isfinite(value) or value <= 0:
+            raise ValueError('mz values must be positive numbers')
+        masses.append(value)
+    return masses, ppm, adduct
+
+
+class MassIndex:
+    """Substances and metabolites sorted by monoisotopic mass.
+
+    `entries` yields `(monoisotopic_mass, candidate)` pairs, where candidate is
+    the JSON-ready dict returned for a match; entries without a mass are
+    skipped.
+    """
+
+    def __init__(self, entries):
+        entries = sorted(((mass, candidate) for mass, candidate in entries if mass is not None),
+                         key=lambda entry: entry[0])
+        self.masses = [mass for mass, _ in entries]
+        self.candidates = [candidate for _, candidate in entries]
+
+    def __len__(self):
+        return len(self.masses)
+
+    def candidates_near(self, mass, ppm):
+        """Candidates within `ppm` of a neutral mass, closest first, with their ppm error"""
+        tolerance = mass * ppm / 1e6
+        start = bisect.bisect_left(self.masses, mass - tolerance)
+        stop = bisect.bisect_right(self.masses, mass + tolerance)
+        found = [dict(self.candidates[index], ppm_error=round((mass - self.masses[index]) / self.masses[index] * 1e6, 3))
+                 for index in range(start, stop)]
+        found.sort(key=lambda candidate: abs(candidate['ppm_error']))
+        return found
+
+    def screen(self, mz_values, ppm, adduct):
+        """Match every measured m/z; returns one result per peak, in request order"""
+        results = []
+        for mz in mz_values:
+            mass = neutral_mass(mz, adduct)
+            results.append({'mz': mz, 'neutral_mass': round(mass, 6), 'matches': self.candidates_near(mass, ppm)})
+        return results
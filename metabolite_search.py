@@ -0,0 +1,82 @@
+"""
+Reverse lookup from detected metabolites to their candidate parent substances
+
+Casework usually starts from a metabolite found in a sample (benzoylecgonine,
+6-monoacetylmorphine) and asks which substances could have produced it. Both
+servers store every metabolite's name lowercased without spaces or punctuation
+in an indexed `normalized_name` column, and index `chemical_formula`, so the
+metabolites matching any detected name or formula come back in one indexed
+query. The parents are then ranked by how many of the detected metabolites
+they explain.
+
+Unlike autocomplete's fold, the key never changes letters: merging spelling
+variants and repeated letters makes distinct metabolites such as HMA and HMMA
+share a key.
+"""
+
+import unicodedata
+
+# Detected names and formulas per request
+MAX_TERMS = 50
+
+
+def normalize_name(name):
+    """The `normalized_name` key of a metabolite name or a searched name: lowercase letters and digits only"""
+    return ''.join(char for char in unicodedata.normalize('NFKC', name or '').lower() if char.isalnum())
+
+
+def normalize_formula(formula):
+    """A formula as stored in `chemical_formula`, without spaces; element symbols are case sensitive"""
+    return ''.join((formula or '').split())
+
+
+def parse_terms(names, formulas):
+    """Validate the name= and formula= parameters; returns `{key: term}` for names and for formulas.
+
+    Keys are what the columns hold, terms what the client sent. Raises
+    ValueError without any term or with more than MAX_TERMS.
+    """
+    name_keys = {normalize_name(name): name.strip() for name in names if normalize_name(name)}
+    formula_keys = {normalize_formula(formula): formula.strip() for formula in formulas if normalize_formula(formula)}
+    if not name_keys and not formula_keys:
+        raise ValueError('Give at least one name= or formula= of a detected metabolite')
+    if len(name_keys) + len(formula_keys) > MAX_TERMS:
+        raise ValueError(f'At most {MAX_TERMS} names and formulas per search')
+    return name_keys, formula_keys
+
+
+def rank_parents(rows, name_keys, formula_keys):
+    """Group matching metabolite rows by parent substance, best candidates first.
+
+    `rows` yields `(substance_id, substance_name, category, metabolite_id,
+    metabolite_name, chemical_formula, normalized_name)` for every metabolite
+    matching a key. Each parent lists the detected terms it explains and the
+    matching metabolites. Parents explaining more terms come first; on a tie,
+    name matches count for more than formula matches, which isomers share.
+    """
+    parents = {}
+    for substance_id, substance_name, category, metabolite_id, metabolite_name, formula, normalized in rows:
+        parent = parents.get(substance_id)
+        if parent is None:
+            parent = parents[substance_id] = {
+                'id': substance_id, 'name': substance_name, 'category': category,
+                'names': {}, 'formulas': {}, 'metabolites': []
+            }
+        if normalized in name_keys:
+            parent['names'][normalized] = name_keys[normalized]
+        if formula in formula_keys:
+            parent['formulas'][formula] = formula_keys[formula]
+        parent['metabolites'].append({'id': metabolite_id, 'name': metabolite_name, 'chemical_formula': formula})
+
+    ranked = sorted(parents.values(),
+                    key=lambda parent: (-len(parent['names']) - len(parent['formulas']), -len(parent['names']),
+                                        parent['name']))
+    return [{
+        'id': parent['id'],
+        'name': parent['name'],
+        'category': parent['category'],
+        'match_count': len(parent['names']) + len(parent['formulas']),
+        'matched_names': list(parent['names'].values()),
+        'matched_formulas': list(parent['formulas'].values()),
+        'metabolites': parent['metabolites']
+    } for parent in ranked]
@@ -0,0 +1,35 @@
+"""Keep a catalog revision row that triggers bump on every catalog write
+
+Revision ID: 0795624ba354
+Revises: e2b6d8f41a97
+Create Date: 2026-10-18 21:05:37.214870
+
+"""
+from alembic import op
+
+import http_cache
+
+
+# revision identifiers, used by Alembic.
+revision = '0795624ba354'
+down_revision = 'e2b6d8f41a97'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('substance', 'metabolite', 'detection_window')
+
+
+def upgrade():
+    # SQLite trigger syntax; other databases keep process-local invalidation
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in http_cache.revision_ddl(TABLES):
+        op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in http_cache.drop_revision_ddl(TABLES):
+        op.execute(statement)
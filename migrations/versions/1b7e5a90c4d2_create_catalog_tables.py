@@ -0,0 +1,63 @@
+"""Create the substance and metabolite tables
+
+Revision ID: 1b7e5a90c4d2
+Revises:
+Create Date: 2026-10-17 22:58:12.604318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b7e5a90c4d2'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The tables as first released; databases created with db.create_all() already have them
+    existing = sa.inspect(op.get_bind()).get_table_names()
+    if 'substance' not in existing:
+        op.create_table('substance',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=200), nullable=False),
+        sa.Column('common_names', sa.Text(), nullable=True),
+        sa.Column('chemical_formula', sa.String(length=100), nullable=True),
+        sa.Column('cas_number', sa.String(length=50), nullable=True),
+        sa.Column('category', sa.String(length=100), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('mechanism_of_action', sa.Text(), nullable=True),
+        sa.Column('therapeutic_dose_min', sa.Float(), nullable=True),
+        sa.Column('therapeutic_dose_max', sa.Float(), nullable=True),
+        sa.Column('toxic_dose', sa.Float(), nullable=True),
+        sa.Column('lethal_dose', sa.Float(), nullable=True),
+        sa.Column('dose_unit', sa.String(length=20), nullable=True),
+        sa.Column('half_life', sa.String(length=50), nullable=True),
+        sa.Column('detection_window', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+        )
+    if 'metabolite' not in existing:
+        op.create_table('metabolite',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('substance_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=200), nullable=False),
+        sa.Column('chemical_formula', sa.String(length=100), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('formation_pathway', sa.Text(), nullable=True),
+        sa.Column('detection_significance', sa.Text(), nullable=True),
+        sa.Column('therapeutic_range_min', sa.Float(), nullable=True),
+        sa.Column('therapeutic_range_max', sa.Float(), nullable=True),
+        sa.Column('toxic_level', sa.Float(), nullable=True),
+        sa.Column('unit', sa.String(length=20), nullable=True),
+        sa.ForeignKeyConstraint(['substance_id'], ['substance.id']),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('metabolite')
+    op.drop_table('substance')
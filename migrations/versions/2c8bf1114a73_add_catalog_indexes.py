@@ -0,0 +1,34 @@
+"""Add indexes for catalog filters and metabolite lookups
+
+Revision ID: 2c8bf1114a73
+Revises: 1b7e5a90c4d2
+Create Date: 2026-10-17 23:06:44.431147
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '2c8bf1114a73'
+down_revision = '1b7e5a90c4d2'
+branch_labels = None
+depends_on = None
+
+
+# Databases created with db.create_all() after this revision already have the
+# indexes, so they are created only when missing
+INDEXES = (
+    ('ix_metabolite_substance_id', 'metabolite', 'substance_id'),
+    ('ix_substance_cas_number', 'substance', 'cas_number'),
+    ('ix_substance_category_name', 'substance', 'category, name'),
+)
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+
+
+def downgrade():
+    for name, _, _ in reversed(INDEXES):
+        op.execute(f'DROP INDEX IF EXISTS {name}')
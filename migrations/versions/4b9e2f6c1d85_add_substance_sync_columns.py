@@ -0,0 +1,35 @@
+"""Add content_hash and updated_at to substance for incremental sync
+
+Revision ID: 4b9e2f6c1d85
+Revises: 7d41e0a9c3b2
+Create Date: 2026-10-17 23:41:52.207316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b9e2f6c1d85'
+down_revision = '7d41e0a9c3b2'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = (
+    ('updated_at', sa.DateTime()),
+    ('content_hash', sa.String(length=64)),
+)
+
+
+def upgrade():
+    # Databases created with db.create_all() after this revision already have the columns
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('substance')}
+    for name, type_ in COLUMNS:
+        if name not in existing:
+            op.add_column('substance', sa.Column(name, type_, nullable=True))
+
+
+def downgrade():
+    for name, _ in reversed(COLUMNS):
+        op.drop_column('substance', name)
@@ -0,0 +1,57 @@
+"""Store every threshold converted to ng/mL for cross-substance comparisons
+
+Revision ID: 5e8d1b3a7c60
+Revises: 9a3c5e7f2b14
+Create Date: 2026-10-18 14:03:21.447915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import units
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8d1b3a7c60'
+down_revision = '9a3c5e7f2b14'
+branch_labels = None
+depends_on = None
+
+
+# (table, unit column, threshold columns, indexed thresholds)
+TABLES = (
+    ('substance', 'dose_unit', units.SUBSTANCE_THRESHOLDS, ('toxic_dose',)),
+    ('metabolite', 'unit', units.METABOLITE_THRESHOLDS, ('toxic_level',)),
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    for table, unit_column, thresholds, indexed in TABLES:
+        # Databases created with db.create_all() after this revision already have the columns
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        added = [column for column in thresholds if column + units.CANONICAL_SUFFIX not in existing]
+        if not added:
+            continue
+        for column in added:
+            op.add_column(table, sa.Column(column + units.CANONICAL_SUFFIX, sa.Float(), nullable=True))
+        for column in indexed:
+            op.create_index(f'ix_{table}_{column}{units.CANONICAL_SUFFIX}', table,
+                            [column + units.CANONICAL_SUFFIX])
+
+        # Convert the thresholds already stored
+        rows = bind.execute(sa.text(f"SELECT id, {unit_column}, {', '.join(thresholds)} FROM {table}")).mappings()
+        updates = [dict(units.canonical_columns(row, thresholds, row[unit_column]), id=row['id']) for row in rows]
+        if updates:
+            assignments = ', '.join(f'{column}{units.CANONICAL_SUFFIX} = :{column}{units.CANONICAL_SUFFIX}'
+                                    for column in thresholds)
+            bind.execute(sa.text(f'UPDATE {table} SET {assignments} WHERE id = :id'), updates)
+
+
+def downgrade():
+    for table, _, thresholds, indexed in reversed(TABLES):
+        for column in indexed:
+            op.drop_index(f'ix_{table}_{column}{units.CANONICAL_SUFFIX}', table_name=table)
+        for column in reversed(thresholds):
+            op.drop_column(table, column + units.CANONICAL_SUFFIX)
@@ -0,0 +1,33 @@
+"""Add import_checkpoint for resumable reference data imports
+
+Revision ID: 7d41e0a9c3b2
+Revises: 2c8bf1114a73
+Create Date: 2026-10-17 23:24:10.512874
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d41e0a9c3b2'
+down_revision = '2c8bf1114a73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created with db.create_all() after this revision already have the table
+    if 'import_checkpoint' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table('import_checkpoint',
+    sa.Column('source', sa.String(length=500), nullable=False),
+    sa.Column('fingerprint', sa.String(length=100), nullable=False),
+    sa.Column('rows_done', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('source')
+    )
+
+
+def downgrade():
+    op.drop_table('import_checkpoint')
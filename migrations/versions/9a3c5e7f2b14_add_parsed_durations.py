@@ -0,0 +1,77 @@
+"""Store half_life and detection_window in hours for range filters
+
+Revision ID: 9a3c5e7f2b14
+Revises: 4b9e2f6c1d85
+Create Date: 2026-10-18 10:12:37.581204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import durations
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3c5e7f2b14'
+down_revision = '4b9e2f6c1d85'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = (
+    ('half_life_min_hours', sa.Float()),
+    ('half_life_max_hours', sa.Float()),
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    # Databases created with db.create_all() after this revision already have the columns and table
+    existing = {column['name'] for column in inspector.get_columns('substance')}
+    missing = [(name, type_) for name, type_ in COLUMNS if name not in existing]
+    for name, type_ in missing:
+        op.add_column('substance', sa.Column(name, type_, nullable=True))
+
+    if inspector.has_table('detection_window'):
+        if not missing:
+            return
+    else:
+        op.create_table(
+            'detection_window',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('substance_id', sa.Integer(), nullable=False),
+            sa.Column('matrix', sa.String(length=50), nullable=False),
+            sa.Column('min_hours', sa.Float(), nullable=False),
+            sa.Column('max_hours', sa.Float(), nullable=False),
+            sa.ForeignKeyConstraint(['substance_id'], ['substance.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_detection_window_substance_id', 'detection_window', ['substance_id'])
+        op.create_index('ix_detection_window_matrix_max_hours', 'detection_window',
+                        ['matrix', 'max_hours', 'substance_id'])
+
+    # Parse the text of the substances already stored
+    substances = bind.execute(sa.text('SELECT id, half_life, detection_window FROM substance')).all()
+    updates = [dict(durations.half_life_columns(half_life), id=substance_id)
+               for substance_id, half_life, _ in substances]
+    if updates:
+        bind.execute(sa.text('UPDATE substance SET half_life_min_hours = :half_life_min_hours, '
+                             'half_life_max_hours = :half_life_max_hours WHERE id = :id'), updates)
+
+    windows = sa.table('detection_window', sa.column('substance_id'), sa.column('matrix'),
+                       sa.column('min_hours'), sa.column('max_hours'))
+    bind.execute(windows.delete())
+    rows = [{'substance_id': substance_id, 'matrix': matrix, 'min_hours': min_hours, 'max_hours': max_hours}
+            for substance_id, _, detection_window in substances
+            for matrix, min_hours, max_hours in durations.parse_detection_windows(detection_window)]
+    if rows:
+        op.bulk_insert(windows, rows)
+
+
+def downgrade():
+    op.drop_index('ix_detection_window_matrix_max_hours', table_name='detection_window')
+    op.drop_index('ix_detection_window_substance_id', table_name='detection_window')
+    op.drop_table('detection_window')
+    for name, _ in reversed(COLUMNS):
+        op.drop_column('substance', name)
@@ -0,0 +1,29 @@
+"""Add seeded to substance so a sync only removes rows it loaded
+
+Revision ID: a6f3d92c5e17
+Revises: 0795624ba354
+Create Date: 2026-10-18 22:14:09.583012
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6f3d92c5e17'
+down_revision = '0795624ba354'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created with db.create_all() after this revision already have the column.
+    # Existing rows stay unmarked: the next sync marks the ones it still lists, and
+    # never deletes the others
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('substance')}
+    if 'seeded' not in existing:
+        op.add_column('substance', sa.Column('seeded', sa.Boolean(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('substance', 'seeded')
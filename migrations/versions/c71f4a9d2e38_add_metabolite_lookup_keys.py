@@ -0,0 +1,42 @@
+"""Index metabolites by normalized name and formula for parent lookups
+
+Revision ID: c71f4a9d2e38
+Revises: 5e8d1b3a7c60
+Create Date: 2026-10-18 16:47:09.318552
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import metabolite_search
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71f4a9d2e38'
+down_revision = '5e8d1b3a7c60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    # Databases created with db.create_all() after this revision already have the column and indexes
+    existing = {column['name'] for column in inspector.get_columns('metabolite')}
+    if 'normalized_name' in existing:
+        return
+    op.add_column('metabolite', sa.Column('normalized_name', sa.String(length=200), nullable=True))
+    op.create_index('ix_metabolite_normalized_name', 'metabolite', ['normalized_name'])
+    op.create_index('ix_metabolite_chemical_formula', 'metabolite', ['chemical_formula'])
+
+    # Fold the names already stored
+    updates = [{'id': metabolite_id, 'normalized_name': metabolite_search.normalize_name(name)}
+               for metabolite_id, name in bind.execute(sa.text('SELECT id, name FROM metabolite'))]
+    if updates:
+        bind.execute(sa.text('UPDATE metabolite SET normalized_name = :normalized_name WHERE id = :id'), updates)
+
+
+def downgrade():
+    op.drop_index('ix_metabolite_chemical_formula', table_name='metabolite')
+    op.drop_index('ix_metabolite_normalized_name', table_name='metabolite')
+    op.drop_column('metabolite', 'normalized_name')
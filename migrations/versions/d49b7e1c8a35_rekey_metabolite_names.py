@@ -0,0 +1,36 @@
+"""Store metabolite name keys without folding spelling variants
+
+Revision ID: d49b7e1c8a35
+Revises: a6f3d92c5e17
+Create Date: 2026-10-18 23:02:51.770436
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import autocomplete
+import metabolite_search
+
+
+# revision identifiers, used by Alembic.
+revision = 'd49b7e1c8a35'
+down_revision = 'a6f3d92c5e17'
+branch_labels = None
+depends_on = None
+
+
+def store_keys(normalize):
+    bind = op.get_bind()
+    updates = [{'id': metabolite_id, 'normalized_name': normalize(name)}
+               for metabolite_id, name in bind.execute(sa.text('SELECT id, name FROM metabolite'))]
+    if updates:
+        bind.execute(sa.text('UPDATE metabolite SET normalized_name = :normalized_name WHERE id = :id'), updates)
+
+
+def upgrade():
+    store_keys(metabolite_search.normalize_name)
+
+
+def downgrade():
+    # The keys as c71f4a9d2e38 stored them
+    store_keys(lambda name: autocomplete.fold(name or ''))
@@ -0,0 +1,52 @@
+"""Store monoisotopic and average masses of substance and metabolite formulas
+
+Revision ID: e2b6d8f41a97
+Revises: c71f4a9d2e38
+Create Date: 2026-10-18 19:22:54.603117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import formula
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b6d8f41a97'
+down_revision = 'c71f4a9d2e38'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('substance', 'metabolite')
+COLUMNS = (
+    ('monoisotopic_mass', sa.Float()),
+    ('average_mass', sa.Float()),
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    for table in TABLES:
+        # Databases created with db.create_all() after this revision already have the columns
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        if 'monoisotopic_mass' in existing:
+            continue
+        for name, type_ in COLUMNS:
+            op.add_column(table, sa.Column(name, type_, nullable=True))
+        op.create_index(f'ix_{table}_monoisotopic_mass', table, ['monoisotopic_mass'])
+
+        # Compute the masses of the formulas already stored
+        updates = [dict(formula.mass_columns(chemical_formula), id=row_id)
+                   for row_id, chemical_formula in bind.execute(sa.text(f'SELECT id, chemical_formula FROM {table}'))]
+        if updates:
+            bind.execute(sa.text(f'UPDATE {table} SET monoisotopic_mass = :monoisotopic_mass, '
+                                 f'average_mass = :average_mass WHERE id = :id'), updates)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_index(f'ix_{table}_monoisotopic_mass', table_name=table)
+        for name, _ in reversed(COLUMNS):
+            op.drop_column(table, name)
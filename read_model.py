@@ -0,0 +1,128 @@
+"""
+Compact in-memory read model of the catalog's dose thresholds
+
+The analysis endpoints need a handful of fields of every substance and
+metabolite. Holding them as ORM instances or `dict(row)` copies costs a hash
+table or instance state per row and a boxed float per threshold, which
+dominates memory at a million metabolites. `ThresholdTable` stores one table
+column-wise instead:
+
+- ids in a sorted `array('q')`, looked up with bisect
+- each threshold in an `array('d')`, with NaN where the value is missing
+- names in one UTF-8 buffer with an `array('q')` of offsets
+- units and categories interned, so rows with the same value share one string
+
+`get(id)` materializes a single row as a `Thresholds`, a `__slots__` record
+with None for missing thresholds, only when a request needs it. The NumPy
+classifier in dose_classifier reads the columns without copying them.
+"""
+
+import bisect
+import math
+import sys
+from array import array
+
+import dose_classifier
+
+MISSING = math.nan
+THRESHOLDS = ('therapeutic_min', 'therapeutic_max', 'toxic', 'lethal')
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _optional(value):
+    # NaN is the only value not equal to itself
+    return None if value != value else value
+
+
+def parse_id(value):
+    """An id sent as an int, a float without a fractional part or a string of digits, as an int.
+
+    Raises ValueError for anything else, bools and fractional floats included,
+    so a malformed id is never rounded to another row's.
+    """
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    raise ValueError(value)
+
+
+class Thresholds:
+    """One substance or metabolite with the thresholds its measurements are compared with"""
+
+    __slots__ = ('id', 'name', 'unit', 'category') + THRESHOLDS
+
+    def __init__(self, id, name, unit, category, therapeutic_min, therapeutic_max, toxic, lethal):
+        self.id = id
+        self.name = name
+        self.unit = unit
+        self.category = category
+        self.therapeutic_min = therapeutic_min
+        self.therapeutic_max = therapeutic_max
+        self.toxic = toxic
+        self.lethal = lethal
+
+    def classify(self, measured_level):
+        """Interpret a level given in `unit`; returns one of dose_classifier.LABELS"""
+        return dose_classifier.classify_level(self.therapeutic_min, self.therapeutic_max,
+                                              self.toxic, self.lethal, measured_level)
+
+
+class ThresholdTable:
+    """Thresholds of one catalog table, stored column-wise.
+
+    Rows are `(id, name, unit, category, therapeutic_min, therapeutic_max,
+    toxic, lethal)` in ascending id order, as `ORDER BY id` returns them, so a
+    cursor can be consumed without holding its rows. Metabolites pass None for
+    the category and the lethal threshold.
+    """
+
+    def __init__(self, rows):
+        self.ids = array('q')
+        self.units = []
+        self.categories = []
+        self._name_offsets = array('q', [0])
+        names = bytearray()
+        columns = [array('d') for _ in THRESHOLDS]
+        for row in rows:
+            if self.ids and row[0] <= self.ids[-1]:
+                raise ValueError('Threshold rows must be in ascending id order')
+            self.ids.append(row[0])
+            names += (row[1] or '').encode()
+            self._name_offsets.append(len(names))
+            self.units.append(_intern(row[2]))
+            self.categories.append(_intern(row[3]))
+            for column, value in zip(columns, row[4:]):
+                column.append(MISSING if value is None else value)
+        self._names = bytes(names)
+        self.therapeutic_min, self.therapeutic_max, self.toxic, self.lethal = columns
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, item_id):
+        """Row index of an id, or -1 when it is not in the table"""
+        if not isinstance(item_id, int) or isinstance(item_id, bool):
+            return -1
+        position = bisect.bisect_left(self.ids, item_id)
+        return position if position < len(self.ids) and self.ids[position] == item_id else -1
+
+    def name(self, position):
+        return self._names[self._name_offsets[position]:self._name_offsets[position + 1]].decode()
+
+    def record(self, position):
+        return Thresholds(self.ids[position], self.name(position), self.units[position], self.categories[position],
+                          _optional(self.therapeutic_min[position]), _optional(self.therapeutic_max[position]),
+                          _optional(self.toxic[position]), _optional(self.lethal[position]))
+
+    def get(self, item_id):
+        """The row of an id as a Thresholds record, or None"""
+        position = self.position(item_id)
+        return None if position < 0 else self.record(position)
@@ -0,0 +1,325 @@
+"""
+Streaming import of external reference datasets
+
+`flask load-reference-data` reads substances and metabolites from CSV or JSON
+Lines files one record at a time, validates and coerces every record, and
+commits them in chunks. Each chunk is committed together with the file's
+ImportCheckpoint row, so an interrupted import resumes after the last
+committed chunk.
+"""
+
+import csv
+import json
+import math
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+import click
+from sqlalchemy import delete, insert, select
+
+import units
+from app import (db, Substance, Metabolite, ImportCheckpoint, create_search_index, drop_search_index,
+                 reset_catalog_caches)
+from init_database import insert_metabolites, insert_substances, substance_ids
+
+# Filled in by the database or the loader, never read from a file
+MANAGED_COLUMNS = ('id', 'created_at', 'updated_at', 'content_hash', 'seeded', 'half_life_min_hours',
+                   'half_life_max_hours', 'normalized_name', 'monoisotopic_mass', 'average_mass')
+
+
+def is_file_column(name):
+    return name not in MANAGED_COLUMNS and not name.endswith(units.CANONICAL_SUFFIX)
+
+
+SUBSTANCE_COLUMNS = tuple(c.name for c in Substance.__table__.columns if is_file_column(c.name))
+METABOLITE_COLUMNS = tuple(c.name for c in Metabolite.__table__.columns
+                           if is_file_column(c.name) and c.name != 'substance_id')
+NUMERIC_COLUMNS = {'therapeutic_dose_min', 'therapeutic_dose_max', 'toxic_dose', 'lethal_dose',
+                   'therapeutic_range_min', 'therapeutic_range_max', 'toxic_level'}
+BOOLEAN_COLUMNS = {'is_active'}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f'}
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl'}
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 2.0
+
+
+def detect_format(path):
+    file_format = FORMATS.get(os.path.splitext(path)[1].lower())
+    if file_format is None:
+        raise click.UsageError(f'Cannot tell the format of {path}; pass --format csv or --format jsonl.')
+    return file_format
+
+
+def read_records(path, file_format):
+    """Yield (line_number, record) for every record of a CSV or JSON Lines file.
+
+    JSON lines that do not decode are yielded as None so they are reported as
+    rejected rows instead of stopping the import.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+            return
+
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+
+
+def coerce_number(column, value):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f'{column} must be a number, got {value!r}')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{column} must be a number, got {value!r}')
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f'{column} must be a finite, non-negative number, got {value!r}')
+    return number
+
+
+def coerce_boolean(column, value):
+    if value is None or isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES or not text:
+        return False
+    raise ValueError(f'{column} must be true or false, got {value!r}')
+
+
+def clean_record(record, columns, required):
+    """Validate and coerce one record; returns a dict of column values or raises ValueError.
+
+    Columns the record does not mention are left out so they get the column
+    defaults; unknown keys are ignored.
+    """
+    if not isinstance(record, dict):
+        raise ValueError('record is not a JSON object')
+
+    row = {}
+    for column in columns:
+        if column not in record:
+            continue
+        value = record[column]
+        if column in NUMERIC_COLUMNS:
+            value = coerce_number(column, value)
+        elif column in BOOLEAN_COLUMNS:
+            value = coerce_boolean(column, value)
+        elif value is not None:
+            value = str(value).strip() or None
+        row[column] = value
+
+    for column in required:
+        if not row.get(column):
+            raise ValueError(f'{column} is required')
+    return row
+
+
+def clean_substance(record):
+    row = clean_record(record, SUBSTANCE_COLUMNS, ('name', 'category'))
+    metabolites = record.get('metabolites') or []
+    if not isinstance(metabolites, list):
+        raise ValueError('metabolites must be a list')
+    row['metabolites'] = [clean_record(m, METABOLITE_COLUMNS, ('name',)) for m in metabolites]
+    return row
+
+
+def clean_metabolite(record):
+    return clean_record(record, METABOLITE_COLUMNS + ('substance_name',), ('name', 'substance_name'))
+
+
+def clean_chunk(chunk, clean):
+    rows, errors = [], []
+    for line_number, record in chunk:
+        try:
+            rows.append((line_number, clean(record)))
+        except ValueError as exc:
+            errors.append((line_number, str(exc)))
+    return rows, errors
+
+
+def load_substance_chunk(connection, chunk):
+    """Insert one chunk of substance records; returns (rows loaded, errors)"""
+    rows, errors = clean_chunk(chunk, clean_substance)
+
+    # Names must be unique; report duplicates instead of failing the whole chunk
+    seen = set(substance_ids(connection, {row['name'] for _, row in rows}))
+    accepted = []
+    for line_number, row in rows:
+        if row['name'] in seen:
+            errors.append((line_number, f"substance {row['name']!r} already exists"))
+            continue
+        seen.add(row['name'])
+        accepted.append(row)
+
+    substance_count, metabolite_count = insert_substances(connection, accepted)
+    return substance_count + metabolite_count, errors
+
+
+def load_metabolite_chunk(connection, chunk):
+    """Insert one chunk of metabolite records; returns (rows loaded, errors)"""
+    rows, errors = clean_chunk(chunk, clean_metabolite)
+
+    parents = substance_ids(connection, {row['substance_name'] for _, row in rows})
+    accepted = []
+    for line_number, row in rows:
+        parent_name = row.pop('substance_name')
+        if parent_name not in parents:
+            errors.append((line_number, f'unknown substance {parent_name!r}'))
+            continue
+        row['substance_id'] = parents[parent_name]
+        accepted.append(row)
+
+    return insert_metabolites(connection, accepted), errors
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return f'{stat.st_size}:{int(stat.st_mtime)}'
+
+
+def saved_progress(connection, source, fingerprint):
+    checkpoint = connection.execute(
+        select(ImportCheckpoint.fingerprint, ImportCheckpoint.rows_done)
+        .where(ImportCheckpoint.source == source)).first()
+    if checkpoint is None:
+        return 0
+    if checkpoint.fingerprint != fingerprint:
+        raise click.ClickException(f'{source} changed since it was last imported; '
+                                   f'pass --restart to read it from the start.')
+    return checkpoint.rows_done
+
+
+def save_progress(connection, source, fingerprint, rows_done):
+    connection.execute(delete(ImportCheckpoint).where(ImportCheckpoint.source == source))
+    connection.execute(insert(ImportCheckpoint).values(source=source, fingerprint=fingerprint,
+                                                       rows_done=rows_done))
+
+
+@contextmanager
+def import_connection():
+    """Engine connection for a resumable import, used outside the ORM session.
+
+    Unlike init_database.bulk_connection, every committed chunk and its
+    checkpoint must survive a crash: SQLite runs in WAL mode with
+    synchronous=NORMAL, which syncs at checkpoints rather than on every commit.
+    """
+    db.session.close()
+    with db.engine.connect() as connection:
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            synchronous = connection.exec_driver_sql('PRAGMA synchronous').scalar()
+            # WAL is a property of the database file and stays on for the servers reading it
+            connection.exec_driver_sql('PRAGMA journal_mode = WAL')
+            connection.exec_driver_sql('PRAGMA synchronous = NORMAL')
+            connection.commit()  # end the autobegun transaction; PRAGMAs are not transactional
+        try:
+            yield connection
+        finally:
+            if sqlite:
+                connection.exec_driver_sql(f'PRAGMA synchronous = {synchronous}')
+                connection.commit()
+
+
+@contextmanager
+def stop_on_interrupt():
+    """Turn Ctrl-C into a request to stop after the chunk being loaded.
+
+    Interrupting SQLite in the middle of a write leaves the connection holding
+    its lock, which would keep the search index from being rebuilt.
+    """
+    stop = threading.Event()
+    if threading.current_thread() is not threading.main_thread():
+        yield stop
+        return
+
+    def request_stop(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        click.echo('Stopping after the current chunk; press Ctrl-C again to abort.', err=True)
+        stop.set()
+
+    previous = signal.signal(signal.SIGINT, request_stop)
+    try:
+        yield stop
+    finally:
+        signal.signal(signal.SIGINT, previous)
+
+
+def import_file(connection, path, load_chunk, file_format, chunk_size, restart, stop):
+    """Stream one file into the catalog, committing every chunk_size records"""
+    source = os.path.abspath(path)
+    fingerprint = file_fingerprint(path)
+    with connection.begin():
+        done = 0 if restart else saved_progress(connection, source, fingerprint)
+    if done:
+        click.echo(f'{path}: resuming after {done:,} records (pass --restart to read it from the start)')
+
+    records = islice(read_records(path, file_format or detect_format(path)), done, None)
+    read = loaded = rejected = 0
+    start = last_report = time.perf_counter()
+    while not stop.is_set():
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+
+        with connection.begin():
+            chunk_loaded, errors = load_chunk(connection, chunk)
+            save_progress(connection, source, fingerprint, done + read + len(chunk))
+
+        read += len(chunk)
+        loaded += chunk_loaded
+        rejected += len(errors)
+        for line_number, message in sorted(errors):
+            click.echo(f'{path}:{line_number}: {message}', err=True)
+
+        now = time.perf_counter()
+        if now - last_report >= PROGRESS_INTERVAL:
+            click.echo(f'{path}: {done + read:,} records, {read / (now - start):,.0f} records/s')
+            last_report = now
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    if stop.is_set():
+        click.echo(f'{path}: stopped after {done + read:,} records; run the command again to resume')
+    click.echo(f'{path}: read {read:,} records ({rejected:,} rejected), loaded {loaded:,} rows '
+               f'in {elapsed:.1f}s, {read / elapsed:,.0f} records/s')
+
+
+def load_reference_data(substances_file=None, metabolites_file=None, file_format=None, chunk_size=1000,
+                        restart=False):
+    """Import a substances file and/or a metabolites file; must run inside an application context"""
+    with import_connection() as connection, stop_on_interrupt() as stop:
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            # Triggers would update the search index for every row; it is rebuilt once at the end
+            with connection.begin():
+                drop_search_index(None, connection)
+        try:
+            if substances_file:
+                import_file(connection, substances_file, load_substance_chunk, file_format, chunk_size, restart, stop)
+            if metabolites_file and not stop.is_set():
+                import_file(connection, metabolites_file, load_metabolite_chunk, file_format, chunk_size, restart, stop)
+        finally:
+            # Also after an interruption, so search covers every committed chunk
+            if sqlite:
+                with connection.begin():
+                    connection.exec_driver_sql('BEGIN')
+                    create_search_index(None, connection)
+            reset_catalog_caches()
@@ -0,0 +1,118 @@
+"""
+Full-text search index for the substance catalog
+
+Both servers keep an SQLite FTS5 table next to their substance table. It covers
+name, common names, description, mechanism of action and the names of all
+metabolites, and triggers keep it in sync with the base tables.
+"""
+
+import re
+import sqlite3
+
+# Column weights for bm25(): name and street names matter most
+BM25_WEIGHTS = (10.0, 5.0, 1.0, 1.0, 3.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_ddl(substance_table, metabolite_table, fts_table):
+    """Return the statements creating the FTS table and its sync triggers"""
+    metabolite_names = (f"(SELECT group_concat(name, ' ') FROM {metabolite_table} "
+                        f"WHERE substance_id = {{row}}.id)")
+    insert_row = (f"INSERT INTO {fts_table}(rowid, name, common_names, description, "
+                  f"mechanism_of_action, metabolite_names) "
+                  f"VALUES (new.id, new.name, new.common_names, new.description, "
+                  f"new.mechanism_of_action, {metabolite_names.format(row='new')});")
+    refresh_metabolites = (f"UPDATE {fts_table} SET metabolite_names = "
+                           f"(SELECT group_concat(name, ' ') FROM {metabolite_table} "
+                           f"WHERE substance_id = {{row}}.substance_id) "
+                           f"WHERE rowid = {{row}}.substance_id;")
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+            name, common_names, description, mechanism_of_action, metabolite_names,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {substance_table} BEGIN
+            {insert_row}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE ON {substance_table} BEGIN
+            DELETE FROM {fts_table} WHERE rowid = old.id;
+            {insert_row}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {substance_table} BEGIN
+            DELETE FROM {fts_table} WHERE rowid = old.id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_mai AFTER INSERT ON {metabolite_table} BEGIN
+            {refresh_metabolites.format(row='new')}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_mau AFTER UPDATE ON {metabolite_table} BEGIN
+            {refresh_metabolites.format(row='old')}
+            {refresh_metabolites.format(row='new')}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_mad AFTER DELETE ON {metabolite_table} BEGIN
+            {refresh_metabolites.format(row='old')}
+        END""",
+    ]
+
+
+def drop_ddl(fts_table):
+    """Return the statements removing the FTS table and its triggers"""
+    triggers = ['ai', 'au', 'ad', 'mai', 'mau', 'mad']
+    return ([f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}" for suffix in triggers] +
+            [f"DROP TABLE IF EXISTS {fts_table}"])
+
+
+def rebuild_sql(substance_table, metabolite_table, fts_table):
+    """Return the statements repopulating the FTS table from the base tables"""
+    return [
+        f"DELETE FROM {fts_table}",
+        f"""INSERT INTO {fts_table}(rowid, name, common_names, description,
+                                    mechanism_of_action, metabolite_names)
+            SELECT s.id, s.name, s.common_names, s.description, s.mechanism_of_action, m.names
+            FROM {substance_table} s
+            LEFT JOIN (SELECT substance_id, group_concat(name, ' ') AS names
+                       FROM {metabolite_table} GROUP BY substance_id) m
+                   ON m.substance_id = s.id""",
+    ]
+
+
+def create_fts(conn, substance_table, metabolite_table, fts_table):
+    """Create the FTS table on a DB-API connection, populating it if it is new.
+
+    Returns False when the SQLite build has no FTS5 module; callers then keep
+    using LIKE filtering.
+    """
+    cursor = conn.cursor()
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)
+    ).fetchone()
+    try:
+        for statement in fts_ddl(substance_table, metabolite_table, fts_table):
+            cursor.execute(statement)
+    except sqlite3.OperationalError as exc:
+        if 'fts5' in str(exc):
+            return False
+        raise
+    if not exists:
+        for statement in rebuild_sql(substance_table, metabolite_table, fts_table):
+            cursor.execute(statement)
+    return True
+
+
+def rank_expression(fts_table):
+    """SQL expression ranking FTS matches, lower is better"""
+    weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+    return f"bm25({fts_table}, {weights})"
+
+
+def match_expression(search):
+    """Turn free text from the search box into an FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term so partially typed words match and
+    user input can never inject FTS query syntax. Returns None when the text
+    has no searchable words.
+    """
+    tokens = _TOKEN_RE.findall(search)
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
@@ -4,30 +4,170 @@ Simple Forensic Toxicology Database Application
 A lightweight version using only Python built-in modules
 """
 
+import argparse
+import hashlib
 import json
+import math
+import selectors
+import signal
+import socket
 import sqlite3
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import threading
-import webbrowser
+
+import autocomplete
+import catalog_mmap
+import catalog_snapshot
+import compression
+import durations
+import formula
+import http_cache
+import mass_search
+import metabolite_search
+import read_model
+import search_index
+import units
 
 # Database setup
 DB_PATH = 'forensic_toxicology.db'
+FTS_TABLE = 'substances_fts'
+# Binary catalog file every process maps instead of building the snapshot, set with --catalog-file
+CATALOG_FILE = None
+
+# Pagination of the substance list
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+STREAM_CHUNK_SIZE = 500
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Concurrency of the HTTP server
+DEFAULT_THREADS = 8
+KEEP_ALIVE_TIMEOUT = 5
+
+# SQLite tuning of the pooled read connections. The page cache is per connection,
+# so it stays small and the memory map shares hot pages between threads
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_CACHE_KIB = int(os.environ.get('SQLITE_CACHE_KIB', 16 * 1024))
+SQLITE_CACHED_STATEMENTS = 256
+
+# HTTP caching of the read endpoints
+CATALOG_MAX_AGE = int(os.environ.get('CATALOG_MAX_AGE', 60))
+RESPONSE_CACHE = http_cache.ResponseCache(int(os.environ.get('RESPONSE_CACHE_BYTES', 64 * 1024 * 1024)))
+
+# Columns that can be requested with fields=
+SUBSTANCE_FIELDS = (
+    'id', 'name', 'common_names', 'chemical_formula', 'cas_number', 'category',
+    'description', 'mechanism_of_action', 'therapeutic_dose_min', 'therapeutic_dose_max',
+    'toxic_dose', 'lethal_dose', 'dose_unit', 'half_life', 'detection_window', 'created_at'
+)
+
+# Columns of the metabolites listed with each substance: the table as first released, without
+# the lookup and derived columns added since
+METABOLITE_FIELDS = (
+    'id', 'substance_id', 'name', 'chemical_formula', 'is_active', 'formation_pathway',
+    'detection_significance', 'therapeutic_range_min', 'therapeutic_range_max', 'toxic_level', 'unit'
+)
 
-def init_database():
-    """Initialize SQLite database with forensic toxicology data"""
+class ConnectionPool:
+    """SQLite connections opened once per thread and reused for every request.
     
-    # Remove existing database
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
+    Connections are tuned for reads (WAL, memory-mapped I/O, statement cache)
+    and owned by the pool, so handlers never open or close them. `close_all()`
+    closes every connection; threads transparently reopen on their next use.
+    A forked child discards the connections inherited from its parent.
+    """
     
-    conn = sqlite3.connect(DB_PATH)
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset()
+    
+    def _reset(self):
+        self._local = threading.local()
+        self._connections = []
+        self._generation = 0
+        self._pid = os.getpid()
+    
+    def connection(self):
+        """Return the calling thread's connection, opening it on first use"""
+        if self._pid != os.getpid():
+            # Never touch a connection opened before fork; the parent still owns it
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        
+        local = self._local
+        if getattr(local, 'generation', None) != self._generation:
+            local.conn = self._open()
+            local.generation = self._generation
+        return local.conn
+    
+    def _open(self):
+        # check_same_thread=False only so close_all() may close it from another thread
+        conn = sqlite3.connect(self.path, check_same_thread=False,
+                               cached_statements=SQLITE_CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_KIB}")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+    
+    def close_all(self):
+        """Close every pooled connection, e.g. before the database file is replaced"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for conn in connections:
+            conn.close()
+
+DB_POOL = ConnectionPool(DB_PATH)
+
+# Columns added after the tables were first released, added to older databases on startup
+ADDED_COLUMNS = {
+    'substances': (('content_hash', 'TEXT'), ('updated_at', 'TIMESTAMP'),
+                   ('half_life_min_hours', 'REAL'), ('half_life_max_hours', 'REAL'),
+                   ('monoisotopic_mass', 'REAL'), ('average_mass', 'REAL'), ('seeded', 'BOOLEAN DEFAULT 0'))
+                  + tuple((column + units.CANONICAL_SUFFIX, 'REAL') for column in units.SUBSTANCE_THRESHOLDS),
+    'metabolites': (('normalized_name', 'TEXT'), ('monoisotopic_mass', 'REAL'), ('average_mass', 'REAL'))
+                   + tuple((column + units.CANONICAL_SUFFIX, 'REAL') for column in units.METABOLITE_THRESHOLDS),
+}
+
+# Format of the metabolite_search.normalize_name keys in metabolites.normalized_name, kept in
+# PRAGMA user_version; keys stored in an older format are recomputed on startup
+METABOLITE_KEY_VERSION = 1
+
+SYNCED_SUBSTANCE_COLUMNS = ('name', 'common_names', 'chemical_formula', 'cas_number', 'category',
+                            'description', 'mechanism_of_action', 'therapeutic_dose_min',
+                            'therapeutic_dose_max', 'toxic_dose', 'lethal_dose', 'dose_unit',
+                            'half_life', 'detection_window')
+SYNCED_METABOLITE_COLUMNS = ('name', 'chemical_formula', 'is_active', 'formation_pathway',
+                             'detection_significance', 'therapeutic_range_min', 'therapeutic_range_max',
+                             'toxic_level', 'unit')
+
+def add_missing_columns(cursor):
+    """Bring tables created by an older version up to date; returns the names of the added columns"""
+    added = []
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        for name, declaration in columns:
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+                added.append(name)
+    return added
+
+def create_schema(conn):
+    """Create the catalog tables, or add what is missing to existing ones"""
     cursor = conn.cursor()
     
-    # Create tables
     cursor.execute('''
-        CREATE TABLE substances (
+        CREATE TABLE IF NOT EXISTS substances (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL UNIQUE,
             common_names TEXT,
@@ -48,7 +188,7 @@ def init_database():
     ''')
     
     cursor.execute('''
-        CREATE TABLE metabolites (
+        CREATE TABLE IF NOT EXISTS metabolites (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             substance_id INTEGER NOT NULL,
             name TEXT NOT NULL,
@@ -63,6 +203,195 @@ def init_database():
             FOREIGN KEY (substance_id) REFERENCES substances (id)
         )
     ''')
+    added = add_missing_columns(cursor)
+    
+    # detection_window parsed into hours, one row per "Matrix: range" part
+    new_windows = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'detection_windows'").fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS detection_windows (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            substance_id INTEGER NOT NULL,
+            matrix TEXT NOT NULL,
+            min_hours REAL NOT NULL,
+            max_hours REAL NOT NULL,
+            FOREIGN KEY (substance_id) REFERENCES substances (id)
+        )
+    ''')
+    
+    # Category filters and listings, CAS lookups, and the metabolites of each substance
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_substances_category_name ON substances (category, name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_substances_cas_number ON substances (cas_number)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_metabolites_substance_id ON metabolites (substance_id)")
+    # detectable_in= and hours= filters are a range scan of one matrix that never reads the table
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_detection_windows_matrix_max_hours "
+                   "ON detection_windows (matrix, max_hours, substance_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_detection_windows_substance_id ON detection_windows (substance_id)")
+    # Toxic thresholds compared across substances and metabolites in ng/mL
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_substances_toxic_dose_ng_ml ON substances (toxic_dose_ng_ml)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_metabolites_toxic_level_ng_ml ON metabolites (toxic_level_ng_ml)")
+    # Parent lookups from detected metabolite names and formulas
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_metabolites_normalized_name ON metabolites (normalized_name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_metabolites_chemical_formula ON metabolites (chemical_formula)")
+    # Accurate-mass screening
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_substances_monoisotopic_mass ON substances (monoisotopic_mass)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_metabolites_monoisotopic_mass ON metabolites (monoisotopic_mass)")
+    # Revision bumped on every write, so running servers notice writes made by other processes
+    for statement in http_cache.revision_ddl(('substances', 'metabolites', 'detection_windows')):
+        cursor.execute(statement)
+    
+    # Rows stored by a version without the derived columns
+    if new_windows:
+        store_parsed_durations(conn)
+    if any(name.endswith(units.CANONICAL_SUFFIX) for name in added):
+        store_canonical_thresholds(conn)
+    if 'normalized_name' in added or conn.execute("PRAGMA user_version").fetchone()[0] < METABOLITE_KEY_VERSION:
+        store_metabolite_keys(conn)
+        conn.execute(f"PRAGMA user_version = {METABOLITE_KEY_VERSION}")
+    if 'monoisotopic_mass' in added:
+        store_masses(conn)
+
+def store_derived_columns(conn, names=None):
+    """Fill every column derived from others, for the substances with the given names or for all of them"""
+    store_parsed_durations(conn, names)
+    store_canonical_thresholds(conn, names)
+    store_metabolite_keys(conn, names)
+    store_masses(conn, names)
+
+def store_masses(conn, names=None):
+    """Fill the formula masses of the substances with the given names and their metabolites, or of every row"""
+    for table, key in (('substances', 'id'), ('metabolites', 'substance_id')):
+        query = f"SELECT id, chemical_formula FROM {table}"
+        if names is None:
+            rows = conn.execute(query).fetchall()
+        else:
+            query += f" WHERE {key} = (SELECT id FROM substances WHERE name = ?)"
+            rows = [row for name in names for row in conn.execute(query, (name,))]
+        masses = ((formula.mass_columns(chemical_formula), row_id) for row_id, chemical_formula in rows)
+        conn.executemany(f"UPDATE {table} SET monoisotopic_mass = ?, average_mass = ? WHERE id = ?",
+                         [(columns['monoisotopic_mass'], columns['average_mass'], row_id)
+                          for columns, row_id in masses])
+
+def store_metabolite_keys(conn, names=None):
+    """Fill normalized_name for the metabolites of the substances with the given names, or of every substance"""
+    query = "SELECT id, name FROM metabolites"
+    if names is None:
+        rows = conn.execute(query).fetchall()
+    else:
+        query += " WHERE substance_id = (SELECT id FROM substances WHERE name = ?)"
+        rows = [row for name in names for row in conn.execute(query, (name,))]
+    conn.executemany("UPDATE metabolites SET normalized_name = ? WHERE id = ?",
+                     [(metabolite_search.normalize_name(name), metabolite_id) for metabolite_id, name in rows])
+
+def store_canonical_thresholds(conn, names=None):
+    """Convert the thresholds of substances and their metabolites into the `_ng_ml` columns.
+    
+    Covers the substances with the given names, or every substance when names is None.
+    """
+    for table, unit_column, thresholds, key in (
+            ('substances', 'dose_unit', units.SUBSTANCE_THRESHOLDS, 'id'),
+            ('metabolites', 'unit', units.METABOLITE_THRESHOLDS, 'substance_id')):
+        query = f"SELECT id, {unit_column}, {', '.join(thresholds)} FROM {table}"
+        if names is None:
+            rows = conn.execute(query).fetchall()
+        else:
+            query += f" WHERE {key} = (SELECT id FROM substances WHERE name = ?)"
+            rows = [row for name in names for row in conn.execute(query, (name,))]
+        
+        assignments = ', '.join(f"{column}{units.CANONICAL_SUFFIX} = ?" for column in thresholds)
+        updates = []
+        for row_id, unit, *values in rows:
+            converted = units.canonical_columns(dict(zip(thresholds, values)), thresholds, unit)
+            updates.append(tuple(converted.values()) + (row_id,))
+        conn.executemany(f"UPDATE {table} SET {assignments} WHERE id = ?", updates)
+
+def store_parsed_durations(conn, names=None):
+    """Parse half_life and detection_window into the half-life hour columns and detection_windows rows.
+    
+    Covers the substances with the given names, or every substance when names is None.
+    """
+    query = "SELECT id, half_life, detection_window FROM substances"
+    if names is None:
+        rows = conn.execute(query).fetchall()
+        conn.execute("DELETE FROM detection_windows")
+    else:
+        rows = [row for name in names for row in conn.execute(query + " WHERE name = ?", (name,))]
+        conn.executemany("DELETE FROM detection_windows WHERE substance_id = ?", [(row[0],) for row in rows])
+    
+    conn.executemany("UPDATE substances SET half_life_min_hours = ?, half_life_max_hours = ? WHERE id = ?",
+                     [(*(durations.parse_duration(half_life) or (None, None)), substance_id)
+                      for substance_id, half_life, _ in rows])
+    conn.executemany("INSERT INTO detection_windows (substance_id, matrix, min_hours, max_hours) VALUES (?, ?, ?, ?)",
+                     [(substance_id, *window) for substance_id, _, detection_window in rows
+                      for window in durations.parse_detection_windows(detection_window)])
+
+def create_search_index(conn):
+    """Create and populate the full-text search index over the catalog tables"""
+    if not search_index.create_fts(conn, 'substances', 'metabolites', FTS_TABLE):
+        print("SQLite FTS5 is not available, search falls back to LIKE filtering")
+
+def content_hash(substance, metabolites):
+    """Digest of a substance row and its metabolite rows, stored to detect changed records"""
+    return hashlib.sha256(json.dumps([substance, metabolites]).encode()).hexdigest()
+
+def sync_catalog(conn, substances, metabolites):
+    """Make the catalog tables match the given rows, writing only what changed.
+    
+    `substances` rows follow SYNCED_SUBSTANCE_COLUMNS; `metabolites` rows start
+    with the 1-based position of their substance in `substances`, followed by
+    SYNCED_METABOLITE_COLUMNS. Substances are matched by name: new and changed
+    ones are upserted and get their metabolites replaced, substances a previous
+    sync seeded that are missing from `substances` are deleted. Rows written by
+    other means are left alone. Returns (changed, removed) counts.
+    """
+    children = {}
+    for position, *metabolite in metabolites:
+        children.setdefault(substances[position - 1][0], []).append(tuple(metabolite))
+    
+    stored = {name: (digest, seeded) for name, digest, seeded in
+              conn.execute("SELECT name, content_hash, seeded FROM substances")}
+    changed = []
+    for substance in substances:
+        digest = content_hash(substance, children.get(substance[0], []))
+        # Rows from before the seeded column are marked by rewriting them once
+        if stored.pop(substance[0], None) != (digest, 1):
+            changed.append(tuple(substance) + (digest, 1))
+    removed = [(name,) for name, (_, seeded) in stored.items() if seeded]
+    
+    columns = SYNCED_SUBSTANCE_COLUMNS + ('content_hash', 'seeded')
+    updates = ', '.join(f"{column} = excluded.{column}" for column in columns[1:])
+    conn.executemany(f'''
+        INSERT INTO substances ({', '.join(columns)}, updated_at)
+        VALUES ({', '.join('?' for _ in columns)}, CURRENT_TIMESTAMP)
+        ON CONFLICT(name) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP
+    ''', changed)
+    
+    # Changed substances keep their id; their metabolites are replaced wholesale
+    conn.executemany("DELETE FROM metabolites WHERE substance_id = (SELECT id FROM substances WHERE name = ?)",
+                     [(row[0],) for row in changed] + removed)
+    conn.executemany("DELETE FROM detection_windows WHERE substance_id = (SELECT id FROM substances WHERE name = ?)",
+                     removed)
+    conn.executemany("DELETE FROM substances WHERE name = ?", removed)
+    conn.executemany(f'''
+        INSERT INTO metabolites (substance_id, {', '.join(SYNCED_METABOLITE_COLUMNS)})
+        SELECT id, {', '.join('?' for _ in SYNCED_METABOLITE_COLUMNS)} FROM substances WHERE name = ?
+    ''', [metabolite + (row[0],) for row in changed for metabolite in children.get(row[0], [])])
+    store_derived_columns(conn, [row[0] for row in changed])
+    return len(changed), len(removed)
+
+def init_database(rebuild=False):
+    """Create the database if needed and sync it with the built-in forensic toxicology data"""
+    
+    if rebuild:
+        # Remove existing database, including any write-ahead log left next to it
+        DB_POOL.close_all()
+        for path in (DB_PATH, DB_PATH + '-wal', DB_PATH + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    conn = sqlite3.connect(DB_PATH)
+    
+    create_schema(conn)
     
     # Insert sample data
     substances = [
@@ -115,14 +444,7 @@ def init_database():
          None, None, 0.001, 0.01, 'mg/L', '3-5 hours', 'Urine: 1-3 days, Blood: 6-12 hours')
     ]
     
-    cursor.executemany('''
-        INSERT INTO substances (name, common_names, chemical_formula, cas_number, category,
-                              description, mechanism_of_action, therapeutic_dose_min, therapeutic_dose_max,
-                              toxic_dose, lethal_dose, dose_unit, half_life, detection_window)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', substances)
-    
-    # Insert metabolites for some substances
+    # Metabolites for some substances, by position in the list above
     metabolites = [
         # Acetaminophen metabolites
         (1, 'Acetaminophen Glucuronide', 'C14H17NO8', 0, 'Phase II glucuronidation by UGT1A1, UGT1A6, UGT1A9',
@@ -145,24 +467,313 @@ def init_database():
          'Active metabolite with hallucinogenic properties', None, None, 0.3, 'mg/L'),
     ]
     
-    cursor.executemany('''
-        INSERT INTO metabolites (substance_id, name, chemical_formula, is_active, formation_pathway,
-                               detection_significance, therapeutic_range_min, therapeutic_range_max, toxic_level, unit)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', metabolites)
+    changed, removed = sync_catalog(conn, substances, metabolites)
+    
+    # Triggers keep an existing index in sync; a new one is built from the loaded rows in one pass
+    create_search_index(conn)
     
     conn.commit()
     conn.close()
-    print(f"Database initialized with {len(substances)} substances and {len(metabolites)} metabolites")
+    if changed or removed:
+        invalidate_catalog()
+    print(f"Database synced with {len(substances)} substances and {len(metabolites)} metabolites "
+          f"({changed} added or updated, {removed} removed)")
+
+def catalog_revision():
+    """(revision, changed_at) of the catalog, or None for databases without the revision row"""
+    try:
+        row = DB_POOL.connection().execute(http_cache.REVISION_QUERY).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return None if row is None else tuple(row)
+
+def catalog_fingerprint():
+    """Summarize the catalog tables for the HTTP cache validators"""
+    conn = DB_POOL.connection()
+    substances = tuple(conn.execute(
+        "SELECT COUNT(*), MAX(id), MAX(created_at), MAX(updated_at) FROM substances").fetchone())
+    metabolites = tuple(conn.execute("SELECT COUNT(*), MAX(id) FROM metabolites").fetchone())
+    revision = catalog_revision()
+    
+    # created_at, updated_at and changed_at are stored by SQLite as UTC text
+    newest = max(filter(None, substances[2:] + (revision[1] if revision else None,)), default=None)
+    return f'{substances}{metabolites}{revision}', http_cache.parse_sqlite_timestamp(newest)
+
+CATALOG_VERSION = http_cache.CatalogVersion(catalog_fingerprint, catalog_revision)
+
+def encode_snapshot_body(payload):
+    """Encode a snapshot response body the way send_json does"""
+    return json.dumps(payload).encode()
+
+def build_snapshot():
+    """Read the whole catalog into an in-memory snapshot"""
+    conn = DB_POOL.connection()
+    cursor = conn.execute(f"SELECT {', '.join(METABOLITE_FIELDS)} FROM metabolites ORDER BY substance_id, id")
+    metabolites = {}
+    for row in cursor:
+        metabolites.setdefault(row['substance_id'], []).append(tuple(row))
+    
+    substances = conn.execute(f"SELECT {select_columns(SUBSTANCE_FIELDS)} FROM substances")
+    rows = ((tuple(row), metabolites.get(row['id'], ())) for row in substances)
+    return catalog_snapshot.CatalogSnapshot(SUBSTANCE_FIELDS, METABOLITE_FIELDS, rows, encode_snapshot_body)
+
+def load_snapshot():
+    """Map CATALOG_FILE when it matches the database, otherwise build the snapshot in memory"""
+    if CATALOG_FILE:
+        try:
+            catalog = catalog_mmap.MappedCatalog(CATALOG_FILE, encode_snapshot_body, 'simple_app',
+                                                 catalog_fingerprint()[0])
+            if (catalog.fields, catalog.metabolite_fields) == (SUBSTANCE_FIELDS, METABOLITE_FIELDS):
+                return catalog
+            catalog.close()
+            raise ValueError(f"{CATALOG_FILE} was written with other substance or metabolite columns")
+        except (OSError, ValueError) as exc:
+            print(f"Not mapping the catalog file: {exc}; building the snapshot in memory", file=sys.stderr)
+    return build_snapshot()
+
+def export_catalog(path):
+    """Write the catalog to a binary file for --catalog-file"""
+    catalog_mmap.write(path, build_snapshot(), 'simple_app', catalog_fingerprint()[0])
+
+# Serves catalog reads from memory once enabled with --snapshot or --catalog-file
+CATALOG_SNAPSHOT = catalog_snapshot.SnapshotLoader(load_snapshot)
+
+def load_autocomplete_index():
+    """Index every substance name and common name for /api/autocomplete"""
+    conn = DB_POOL.connection()
+    return autocomplete.AutocompleteIndex(conn.execute("SELECT id, name, common_names FROM substances"))
+
+AUTOCOMPLETE_INDEX = catalog_snapshot.SnapshotLoader(load_autocomplete_index, enabled=True)
+
+def load_mass_index():
+    """Sort every substance and metabolite with a parsed formula by monoisotopic mass for /api/search/mass"""
+    conn = DB_POOL.connection()
+    substances = conn.execute('''
+        SELECT id, name, chemical_formula, monoisotopic_mass FROM substances
+        WHERE monoisotopic_mass IS NOT NULL
+    ''')
+    entries = [(mass, {'kind': 'substance', 'id': substance_id, 'name': name,
+                       'chemical_formula': chemical_formula, 'monoisotopic_mass': mass})
+               for substance_id, name, chemical_formula, mass in substances]
+    metabolites = conn.execute('''
+        SELECT metabolites.id, metabolites.name, metabolites.chemical_formula, metabolites.monoisotopic_mass,
+               substances.id, substances.name
+        FROM metabolites JOIN substances ON substances.id = metabolites.substance_id
+        WHERE metabolites.monoisotopic_mass IS NOT NULL
+    ''')
+    entries.extend((mass, {'kind': 'metabolite', 'id': metabolite_id, 'name': name,
+                           'chemical_formula': chemical_formula, 'monoisotopic_mass': mass,
+                           'substance_id': substance_id, 'substance_name': substance_name})
+                   for metabolite_id, name, chemical_formula, mass, substance_id, substance_name in metabolites)
+    return mass_search.MassIndex(entries)
+
+MASS_INDEX = catalog_snapshot.SnapshotLoader(load_mass_index, enabled=True)
+
+def load_threshold_table():
+    """Columnar dose thresholds of every substance for /api/dose-analysis"""
+    conn = DB_POOL.connection()
+    return read_model.ThresholdTable(conn.execute('''
+        SELECT id, name, dose_unit, category, therapeutic_dose_min, therapeutic_dose_max, toxic_dose, lethal_dose
+        FROM substances ORDER BY id
+    '''))
+
+THRESHOLD_TABLE = catalog_snapshot.SnapshotLoader(load_threshold_table, enabled=True)
+
+def invalidate_catalog():
+    """Hook to call after writing to the catalog tables so validators and cached responses are dropped"""
+    CATALOG_VERSION.invalidate()
+    RESPONSE_CACHE.clear()
+    CATALOG_SNAPSHOT.invalidate()
+    AUTOCOMPLETE_INDEX.invalidate()
+    MASS_INDEX.invalidate()
+    THRESHOLD_TABLE.invalidate()
+
+def refresh_catalog():
+    """Drop the caches when another process wrote to the catalog since they were built"""
+    if CATALOG_VERSION.changed():
+        invalidate_catalog()
+
+def is_catalog_path(path):
+    """Whether a GET path is a read of the reference catalog"""
+    return (path in ('/api/substances', '/api/categories', '/api/autocomplete', '/api/metabolites/search',
+                     '/api/search/mass') or
+            path.startswith('/api/substances/'))
+
+def fetch_metabolites(cursor, substance_ids):
+    """Fetch metabolites for many substances in one query, grouped by substance id"""
+    grouped = {}
+    if not substance_ids:
+        return grouped
+    
+    # Pass the ids as a single JSON array so the statement count and the number
+    # of bound parameters stay fixed no matter how many substances are listed
+    cursor.execute(
+        f"SELECT {', '.join(METABOLITE_FIELDS)} FROM metabolites "
+        "WHERE substance_id IN (SELECT value FROM json_each(?)) ORDER BY substance_id, id",
+        (json.dumps(substance_ids),)
+    )
+    for metabolite in cursor.fetchall():
+        grouped.setdefault(metabolite['substance_id'], []).append(dict(metabolite))
+    return grouped
+
+def fetch_substances(cursor, query, params, include_metabolites=True):
+    """Run a substance query and attach the metabolites of every row"""
+    cursor.execute(query, params)
+    substances = [dict(substance) for substance in cursor.fetchall()]
+    if not include_metabolites:
+        return substances
+    
+    # Get metabolites for all substances in a single query
+    metabolites_by_substance = fetch_metabolites(cursor, [s['id'] for s in substances])
+    
+    for substance in substances:
+        substance['metabolites'] = metabolites_by_substance.get(substance['id'], [])
+    return substances
+
+def parse_projection(query_params):
+    """Turn fields= and include= into the fields to return and a metabolites flag.
+    
+    Without fields= every field and the metabolites are returned, as before.
+    Raises ValueError for unknown names.
+    """
+    include = {name.strip() for value in query_params.get('include', []) for name in value.split(',') if name.strip()}
+    unknown = include - {'metabolites'}
+    if unknown:
+        raise ValueError(f"Unknown include: {', '.join(sorted(unknown))}")
+    
+    requested = {name.strip() for value in query_params.get('fields', []) for name in value.split(',') if name.strip()}
+    if not requested:
+        return SUBSTANCE_FIELDS, True
+    unknown = requested - set(SUBSTANCE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    
+    # id is always returned so clients can page and fetch details
+    fields = tuple(field for field in SUBSTANCE_FIELDS if field in requested or field == 'id')
+    return fields, 'metabolites' in include
+
+def select_columns(fields):
+    """SELECT column list for the given substance fields"""
+    return ", ".join(f"substances.{field}" for field in fields)
+
+def exact_filters(query_params):
+    """The category=, name= and cas= filters of a listing, as keyword arguments"""
+    filters = {}
+    for param, column in (('category', 'category'), ('name', 'name'), ('cas', 'cas_number')):
+        if param in query_params and query_params[param][0]:
+            filters[column] = query_params[param][0]
+    return filters
+
+def detection_filter(query_params):
+    """The detectable_in= and hours= filters as (matrix, hours), or None without either; raises ValueError"""
+    matrix = query_params.get('detectable_in', [''])[0]
+    hours = query_params.get('hours', [''])[0]
+    if not matrix and not hours:
+        return None
+    return durations.parse_detection_filter(matrix or None, hours or None)
+
+def threshold_filter(query_params):
+    """The toxic_min= and toxic_max= filters in unit= as ng/mL bounds, or None without either; raises ValueError"""
+    minimum = query_params.get('toxic_min', [''])[0]
+    maximum = query_params.get('toxic_max', [''])[0]
+    if not minimum and not maximum:
+        return None
+    return units.parse_threshold_filter(minimum or None, maximum or None, query_params.get('unit', [''])[0] or None)
+
+def keyset_query(query, where_conditions, params, after_id, limit):
+    """Restrict a substance query to the page following after_id, in id order"""
+    conditions = where_conditions + ["substances.id > ?"]
+    page_query = query + " WHERE " + " AND ".join(conditions) + " ORDER BY substances.id LIMIT ?"
+    return page_query, params + [after_id, limit]
+
+def iter_substances(cursor, query, where_conditions, params, include_metabolites=True,
+                    chunk_size=STREAM_CHUNK_SIZE):
+    """Yield substances chunk by chunk so the full result is never held in memory"""
+    after_id = 0
+    while True:
+        page_query, page_params = keyset_query(query, where_conditions, params, after_id, chunk_size)
+        chunk = fetch_substances(cursor, page_query, page_params, include_metabolites)
+        if not chunk:
+            return
+        yield from chunk
+        after_id = chunk[-1]['id']
+
+def int_param(query_params, name, default):
+    """Read an integer query parameter, falling back to the default when invalid"""
+    try:
+        return int(query_params[name][0])
+    except (KeyError, ValueError):
+        return default
+
+def ndjson_chunks(items, chunk_bytes=64 * 1024):
+    """Encode items as NDJSON, grouped into chunks of roughly chunk_bytes"""
+    # Encoded like the snapshot's lines, so both paths serve the same bytes
+    return line_chunks((encode_snapshot_body(item) + b'\n' for item in items), chunk_bytes)
+
+def line_chunks(lines, chunk_bytes=64 * 1024):
+    """Group already encoded lines into chunks of roughly chunk_bytes"""
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    yield b''.join(chunk)
+
+def fts_enabled(cursor):
+    """Check whether the database has the full-text search table"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,))
+    return cursor.fetchone() is not None
 
 class ForensicToxRequestHandler(SimpleHTTPRequestHandler):
     """Custom HTTP request handler for the forensic toxicology app"""
     
+    # Keep connections open between requests; idle ones are closed after the timeout.
+    # Headers and body go out in separate writes, so Nagle's algorithm would delay the body.
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEP_ALIVE_TIMEOUT
+    disable_nagle_algorithm = True
+    
+    def handle(self):
+        """Serve requests while they are waiting; close_connection stays False when the
+        connection is idle but should be kept alive"""
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self.request_pending():
+                return
+            self.handle_one_request()
+    
+    def request_pending(self):
+        """Whether the next request has (at least partly) arrived, without blocking"""
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+    
     def do_GET(self):
         """Handle GET requests"""
         parsed_path = urlparse(self.path)
         path = parsed_path.path
         query_params = parse_qs(parsed_path.query)
+        self.cache_key = None
+        
+        # Revalidations are answered from the in-memory version after one revision lookup,
+        # and repeated reads from the encoded-response cache
+        if is_catalog_path(path):
+            refresh_catalog()
+            if self.send_not_modified():
+                return
+            self.cache_key = http_cache.cache_key(
+                path, [(name, value) for name, values in query_params.items() for value in values])
+            self.cache_generation = RESPONSE_CACHE.generation
+            if not self.wants_ndjson() and self.send_cached_response():
+                return
         
         if path == '/':
             self.serve_html_file('index.html')
@@ -170,22 +781,34 @@ class ForensicToxRequestHandler(SimpleHTTPRequestHandler):
             self.handle_substances_api(query_params)
         elif path.startswith('/api/substances/'):
             substance_id = path.split('/')[-1]
-            self.handle_substance_detail_api(substance_id)
+            self.handle_substance_detail_api(substance_id, query_params)
         elif path == '/api/categories':
             self.handle_categories_api()
+        elif path == '/api/autocomplete':
+            self.handle_autocomplete_api(query_params)
+        elif path == '/api/metabolites/search':
+            self.handle_metabolite_search_api(query_params)
+        elif path == '/api/search/mass':
+            self.handle_mass_search_api(query_params.get('mz', []), query_params.get('ppm', [None])[0],
+                                        query_params.get('adduct', [None])[0])
+        elif path == '/api/cache-stats':
+            self.send_json(RESPONSE_CACHE.stats())
         else:
             super().do_GET()
     
     def do_POST(self):
         """Handle POST requests"""
+        if self.path in ('/api/dose-analysis', '/api/search/mass'):
+            refresh_catalog()
         if self.path == '/api/dose-analysis':
             self.handle_dose_analysis_api()
+        elif self.path == '/api/search/mass':
+            self.handle_mass_search_post()
         else:
             self.send_error(404)
     
-    def serve_html_file(self, filename):
-        """Serve the main HTML file with embedded CSS and JS"""
-        html_content = '''<!DOCTYPE html>
+    # Main page with embedded CSS and JS, served from INDEX_PAGE
+    INDEX_HTML = '''<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -303,6 +926,10 @@ class ForensicToxRequestHandler(SimpleHTTPRequestHandler):
                 this.selectedSubstance = null;
                 this.currentCategory = '';
                 this.currentSearch = '';
+                this.pageSize = 200;
+                this.listFields = 'id,name,category,chemical_formula';
+                this.searchResults = null;
+                this.searchTimer = null;
                 
                 this.initializeElements();
                 this.bindEvents();
@@ -326,19 +953,55 @@ class ForensicToxRequestHandler(SimpleHTTPRequestHandler):
             
             async loadSubstances() {
                 try {
-                    const response = await fetch('/api/substances');
-                    this.substances = await response.json();
-                    this.filteredSubstances = [...this.substances];
-                    this.displaySubstances();
-                    this.updateResultsCount();
+                    let cursor = null;
+                    do {
+                        const params = new URLSearchParams({ limit: this.pageSize, fields: this.listFields });
+                        if (cursor !== null) params.set('after_id', cursor);
+                        const response = await fetch(`/api/substances?${params}`);
+                        const page = await response.json();
+                        this.substances.push(...page.items);
+                        this.filterSubstances();
+                        cursor = page.next_cursor;
+                    } while (cursor !== null);
                 } catch (error) {
                     console.error('Error loading substances:', error);
                 }
             }
             
             handleSearch() {
-                this.currentSearch = this.searchInput.value.toLowerCase().trim();
-                this.filterSubstances();
+                this.currentSearch = this.searchInput.value.trim();
+                clearTimeout(this.searchTimer);
+                this.searchTimer = setTimeout(() => this.searchSubstances(), 250);
+            }
+            
+            async searchSubstances() {
+                const search = this.currentSearch;
+                if (!search) {
+                    this.searchResults = null;
+                    this.filterSubstances();
+                    return;
+                }
+                try {
+                    const params = new URLSearchParams({ search, fields: this.listFields });
+                    const response = await fetch(`/api/substances?${params}`);
+                    let results = await response.json();
+                    if (!results.length) {
+                        results = await this.suggestedSubstances(search);
+                    }
+                    if (search === this.currentSearch) {
+                        this.searchResults = results;
+                        this.filterSubstances();
+                    }
+                } catch (error) {
+                    console.error('Error searching substances:', error);
+                }
+            }
+            
+            async suggestedSubstances(search) {
+                const response = await fetch(`/api/autocomplete?${new URLSearchParams({ q: search })}`);
+                const suggestions = await response.json();
+                const byId = new Map(this.substances.map(substance => [substance.id, substance]));
+                return suggestions.map(suggestion => byId.get(suggestion.id)).filter(Boolean);
             }
             
             handleCategoryFilter() {
@@ -347,15 +1010,9 @@ class ForensicToxRequestHandler(SimpleHTTPRequestHandler):
             }
             
             filterSubstances() {
-                this.filteredSubstances = this.substances.filter(substance => {
-                    const matchesCategory = !this.currentCategory || substance.category === this.currentCategory;
-                    const matchesSearch = !this.currentSearch || 
-                        substance.name.toLowerCase().includes(this.currentSearch) ||
-                        (substance.common_names && substance.common_names.toLowerCase().includes(this.currentSearch)) ||
-                        (substance.description && substance.description.toLowerCase().includes(this.currentSearch));
-                    
-                    return matchesCategory && matchesSearch;
-                });
+                const source = this.currentSearch && this.searchResults ? this.searchResults : this.substances;
+                this.filteredSubstances = source.filter(substance =>
+                    !this.currentCategory || substance.category === this.currentCategory);
                 
                 this.displaySubstances();
                 this.updateResultsCount();
@@ -366,6 +1023,8 @@ class ForensicToxRequestHandler(SimpleHTTPRequestHandler):
                 this.categoryFilter.value = '';
                 this.currentSearch = '';
                 this.currentCategory = '';
+                this.searchResults = null;
+                clearTimeout(this.searchTimer);
                 this.filteredSubstances = [...this.substances];
                 this.displaySubstances();
                 this.updateResultsCount();
@@ -386,9 +1045,6 @@ class ForensicToxRequestHandler(SimpleHTTPRequestHandler):
                             ${this.formatCategory(substance.category)}
                         </div>
                         ${substance.chemical_formula ? `<div class="substance-formula">${substance.chemical_formula}</div>` : ''}
-                        <div class="substance-description">
-                            ${substance.description || 'No description available'}
-                        </div>
                     </div>
                 `).join('');
                 
@@ -400,7 +1056,7 @@ class ForensicToxRequestHandler(SimpleHTTPRequestHandler):
                 });
             }
             
-            selectSubstance(id) {
+            async selectSubstance(id) {
                 this.substancesList.querySelectorAll('.substance-item').forEach(item => {
                     item.classList.remove('selected');
                 });
@@ -410,9 +1066,13 @@ class ForensicToxRequestHandler(SimpleHTTPRequestHandler):
                     selectedItem.classList.add('selected');
                 }
                 
-                this.selectedSubstance = this.substances.find(s => s.id === id);
-                if (this.selectedSubstance) {
+                try {
+                    const response = await fetch(`/api/substances/${id}`);
+                    if (!response.ok) return;
+                    this.selectedSubstance = await response.json();
                     this.displaySubstanceDetail(this.selectedSubstance);
+                } catch (error) {
+                    console.error('Error loading substance details:', error);
                 }
             }
             
@@ -525,122 +1185,563 @@ class ForensicToxRequestHandler(SimpleHTTPRequestHandler):
     </script>
 </body>
 </html>'''
-        
+    
+    def serve_html_file(self, filename):
+        """Serve the main page, compressed once at startup"""
+        body, encoding = INDEX_PAGE.select(self.headers.get('Accept-Encoding'))
         self.send_response(200)
         self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if INDEX_PAGE.variants:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def accepted_encoding(self):
+        """The content coding negotiated from Accept-Encoding, or None"""
+        return compression.negotiate(self.headers.get('Accept-Encoding'))
+    
+    def send_json(self, payload, status=200, headers=None, cache=False):
+        """Send a JSON response, optionally keeping the encoded body for repeated reads"""
+        body = json.dumps(payload).encode()
+        if cache:
+            RESPONSE_CACHE.put(self.cache_key, body, self.cache_generation)
+        self.send_json_body(body, status, headers, cache)
+    
+    def send_json_body(self, body, status=200, headers=None, cache=False):
+        """Send an already encoded JSON body, compressed if the client accepts it.
+        
+        With cache, the compressed body is kept next to the plain one in the response cache.
+        """
+        encoding = self.accepted_encoding() if len(body) >= compression.MIN_SIZE else None
+        if encoding:
+            body = self.compressed_body(body, encoding, cache)
+            headers = http_cache.coded_headers(headers or {}, encoding)
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def compressed_body(self, body, encoding, cache):
+        """Compress a response body, reusing the cached variant for repeated catalog reads"""
+        if not cache:
+            return compression.compress(body, encoding)
+        key = (self.cache_key, encoding)
+        compressed = RESPONSE_CACHE.get(key)
+        if compressed is None:
+            compressed = compression.compress(body, encoding)
+            RESPONSE_CACHE.put(key, compressed, self.cache_generation)
+        return compressed
+    
+    def send_ndjson(self, chunks):
+        """Stream NDJSON chunks with the catalog headers, compressing them on the fly if accepted"""
+        encoding = self.accepted_encoding()
+        self.send_response(200)
+        self.send_header('Content-type', NDJSON_MIMETYPE)
+        self.send_header('Transfer-Encoding', 'chunked')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        for name, value in http_cache.coded_headers(self.catalog_headers(), encoding).items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(html_content.encode())
+        self.send_chunked(compression.compress_chunks(chunks, encoding) if encoding else chunks)
+    
+    def send_chunked(self, chunks):
+        """Write an iterable of byte strings using chunked transfer encoding"""
+        for chunk in chunks:
+            if chunk:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.write(b'0\r\n\r\n')
+    
+    def send_cached_response(self):
+        """Send the cached body for this request if there is one; returns whether it did"""
+        body = RESPONSE_CACHE.get(self.cache_key)
+        if body is None:
+            return False
+        self.send_json_body(body, headers=self.catalog_headers(), cache=True)
+        return True
+    
+    def wants_ndjson(self):
+        """Whether the client asked for newline-delimited JSON"""
+        return NDJSON_MIMETYPE in self.headers.get('Accept', '')
+    
+    def catalog_headers(self):
+        """ETag, Last-Modified and Cache-Control headers for a plain catalog response"""
+        variant = 'ndjson' if self.wants_ndjson() else 'json'
+        return http_cache.validator_headers(CATALOG_VERSION, variant, CATALOG_MAX_AGE)
+    
+    def send_not_modified(self):
+        """Send 304 Not Modified if the client's copy is current; returns whether it did"""
+        headers = http_cache.not_modified_headers(self.headers, self.catalog_headers(), self.accepted_encoding(),
+                                                  CATALOG_VERSION.last_modified)
+        if headers is None:
+            return False
+        
+        self.send_response(304)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        return True
     
     def handle_substances_api(self, query_params):
         """Handle substances API endpoint"""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        try:
+            fields, include_metabolites = parse_projection(query_params)
+            detectable = detection_filter(query_params)
+            toxic_range = threshold_filter(query_params)
+        except ValueError as exc:
+            self.send_json({'error': str(exc)}, status=400)
+            return
+        
+        filters = exact_filters(query_params)
+        snapshot = CATALOG_SNAPSHOT.get()
+        if (snapshot is not None and not query_params.get('search', [''])[0] and detectable is None
+                and toxic_range is None):
+            self.send_snapshot_listing(snapshot, query_params, fields, include_metabolites, filters)
+            return
+        
+        cursor = DB_POOL.connection().cursor()
         
         # Build query based on filters
-        query = "SELECT * FROM substances"
+        query = f"SELECT {select_columns(fields)} FROM substances"
         where_conditions = []
         params = []
-        
-        if 'category' in query_params and query_params['category'][0]:
-            where_conditions.append("category = ?")
-            params.append(query_params['category'][0])
+        order_by = None
         
         if 'search' in query_params and query_params['search'][0]:
-            search_term = f"%{query_params['search'][0]}%"
-            where_conditions.append("(name LIKE ? OR common_names LIKE ? OR description LIKE ?)")
-            params.extend([search_term, search_term, search_term])
+            search = query_params['search'][0]
+            match = search_index.match_expression(search)
+            if match and fts_enabled(cursor):
+                # Ranked full-text lookup instead of scanning every row with LIKE
+                query += (f" JOIN (SELECT rowid, {search_index.rank_expression(FTS_TABLE)} AS rank"
+                          f" FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?) AS fts"
+                          f" ON fts.rowid = substances.id")
+                params.append(match)
+                order_by = "fts.rank"
+            else:
+                search_term = f"%{search}%"
+                where_conditions.append("(name LIKE ? OR common_names LIKE ? OR description LIKE ?)")
+                params.extend([search_term, search_term, search_term])
         
-        if where_conditions:
-            query += " WHERE " + " AND ".join(where_conditions)
+        for column, value in filters.items():
+            where_conditions.append(f"{column} = ?")
+            params.append(value)
         
-        cursor.execute(query, params)
-        substances = cursor.fetchall()
+        if detectable is not None:
+            # Still detectable `hours` after use: a window of the matrix that ends at or after it
+            matrix, hours = detectable
+            window_conditions = []
+            if matrix is not None:
+                window_conditions.append("matrix = ?")
+                params.append(matrix)
+            if hours is not None:
+                window_conditions.append("max_hours >= ?")
+                params.append(hours)
+            where_conditions.append("substances.id IN (SELECT substance_id FROM detection_windows WHERE "
+                                    + " AND ".join(window_conditions) + ")")
         
-        # Get metabolites for each substance
-        result = []
-        for substance in substances:
-            substance_dict = dict(substance)
-            
-            # Get metabolites
-            cursor.execute("SELECT * FROM metabolites WHERE substance_id = ?", (substance['id'],))
-            metabolites = cursor.fetchall()
-            substance_dict['metabolites'] = [dict(m) for m in metabolites]
+        if toxic_range is not None:
+            # Compared in ng/mL, whatever unit each substance's thresholds were published in
+            minimum, maximum = toxic_range
+            if minimum is not None:
+                where_conditions.append("toxic_dose_ng_ml >= ?")
+                params.append(minimum)
+            if maximum is not None:
+                where_conditions.append("toxic_dose_ng_ml <= ?")
+                params.append(maximum)
+        
+        # Paged and streamed results walk the primary key instead of the search rank
+        if self.wants_ndjson():
+            substances = iter_substances(cursor, query, where_conditions, params, include_metabolites)
+            self.send_ndjson(ndjson_chunks(substances))
+            return
+        
+        if 'limit' in query_params or 'after_id' in query_params:
+            after_id = int_param(query_params, 'after_id', 0)
+            limit = max(1, min(int_param(query_params, 'limit', DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
             
-            result.append(substance_dict)
+            # Fetch one extra row to learn whether another page follows
+            page_query, page_params = keyset_query(query, where_conditions, params, after_id, limit + 1)
+            substances = fetch_substances(cursor, page_query, page_params, include_metabolites)
+            next_cursor = substances[limit - 1]['id'] if len(substances) > limit else None
+            result = {'items': substances[:limit], 'next_cursor': next_cursor}
+        else:
+            if where_conditions:
+                query += " WHERE " + " AND ".join(where_conditions)
+            if order_by:
+                query += " ORDER BY " + order_by
+            result = fetch_substances(cursor, query, params, include_metabolites)
         
-        conn.close()
+        self.send_json(result, headers=self.catalog_headers(), cache=True)
+    
+    def send_snapshot_listing(self, snapshot, query_params, fields, include_metabolites, filters):
+        """Answer a substance listing from the in-memory snapshot"""
+        if self.wants_ndjson():
+            self.send_ndjson(line_chunks(snapshot.ndjson_lines(fields, include_metabolites, **filters)))
+            return
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(result).encode())
+        if 'limit' in query_params or 'after_id' in query_params:
+            after_id = int_param(query_params, 'after_id', 0)
+            limit = max(1, min(int_param(query_params, 'limit', DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+            body = snapshot.page_body(fields, include_metabolites, after_id, limit, **filters)
+        else:
+            body = snapshot.listing_body(fields, include_metabolites, **filters)
+        self.send_json_body(body, headers=self.catalog_headers(), cache=True)
     
-    def handle_substance_detail_api(self, substance_id):
+    def handle_substance_detail_api(self, substance_id, query_params):
         """Handle individual substance detail API"""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM substances WHERE id = ?", (substance_id,))
-        substance = cursor.fetchone()
-        
-        if not substance:
-            self.send_error(404)
+        try:
+            fields, include_metabolites = parse_projection(query_params)
+        except ValueError as exc:
+            self.send_json({'error': str(exc)}, status=400)
             return
         
-        substance_dict = dict(substance)
+        snapshot = CATALOG_SNAPSHOT.get()
+        if snapshot is not None:
+            try:
+                body = snapshot.substance_body(int(substance_id), fields, include_metabolites)
+            except ValueError:
+                body = None
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_json_body(body, headers=self.catalog_headers(), cache=True)
+            return
         
-        # Get metabolites
-        cursor.execute("SELECT * FROM metabolites WHERE substance_id = ?", (substance_id,))
-        metabolites = cursor.fetchall()
-        substance_dict['metabolites'] = [dict(m) for m in metabolites]
+        cursor = DB_POOL.connection().cursor()
+        substances = fetch_substances(cursor, f"SELECT {select_columns(fields)} FROM substances WHERE id = ?",
+                                      (substance_id,), include_metabolites)
         
-        conn.close()
+        if not substances:
+            self.send_error(404)
+            return
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(substance_dict).encode())
+        self.send_json(substances[0], headers=self.catalog_headers(), cache=True)
     
     def handle_categories_api(self):
         """Handle categories API"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        snapshot = CATALOG_SNAPSHOT.get()
+        if snapshot is not None:
+            self.send_json_body(snapshot.categories_body, headers=self.catalog_headers(), cache=True)
+            return
         
+        cursor = DB_POOL.connection().cursor()
         cursor.execute("SELECT DISTINCT category FROM substances")
         categories = [row[0] for row in cursor.fetchall()]
         
-        conn.close()
+        self.send_json(categories, headers=self.catalog_headers(), cache=True)
+    
+    def handle_autocomplete_api(self, query_params):
+        """Handle autocomplete API"""
+        query = query_params.get('q', [''])[0]
+        limit = max(1, min(int_param(query_params, 'limit', autocomplete.DEFAULT_LIMIT), autocomplete.MAX_LIMIT))
+        # Not kept in the response cache: lookups are cheaper than the cache churn of one entry per keystroke
+        self.send_json(AUTOCOMPLETE_INDEX.get().lookup(query, limit), headers=self.catalog_headers())
+    
+    def handle_metabolite_search_api(self, query_params):
+        """Handle metabolite to parent substance lookup API"""
+        try:
+            name_keys, formula_keys = metabolite_search.parse_terms(query_params.get('name', []),
+                                                                    query_params.get('formula', []))
+        except ValueError as exc:
+            self.send_json({'error': str(exc)}, status=400)
+            return
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(categories).encode())
+        # One query over the name and formula indexes for every detected metabolite
+        keys = list(name_keys) + list(formula_keys)
+        rows = DB_POOL.connection().execute(f'''
+            SELECT substances.id, substances.name, substances.category,
+                   metabolites.id, metabolites.name, metabolites.chemical_formula, metabolites.normalized_name
+            FROM metabolites JOIN substances ON substances.id = metabolites.substance_id
+            WHERE metabolites.normalized_name IN ({', '.join('?' for _ in name_keys) or 'NULL'})
+               OR metabolites.chemical_formula IN ({', '.join('?' for _ in formula_keys) or 'NULL'})
+            ORDER BY metabolites.id
+        ''', keys)
+        self.send_json(metabolite_search.rank_parents(rows, name_keys, formula_keys),
+                       headers=self.catalog_headers(), cache=True)
+    
+    def handle_mass_search_api(self, mz_values, ppm, adduct):
+        """Handle accurate-mass screening API"""
+        try:
+            mz_values, ppm, adduct = mass_search.parse_request(mz_values, ppm, adduct)
+        except ValueError as exc:
+            self.send_json({'error': str(exc)}, status=400)
+            return
+        
+        # Not kept in the response cache: peak lists rarely repeat
+        results = MASS_INDEX.get().screen(mz_values, ppm, adduct)
+        self.send_json({'adduct': adduct, 'ppm': ppm, 'results': results}, headers=self.catalog_headers())
+    
+    def handle_mass_search_post(self):
+        """Handle accurate-mass screening of a whole peak list sent as JSON"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length))
+            mz_values = data.get('mz')
+            ppm, adduct = data.get('ppm'), data.get('adduct')
+        except (ValueError, AttributeError):
+            self.send_json({'error': 'Expected a JSON object'}, status=400)
+            return
+        mz_values = mz_values if isinstance(mz_values, list) else [mz_values] if mz_values is not None else []
+        self.handle_mass_search_api(mz_values, ppm, adduct)
     
     def handle_dose_analysis_api(self):
         """Handle dose analysis API"""
-        # This is a simplified version - in the full app it would be more sophisticated
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({"message": "Dose analysis endpoint"}).encode())
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length))
+            substance_id = data.get('substance_id')
+            measured_level = data.get('measured_level')
+            measured_unit = data.get('unit')
+        except (ValueError, AttributeError):
+            self.send_json({'error': 'Expected a JSON object'}, status=400)
+            return
+        try:
+            substance_id = read_model.parse_id(substance_id)
+        except ValueError:
+            self.send_json({'error': 'substance_id must be an integer'}, status=400)
+            return
+        is_number = isinstance(measured_level, (int, float)) and not isinstance(measured_level, bool)
+        # json.loads accepts NaN and Infinity, which classify as nothing and cannot be sent back as JSON
+        if not is_number or not math.isfinite(measured_level):
+            self.send_json({'error': 'measured_level must be a finite number'}, status=400)
+            return
+        if measured_unit is not None and not isinstance(measured_unit, str):
+            self.send_json({'error': 'unit must be a string'}, status=400)
+            return
+        
+        thresholds = THRESHOLD_TABLE.get().get(substance_id)
+        if thresholds is None:
+            self.send_error(404)
+            return
+        
+        # A measurement without a unit is in the substance's dose_unit
+        measured_unit = measured_unit or thresholds.unit
+        try:
+            level = units.convert(measured_level, measured_unit, thresholds.unit)
+        except ValueError as exc:
+            self.send_json({'error': str(exc)}, status=400)
+            return
+        self.send_json({
+            'substance_name': thresholds.name,
+            'measured_level': measured_level,
+            'unit': measured_unit,
+            'interpretation': thresholds.classify(level)
+        })
+
+# The main page never changes while the server runs
+INDEX_PAGE = compression.PrecompressedBody(ForensicToxRequestHandler.INDEX_HTML.encode(), 'text/html')
 
-def start_server():
+class PooledHTTPServer(HTTPServer):
+    """HTTP server answering requests from a bounded pool of worker threads.
+    
+    A worker only holds a connection while requests keep arriving on it. Idle
+    keep-alive connections wait in a selector, so they never tie up a worker,
+    and are closed after KEEP_ALIVE_TIMEOUT seconds.
+    """
+    
+    def __init__(self, server_address, handler_class, threads=DEFAULT_THREADS, bind_and_activate=True):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.threads = threads
+        self.executor = None
+        self.selector = None
+        self.watcher = None
+        self.idle = {}
+        self.idle_lock = threading.Lock()
+        self.closing = threading.Event()
+    
+    def serve_forever(self, poll_interval=0.5):
+        """Start the workers, then accept connections until shutdown"""
+        # Created here rather than in __init__ so every forked process gets its own threads
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.selector = selectors.DefaultSelector()
+        self.waker, self.wake_reader = socket.socketpair()
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+        self.watcher = threading.Thread(target=self.watch_idle_connections, daemon=True)
+        self.watcher.start()
+        super().serve_forever(poll_interval)
+    
+    def process_request(self, request, client_address):
+        """Queue the connection for the next free worker"""
+        self.executor.submit(self.process_request_thread, request, client_address)
+    
+    def process_request_thread(self, request, client_address):
+        """Serve the requests waiting on a connection, then park or close it"""
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+            if handler.close_connection is False:
+                self.park(request, client_address)
+                return
+        except Exception:
+            self.handle_error(request, client_address)
+        self.shutdown_request(request)
+    
+    def park(self, request, client_address):
+        """Wait for the next request of a keep-alive connection without holding a worker"""
+        with self.idle_lock:
+            # A worker finishing after server_close() has nowhere to park
+            if self.closing.is_set():
+                self.shutdown_request(request)
+                return
+            self.idle[request] = (client_address, time.monotonic())
+            self.selector.register(request, selectors.EVENT_READ)
+        self.waker.send(b'\0')
+    
+    def watch_idle_connections(self):
+        """Hand parked connections back to the pool when they become readable"""
+        while True:
+            ready = self.selector.select(timeout=1)
+            expired = []
+            with self.idle_lock:
+                # server_close() closes whatever is still parked
+                if self.closing.is_set():
+                    return
+                for key, _ in ready:
+                    if key.fileobj is self.wake_reader:
+                        self.wake_reader.recv(4096)
+                        continue
+                    self.selector.unregister(key.fileobj)
+                    client_address, _ = self.idle.pop(key.fileobj)
+                    self.executor.submit(self.process_request_thread, key.fileobj, client_address)
+                now = time.monotonic()
+                for request, (_, since) in list(self.idle.items()):
+                    if now - since > KEEP_ALIVE_TIMEOUT:
+                        self.selector.unregister(request)
+                        del self.idle[request]
+                        expired.append(request)
+            for request in expired:
+                self.shutdown_request(request)
+    
+    def server_close(self):
+        """Stop accepting connections, close the idle ones and let the workers finish"""
+        super().server_close()
+        if self.selector is not None:
+            with self.idle_lock:
+                self.closing.set()
+                idle, self.idle = self.idle, {}
+            self.waker.send(b'\0')
+            self.watcher.join()
+            for request in idle:
+                self.selector.unregister(request)
+                self.shutdown_request(request)
+            self.selector.close()
+            self.waker.close()
+            self.wake_reader.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+def make_server(host, port, threads=DEFAULT_THREADS):
+    """Create the HTTP server; threads=1 answers one request at a time"""
+    return PooledHTTPServer((host, port), ForensicToxRequestHandler, threads)
+
+def serve_forked(httpd, processes):
+    """Serve the listening socket from several forked processes until interrupted"""
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            # Child: the parent handles Ctrl+C and terminates the children
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, lambda signum, frame: os._exit(0))
+            try:
+                httpd.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    
+    # Stopping the parent with SIGTERM also stops the children
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+def parse_args(argv=None):
+    """Command line options of the standalone server"""
+    parser = argparse.ArgumentParser(description='Forensic Toxicology Database (standalone server)')
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help='worker threads per process; 1 serves one connection at a time')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='pre-forked processes sharing the listening socket (POSIX only)')
+    parser.add_argument('--no-init', action='store_true',
+                        help='serve the existing database without syncing the built-in catalog into it')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='delete the database and load the built-in catalog from scratch')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='load the catalog into memory at startup and serve reads without querying SQLite')
+    parser.add_argument('--export-catalog', metavar='PATH',
+                        help='write the catalog to a binary file for --catalog-file and exit')
+    parser.add_argument('--catalog-file', metavar='PATH',
+                        help='like --snapshot, but map a file written by --export-catalog, '
+                             'so all processes share one copy')
+    return parser.parse_args(argv)
+
+def start_server(argv=None):
     """Start the HTTP server"""
-    init_database()
+    args = parse_args(argv)
+    if args.rebuild or not args.no_init:
+        init_database(rebuild=args.rebuild)
+    
+    if args.export_catalog:
+        start = time.perf_counter()
+        export_catalog(args.export_catalog)
+        print(f"Catalog written to {args.export_catalog} ({os.path.getsize(args.export_catalog) / 1024:,.0f} KiB) "
+              f"in {time.perf_counter() - start:.2f}s")
+        return
     
-    server_address = ('', 8000)
-    httpd = HTTPServer(server_address, ForensicToxRequestHandler)
+    if args.snapshot or args.catalog_file:
+        # Built before forking so every process shares the same pages
+        global CATALOG_FILE
+        CATALOG_FILE = args.catalog_file
+        CATALOG_SNAPSHOT.enabled = True
+        start = time.perf_counter()
+        snapshot = CATALOG_SNAPSHOT.get()
+        source = f"mapped from {snapshot.path}" if isinstance(snapshot, catalog_mmap.MappedCatalog) else "in memory"
+        print(f"Catalog snapshot {source}: {len(snapshot)} substances, {snapshot.encoded_bytes / 1024:,.0f} KiB "
+              f"of pre-encoded JSON, ready in {time.perf_counter() - start:.2f}s")
     
-    print("Forensic Toxicology Database running at http://localhost:8000")
+    # Built up front so the first keystrokes are not kept waiting, and shared by forked processes
+    start = time.perf_counter()
+    index = AUTOCOMPLETE_INDEX.get()
+    print(f"Autocomplete index: {len(index)} names of {index.substance_count} substances, "
+          f"built in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    mass_index = MASS_INDEX.get()
+    print(f"Mass index: {len(mass_index)} formulas, built in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    thresholds = THRESHOLD_TABLE.get()
+    print(f"Dose thresholds: {len(thresholds)} substances, built in {time.perf_counter() - start:.2f}s")
+    
+    httpd = make_server(args.host, args.port, max(args.threads, 1))
+    
+    print(f"Forensic Toxicology Database running at http://localhost:{args.port}")
+    print(f"Serving with {args.processes} process(es) x {max(args.threads, 1)} thread(s)")
     print("Press Ctrl+C to stop the server")
     
     try:
-        httpd.serve_forever()
+        if args.processes > 1 and hasattr(os, 'fork'):
+            serve_forked(httpd, args.processes)
+        else:
+            httpd.serve_forever()
     except KeyboardInterrupt:
         print("\nServer stopped")
+    finally:
         httpd.server_close()
+        DB_POOL.close_all()
 
 if __name__ == "__main__":
     start_server()
\ No newline at end of file
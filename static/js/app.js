@@ -5,6 +5,10 @@ class ForensicToxicologyApp {
         this.selectedSubstance = null;
         this.currentCategory = '';
         this.currentSearch = '';
+        this.pageSize = 200;
+        this.listFields = 'id,name,category,chemical_formula';
+        this.searchResults = null;
+        this.searchTimer = null;
         
         this.initializeElements();
         this.bindEvents();
@@ -52,11 +56,19 @@ class ForensicToxicologyApp {
     async loadSubstances() {
         try {
             this.showLoading();
-            const response = await fetch('/api/substances');
-            this.substances = await response.json();
-            this.filteredSubstances = [...this.substances];
-            this.displaySubstances();
-            this.updateResultsCount();
+            this.substances = [];
+            
+            // Render each page as soon as it arrives instead of waiting for the whole catalog
+            let cursor = null;
+            do {
+                const params = new URLSearchParams({ limit: this.pageSize, fields: this.listFields });
+                if (cursor !== null) params.set('after_id', cursor);
+                const response = await fetch(`/api/substances?${params}`);
+                const page = await response.json();
+                this.substances.push(...page.items);
+                this.filterSubstances();
+                cursor = page.next_cursor;
+            } while (cursor !== null);
         } catch (error) {
             console.error('Error loading substances:', error);
             this.showError('Failed to load substances');
@@ -64,8 +76,46 @@ class ForensicToxicologyApp {
     }
     
     handleSearch() {
-        this.currentSearch = this.searchInput.value.toLowerCase().trim();
-        this.filterSubstances();
+        this.currentSearch = this.searchInput.value.trim();
+        
+        // Debounce keystrokes so the server only sees the settled search term
+        clearTimeout(this.searchTimer);
+        this.searchTimer = setTimeout(() => this.searchSubstances(), 250);
+    }
+    
+    async searchSubstances() {
+        const search = this.currentSearch;
+        if (!search) {
+            this.searchResults = null;
+            this.filterSubstances();
+            return;
+        }
+        
+        try {
+            const params = new URLSearchParams({ search, fields: this.listFields });
+            const response = await fetch(`/api/substances?${params}`);
+            let results = await response.json();
+            
+            // Misspelled names match nothing in the full-text index; fall back to the typo-tolerant autocomplete
+            if (!results.length) {
+                results = await this.suggestedSubstances(search);
+            }
+            
+            // Ignore responses for terms the user has already typed past
+            if (search === this.currentSearch) {
+                this.searchResults = results;
+                this.filterSubstances();
+            }
+        } catch (error) {
+            console.error('Error searching substances:', error);
+        }
+    }
+    
+    async suggestedSubstances(search) {
+        const response = await fetch(`/api/autocomplete?${new URLSearchParams({ q: search })}`);
+        const suggestions = await response.json();
+        const byId = new Map(this.substances.map(substance => [substance.id, substance]));
+        return suggestions.map(suggestion => byId.get(suggestion.id)).filter(Boolean);
     }
     
     handleCategoryFilter() {
@@ -74,16 +124,10 @@ class ForensicToxicologyApp {
     }
     
     filterSubstances() {
-        this.filteredSubstances = this.substances.filter(substance => {
-            const matchesCategory = !this.currentCategory || substance.category === this.currentCategory;
-            const matchesSearch = !this.currentSearch || 
-                substance.name.toLowerCase().includes(this.currentSearch) ||
-                (substance.common_names && substance.common_names.toLowerCase().includes(this.currentSearch)) ||
-                (substance.description && substance.description.toLowerCase().includes(this.currentSearch)) ||
-                (substance.chemical_formula && substance.chemical_formula.toLowerCase().includes(this.currentSearch));
-            
-            return matchesCategory && matchesSearch;
-        });
+        // Search results come ranked from the server; the category filter is applied locally
+        const source = this.currentSearch && this.searchResults ? this.searchResults : this.substances;
+        this.filteredSubstances = source.filter(substance =>
+            !this.currentCategory || substance.category === this.currentCategory);
         
         this.displaySubstances();
         this.updateResultsCount();
@@ -94,6 +138,8 @@ class ForensicToxicologyApp {
         this.categoryFilter.value = '';
         this.currentSearch = '';
         this.currentCategory = '';
+        this.searchResults = null;
+        clearTimeout(this.searchTimer);
         this.filteredSubstances = [...this.substances];
         this.displaySubstances();
         this.updateResultsCount();
@@ -119,9 +165,6 @@ class ForensicToxicologyApp {
                     ${this.formatCategory(substance.category)}
                 </div>
                 ${substance.chemical_formula ? `<div class="substance-formula">${substance.chemical_formula}</div>` : ''}
-                <div class="substance-description">
-                    ${substance.description || 'No description available'}
-                </div>
             </div>
         `).join('');
         
@@ -134,7 +177,7 @@ class ForensicToxicologyApp {
         });
     }
     
-    selectSubstance(id) {
+    async selectSubstance(id) {
         // Update visual selection
         this.substancesList.querySelectorAll('.substance-item').forEach(item => {
             item.classList.remove('selected');
@@ -145,10 +188,14 @@ class ForensicToxicologyApp {
             selectedItem.classList.add('selected');
         }
         
-        // Find and display substance details
-        this.selectedSubstance = this.substances.find(s => s.id === id);
-        if (this.selectedSubstance) {
+        // The list only carries summary fields, so fetch the full record on selection
+        try {
+            const response = await fetch(`/api/substances/${id}`);
+            if (!response.ok) return;
+            this.selectedSubstance = await response.json();
             this.displaySubstanceDetail(this.selectedSubstance);
+        } catch (error) {
+            console.error('Error loading substance details:', error);
         }
     }
     
@@ -0,0 +1,87 @@
+"""
+Shared fixtures: the Flask app and simple_app.py, each on a temporary
+database, and a running simple_app server
+"""
+
+import http.client
+import json
+import os
+import sqlite3
+import threading
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def flask_app(tmp_path_factory):
+    # app.py reads DATABASE_URL when it is first imported
+    os.environ['DATABASE_URL'] = 'sqlite:///' + str(tmp_path_factory.mktemp('flask') / 'catalog.db')
+    import app
+    return app
+
+
+@pytest.fixture
+def flask_db(flask_app):
+    """The Flask app module with an empty catalog, inside an application context"""
+    with flask_app.app.app_context():
+        flask_app.db.drop_all()
+        flask_app.db.create_all()
+        flask_app.reset_catalog_caches()
+        yield flask_app
+        flask_app.db.session.remove()
+
+
+@pytest.fixture
+def client(flask_db):
+    return flask_db.app.test_client()
+
+
+@pytest.fixture
+def simple_db(tmp_path, monkeypatch):
+    """simple_app.py with an empty catalog in a temporary database"""
+    import simple_app
+    path = str(tmp_path / 'catalog.db')
+    monkeypatch.setattr(simple_app, 'DB_PATH', path)
+    monkeypatch.setattr(simple_app, 'DB_POOL', simple_app.ConnectionPool(path))
+    conn = sqlite3.connect(path)
+    simple_app.create_schema(conn)
+    conn.commit()
+    conn.close()
+    simple_app.invalidate_catalog()
+    yield simple_app
+    simple_app.DB_POOL.close_all()
+    simple_app.invalidate_catalog()
+
+
+class SimpleServer:
+    """A simple_app server on an ephemeral port"""
+
+    def __init__(self, httpd):
+        self.httpd = httpd
+        self.port = httpd.server_address[1]
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request; returns (status, headers, body bytes)"""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        try:
+            conn.request(method, path, body, headers or {})
+            response = conn.getresponse()
+            return response.status, response.headers, response.read()
+        finally:
+            conn.close()
+
+    def get_json(self, path):
+        status, _, body = self.request('GET', path)
+        assert status == 200, body
+        return json.loads(body)
+
+
+@pytest.fixture
+def simple_server(simple_db):
+    httpd = simple_db.make_server('127.0.0.1', 0, threads=2)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield SimpleServer(httpd)
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
@@ -0,0 +1,48 @@
+"""
+Catalog files (user-024): a file written with other substance or metabolite
+fields than the running code serves is not mapped; the snapshot is built
+from the database instead
+"""
+
+import catalog_mmap
+import catalog_snapshot
+
+
+def stale_snapshot(snapshot, encode):
+    # As written by a version that served one substance field fewer
+    fields = snapshot.fields[:-1]
+    rows = ((record.values[:-1], record.metabolites) for record in snapshot.records)
+    return catalog_snapshot.CatalogSnapshot(fields, snapshot.metabolite_fields, rows, encode)
+
+
+def test_flask_rebuilds_a_snapshot_over_a_file_with_other_fields(flask_db, tmp_path, monkeypatch):
+    flask_db.db.session.add(flask_db.Substance(name='Caffeine', category='pharmaceutical'))
+    flask_db.db.session.commit()
+    path = str(tmp_path / 'catalog.bin')
+    fingerprint = flask_db.catalog_fingerprint()[0]
+    monkeypatch.setitem(flask_db.app.config, 'CATALOG_FILE', path)
+
+    catalog_mmap.write(path, flask_db.build_catalog_snapshot(), 'flask', fingerprint)
+    mapped = flask_db.load_catalog_snapshot()
+    assert isinstance(mapped, catalog_mmap.MappedCatalog)
+    mapped.close()
+
+    catalog_mmap.write(path, stale_snapshot(flask_db.build_catalog_snapshot(), flask_db.encode_json), 'flask',
+                       fingerprint)
+    snapshot = flask_db.load_catalog_snapshot()
+    assert isinstance(snapshot, catalog_snapshot.CatalogSnapshot)
+    assert snapshot.fields == flask_db.SUBSTANCE_FIELDS
+
+
+def test_simple_app_rebuilds_a_snapshot_over_a_file_with_other_fields(simple_db, tmp_path, monkeypatch):
+    conn = simple_db.DB_POOL.connection()
+    conn.execute("INSERT INTO substances (name, category) VALUES ('Caffeine', 'pharmaceutical')")
+    conn.commit()
+    path = str(tmp_path / 'catalog.bin')
+    monkeypatch.setattr(simple_db, 'CATALOG_FILE', path)
+
+    catalog_mmap.write(path, stale_snapshot(simple_db.build_snapshot(), simple_db.encode_snapshot_body),
+                       'simple_app', simple_db.catalog_fingerprint()[0])
+    snapshot = simple_db.load_snapshot()
+    assert isinstance(snapshot, catalog_snapshot.CatalogSnapshot)
+    assert snapshot.fields == simple_db.SUBSTANCE_FIELDS
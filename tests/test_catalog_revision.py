@@ -0,0 +1,88 @@
+"""
+Cache invalidation across processes (user-006): writes made through another
+connection, as the importer, init_database.py or another worker make them,
+change the validators and the cached bodies of a running server
+"""
+
+import sqlite3
+
+import http_cache
+
+
+def write_from_another_process(path, sql, params=()):
+    conn = sqlite3.connect(path)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def flask_database_path(flask_app):
+    return flask_app.db.engine.url.database
+
+
+def test_flask_serves_rows_written_by_another_process(client, flask_db):
+    flask_db.db.session.add(flask_db.Substance(name='Caffeine', category='pharmaceutical'))
+    flask_db.db.session.commit()
+    first = client.get('/api/substances?fields=name')
+    etag = first.headers['ETag']
+    assert [item['name'] for item in first.get_json()] == ['Caffeine']
+
+    write_from_another_process(flask_database_path(flask_db),
+                               "INSERT INTO substance (name, category) VALUES ('Nicotine', 'pharmaceutical')")
+
+    revalidated = client.get('/api/substances?fields=name', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 200
+    assert revalidated.headers['ETag'] != etag
+    assert [item['name'] for item in revalidated.get_json()] == ['Caffeine', 'Nicotine']
+
+
+def test_flask_dose_analysis_sees_thresholds_written_by_another_process(client, flask_db):
+    substance = flask_db.Substance(name='Caffeine', category='pharmaceutical', therapeutic_dose_min=1.0,
+                                   therapeutic_dose_max=10.0, toxic_dose=20.0, lethal_dose=80.0)
+    flask_db.db.session.add(substance)
+    flask_db.db.session.commit()
+    client.get('/api/categories')
+    measurement = {'substance_id': substance.id, 'measured_level': 15.0}
+    assert client.post('/api/dose-analysis', json=measurement).get_json()['interpretation'] == \
+        'Above therapeutic, potentially toxic'
+
+    write_from_another_process(flask_database_path(flask_db), "UPDATE substance SET toxic_dose = 12.0")
+
+    assert client.post('/api/dose-analysis', json=measurement).get_json()['interpretation'] == 'Toxic range'
+
+
+def test_simple_app_serves_rows_written_by_another_process(simple_db, simple_server):
+    write_from_another_process(simple_db.DB_PATH,
+                               "INSERT INTO substances (name, category) VALUES ('Caffeine', 'pharmaceutical')")
+    status, headers, _ = simple_server.request('GET', '/api/categories')
+    etag = headers['ETag']
+
+    write_from_another_process(simple_db.DB_PATH,
+                               "INSERT INTO substances (name, category) VALUES ('Fentanyl', 'synthetic')")
+
+    status, headers, body = simple_server.request('GET', '/api/categories', headers={'If-None-Match': etag})
+    assert status == 200
+    assert headers['ETag'] != etag
+    assert simple_server.get_json('/api/categories') == ['pharmaceutical', 'synthetic']
+
+
+def test_workers_agree_on_the_etag_of_a_revision():
+    # Two workers with their own in-memory versions of the same database
+    state = {'revision': (1, '2026-01-01 00:00:00')}
+
+    def loader():
+        return f"rows{state['revision']}", None
+
+    def revision():
+        return state['revision']
+
+    workers = [http_cache.CatalogVersion(loader, revision) for _ in range(2)]
+    workers[0].invalidate()
+    assert workers[0].etag() == workers[1].etag()
+    assert not workers[1].changed()
+
+    state['revision'] = (2, '2026-01-01 00:00:01')
+    assert all(worker.changed() for worker in workers)
+    for worker in workers:
+        worker.invalidate()
+    assert workers[0].etag() == workers[1].etag()
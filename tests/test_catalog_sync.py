@@ -0,0 +1,60 @@
+"""
+Incremental catalog sync (user-014): a sync removes the substances an earlier
+sync seeded and no longer lists, and leaves imported rows alone
+"""
+
+import pytest
+
+import simple_app
+
+
+@pytest.fixture
+def init_database(flask_db):
+    # Imported after flask_app has pointed app.py at the test database
+    import init_database
+    return init_database
+
+
+def flask_seed(*names):
+    return [{'name': name, 'category': 'pharmaceutical', 'metabolites': [{'name': f'{name} metabolite'}]}
+            for name in names]
+
+
+def simple_seed(*names):
+    substances = [(name,) + (None,) * 3 + ('pharmaceutical',) + (None,) * 9 for name in names]
+    metabolites = [(position, f'{name} metabolite') + (None,) * 8 for position, name in enumerate(names, 1)]
+    return substances, metabolites
+
+
+def test_flask_sync_keeps_imported_substances(flask_db, init_database):
+    init_database.sync_catalog(flask_seed('Caffeine', 'Nicotine'))
+    with init_database.bulk_connection() as connection, connection.begin():
+        init_database.insert_substances(connection, [{'name': 'Imported', 'category': 'synthetic'}])
+
+    assert init_database.sync_catalog(flask_seed('Caffeine')) == (0, 1)
+
+    assert sorted(name for name, in flask_db.db.session.query(flask_db.Substance.name)) == ['Caffeine', 'Imported']
+
+
+def test_flask_sync_marks_rows_from_before_the_seeded_column(flask_db, init_database):
+    init_database.sync_catalog(flask_seed('Caffeine', 'Nicotine'))
+    flask_db.Substance.query.update({'seeded': None})
+    flask_db.db.session.commit()
+
+    # Nothing is known to be seeded yet, so nothing is removed; listed rows are marked
+    assert init_database.sync_catalog(flask_seed('Caffeine')) == (1, 0)
+    assert init_database.sync_catalog(flask_seed()) == (0, 1)
+
+    assert [name for name, in flask_db.db.session.query(flask_db.Substance.name)] == ['Nicotine']
+
+
+def test_simple_sync_keeps_imported_substances(simple_db):
+    conn = simple_db.DB_POOL.connection()
+    simple_app.sync_catalog(conn, *simple_seed('Caffeine', 'Nicotine'))
+    conn.execute("INSERT INTO substances (name, category) VALUES ('Imported', 'synthetic')")
+
+    assert simple_app.sync_catalog(conn, *simple_seed('Caffeine')) == (0, 1)
+    conn.commit()
+
+    assert [row[0] for row in conn.execute("SELECT name FROM substances ORDER BY name")] == ['Caffeine', 'Imported']
+    assert [row[0] for row in conn.execute("SELECT name FROM metabolites")] == ['Caffeine metabolite']
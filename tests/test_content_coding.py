@@ -0,0 +1,109 @@
+"""
+Content codings and validators (user-017): a body is tagged with the coding
+actually applied to it, so a small body sent uncompressed keeps its plain
+ETag, and either tag revalidates
+"""
+
+import asyncio
+import sqlite3
+
+import compression
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+def add_flask_substances(app, count):
+    for index in range(count):
+        app.db.session.add(app.Substance(name=f'Substance {index:03}', category='pharmaceutical',
+                                         description='A reference substance ' * 4))
+    app.db.session.commit()
+
+
+def add_simple_substances(simple_app, count):
+    conn = sqlite3.connect(simple_app.DB_PATH)
+    conn.executemany("INSERT INTO substances (name, category, description) VALUES (?, 'pharmaceutical', ?)",
+                     [(f'Substance {index:03}', 'A reference substance ' * 4) for index in range(count)])
+    conn.commit()
+    conn.close()
+
+
+def test_flask_small_body_keeps_the_plain_etag(client, flask_db):
+    add_flask_substances(flask_db, 1)
+    plain = client.get('/api/categories')
+    accepted = client.get('/api/categories', headers=GZIP)
+    assert len(accepted.data) < compression.MIN_SIZE
+    assert 'Content-Encoding' not in accepted.headers
+    assert accepted.headers['ETag'] == plain.headers['ETag']
+
+
+def test_flask_compressed_body_gets_a_coded_etag(client, flask_db):
+    add_flask_substances(flask_db, 50)
+    plain = client.get('/api/substances')
+    coded = client.get('/api/substances', headers=GZIP)
+    assert len(plain.data) >= compression.MIN_SIZE
+    assert coded.headers['Content-Encoding'] == 'gzip'
+    assert coded.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+
+    for etag in (plain.headers['ETag'], coded.headers['ETag']):
+        revalidated = client.get('/api/substances', headers=dict(GZIP, **{'If-None-Match': etag}))
+        assert revalidated.status_code == 304
+        assert revalidated.headers['ETag'] == etag
+
+
+def get_asgi(path, headers):
+    import asgi
+
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+             'headers': [(name.lower().encode(), value.encode()) for name, value in headers.items()]}
+    asyncio.run(asgi.app(scope, receive, send))
+    response_headers = {name.decode().lower(): value.decode() for name, value in messages[0]['headers']}
+    return messages[0]['status'], response_headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def test_asgi_tags_the_coding_actually_applied(flask_db):
+    add_flask_substances(flask_db, 50)
+    _, small, body = get_asgi('/api/categories', GZIP)
+    assert len(body) < compression.MIN_SIZE
+    assert 'content-encoding' not in small
+    assert small['etag'] == get_asgi('/api/categories', {})[1]['etag']
+
+    _, plain, _ = get_asgi('/api/substances', {})
+    _, coded, _ = get_asgi('/api/substances', GZIP)
+    assert coded['content-encoding'] == 'gzip'
+    assert coded['etag'] == plain['etag'][:-1] + '-gzip"'
+    for etag in (plain['etag'], coded['etag']):
+        status, headers, _ = get_asgi('/api/substances', dict(GZIP, **{'If-None-Match': etag}))
+        assert status == 304
+        assert headers['etag'] == etag
+
+
+def test_simple_app_small_body_keeps_the_plain_etag(simple_db, simple_server):
+    add_simple_substances(simple_db, 1)
+    _, plain, _ = simple_server.request('GET', '/api/categories')
+    _, accepted, body = simple_server.request('GET', '/api/categories', headers=GZIP)
+    assert len(body) < compression.MIN_SIZE
+    assert 'Content-Encoding' not in accepted
+    assert accepted['ETag'] == plain['ETag']
+
+
+def test_simple_app_compressed_body_gets_a_coded_etag(simple_db, simple_server):
+    add_simple_substances(simple_db, 50)
+    _, plain, body = simple_server.request('GET', '/api/substances')
+    _, coded, _ = simple_server.request('GET', '/api/substances', headers=GZIP)
+    assert len(body) >= compression.MIN_SIZE
+    assert coded['Content-Encoding'] == 'gzip'
+    assert coded['ETag'] == plain['ETag'][:-1] + '-gzip"'
+
+    for etag in (plain['ETag'], coded['ETag']):
+        status, headers, _ = simple_server.request('GET', '/api/substances',
+                                                   headers=dict(GZIP, **{'If-None-Match': etag}))
+        assert status == 304
+        assert headers['ETag'] == etag
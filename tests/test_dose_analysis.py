@@ -0,0 +1,119 @@
+"""
+Single dose analysis (user-019, user-025): every server looks substance ids
+up as integers, also when a client sends them as strings, and answers 400
+for ids, levels and units it cannot analyze
+"""
+
+import asyncio
+import json
+
+import pytest
+
+MEASUREMENT = {'measured_level': 15.0}
+INVALID_IDS = ('abc', None, [1], '', 2.9, True, '-1', '1.5')
+# NaN and Infinity are accepted by json.loads but are not levels
+INVALID_LEVELS = (None, '5', True, float('nan'), float('inf'))
+INVALID_UNITS = (5, ['mg/L'], {'unit': 'mg/L'})
+
+
+def add_flask_caffeine(app):
+    substance = app.Substance(name='Caffeine', category='pharmaceutical', therapeutic_dose_min=1.0,
+                              therapeutic_dose_max=10.0, toxic_dose=20.0, lethal_dose=80.0)
+    app.db.session.add(substance)
+    app.db.session.commit()
+    return substance.id
+
+
+def call_asgi(body):
+    import asgi
+
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': json.dumps(body).encode(), 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/api/dose-analysis', 'query_string': b'',
+             'headers': [(b'content-type', b'application/json')]}
+    asyncio.run(asgi.app(scope, receive, send))
+    status = messages[0]['status']
+    return status, json.loads(b''.join(message.get('body', b'') for message in messages[1:]))
+
+
+@pytest.mark.parametrize('key', [int, str, float])
+def test_flask_accepts_numeric_ids(client, flask_db, key):
+    substance_id = add_flask_caffeine(flask_db)
+    response = client.post('/api/dose-analysis', json=dict(MEASUREMENT, substance_id=key(substance_id)))
+    assert response.status_code == 200
+    assert response.get_json()['interpretation'] == 'Above therapeutic, potentially toxic'
+
+
+@pytest.mark.parametrize('substance_id', INVALID_IDS)
+def test_flask_rejects_ids_that_are_not_numbers(client, flask_db, substance_id):
+    add_flask_caffeine(flask_db)
+    response = client.post('/api/dose-analysis', json=dict(MEASUREMENT, substance_id=substance_id))
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'substance_id must be an integer'}
+
+
+@pytest.mark.parametrize('measured_level', INVALID_LEVELS)
+def test_flask_rejects_levels_that_are_not_finite_numbers(client, flask_db, measured_level):
+    substance_id = add_flask_caffeine(flask_db)
+    response = client.post('/api/dose-analysis', data=json.dumps({'substance_id': substance_id,
+                                                                  'measured_level': measured_level}),
+                           content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'measured_level must be a finite number'}
+
+
+@pytest.mark.parametrize('unit', INVALID_UNITS)
+def test_flask_rejects_units_that_are_not_strings(client, flask_db, unit):
+    substance_id = add_flask_caffeine(flask_db)
+    response = client.post('/api/dose-analysis', json=dict(MEASUREMENT, substance_id=substance_id, unit=unit))
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'unit must be a string'}
+
+
+def test_flask_rejects_bodies_that_are_not_objects(client, flask_db):
+    assert client.post('/api/dose-analysis', json=[1, 2]).status_code == 400
+
+
+def test_asgi_coerces_ids_like_flask(flask_db):
+    substance_id = add_flask_caffeine(flask_db)
+    status, result = call_asgi(dict(MEASUREMENT, substance_id=str(substance_id)))
+    assert status == 200
+    assert result['interpretation'] == 'Above therapeutic, potentially toxic'
+    assert call_asgi(dict(MEASUREMENT, substance_id='abc')) == (400, {'error': 'substance_id must be an integer'})
+    for measured_level in INVALID_LEVELS:
+        assert call_asgi({'substance_id': substance_id, 'measured_level': measured_level}) == \
+            (400, {'error': 'measured_level must be a finite number'})
+    for unit in INVALID_UNITS:
+        assert call_asgi(dict(MEASUREMENT, substance_id=substance_id, unit=unit)) == \
+            (400, {'error': 'unit must be a string'})
+
+
+def test_simple_app_coerces_ids_like_flask(simple_db, simple_server):
+    conn = simple_db.DB_POOL.connection()
+    substance_id = conn.execute(
+        "INSERT INTO substances (name, category, therapeutic_dose_min, therapeutic_dose_max, toxic_dose, lethal_dose)"
+        " VALUES ('Caffeine', 'pharmaceutical', 1.0, 10.0, 20.0, 80.0)").lastrowid
+    conn.commit()
+    simple_db.invalidate_catalog()
+
+    def post(body):
+        status, _, response = simple_server.request('POST', '/api/dose-analysis', json.dumps(body).encode(),
+                                                    {'Content-Type': 'application/json'})
+        return status, json.loads(response)
+
+    status, result = post(dict(MEASUREMENT, substance_id=str(substance_id)))
+    assert status == 200
+    assert result['interpretation'] == 'Above therapeutic, potentially toxic'
+    for invalid in INVALID_IDS:
+        assert post(dict(MEASUREMENT, substance_id=invalid)) == (400, {'error': 'substance_id must be an integer'})
+    for measured_level in INVALID_LEVELS:
+        assert post({'substance_id': substance_id, 'measured_level': measured_level}) == \
+            (400, {'error': 'measured_level must be a finite number'})
+    for unit in INVALID_UNITS:
+        assert post(dict(MEASUREMENT, substance_id=substance_id, unit=unit)) == (400, {'error': 'unit must be a string'})
@@ -0,0 +1,51 @@
+"""
+The vectorized threshold classifier (user-008) gives the same label as
+classify_level for every measurement, including missing and zero thresholds
+and levels exactly on a threshold
+"""
+
+from hypothesis import given, settings, strategies as st
+
+import dose_classifier
+import read_model
+
+# Missing, zero, and a small set of values so that levels often land exactly on a threshold
+thresholds = st.one_of(st.none(), st.just(0.0), st.sampled_from([0.001, 0.5, 1.0, 2.5, 10.0, 300.0]),
+                       st.floats(min_value=1e-6, max_value=1e6))
+levels = st.one_of(st.sampled_from([0.0, 0.001, 0.5, 1.0, 2.5, 10.0, 300.0]),
+                   st.floats(min_value=0.0, max_value=1e7))
+rows = st.lists(st.tuples(thresholds, thresholds, thresholds, thresholds), min_size=1, max_size=20)
+
+
+def threshold_table(threshold_rows):
+    return read_model.ThresholdTable((item_id, f'Substance {item_id}', 'mg/L', 'synthetic', *values)
+                                     for item_id, values in enumerate(threshold_rows, 1))
+
+
+@settings(max_examples=300, deadline=None)
+@given(rows, st.data())
+def test_classifier_matches_classify_level(threshold_rows, data):
+    classifier = dose_classifier.ThresholdClassifier(threshold_table(threshold_rows))
+    # Ids outside the table too, which are Unknown
+    ids = data.draw(st.lists(st.integers(min_value=0, max_value=len(threshold_rows) + 1), min_size=1, max_size=50))
+    measured = data.draw(st.lists(levels, min_size=len(ids), max_size=len(ids)))
+
+    labels = classifier.labels(ids, measured)
+
+    for item_id, level, label in zip(ids, measured, labels):
+        if 1 <= item_id <= len(threshold_rows):
+            assert label == dose_classifier.classify_level(*threshold_rows[item_id - 1], level)
+        else:
+            assert label == dose_classifier.LABELS[dose_classifier.UNKNOWN]
+
+
+@settings(max_examples=300, deadline=None)
+@given(st.tuples(thresholds, thresholds, thresholds, thresholds), levels)
+def test_read_model_record_matches_classify_level(values, level):
+    record = threshold_table([values]).get(1)
+    assert record.classify(level) == dose_classifier.classify_level(*values, level)
+
+
+def test_empty_table_classifies_everything_as_unknown():
+    classifier = dose_classifier.ThresholdClassifier(threshold_table([]))
+    assert classifier.labels([1, 2], [1.0, 2.0]) == [dose_classifier.LABELS[dose_classifier.UNKNOWN]] * 2
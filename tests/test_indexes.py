@@ -0,0 +1,76 @@
+"""
+Indexes on the hot filter columns (user-011): category filters and sorted
+category listings, CAS lookups and the metabolite fan-out of a listing use
+them, in both schemas and after the Flask migration
+"""
+
+import os
+import sqlite3
+from contextlib import closing
+
+import flask_migrate
+import pytest
+from sqlalchemy import text
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+# (query, index it must search) for the Flask schema
+FLASK_QUERIES = (
+    ("SELECT id, name FROM substance WHERE category = 'narcotic' ORDER BY name", 'ix_substance_category_name'),
+    ("SELECT id, name FROM substance WHERE category = 'narcotic'", 'ix_substance_category_name'),
+    ("SELECT id, name FROM substance WHERE cas_number = '50-36-2'", 'ix_substance_cas_number'),
+    ("SELECT id, name FROM metabolite WHERE substance_id IN (1, 2, 3) ORDER BY substance_id",
+     'ix_metabolite_substance_id'),
+)
+
+# The same lookups as simple_app.py runs them
+SIMPLE_QUERIES = (
+    ("SELECT id, name FROM substances WHERE category = 'narcotic' ORDER BY name", 'idx_substances_category_name'),
+    ("SELECT id, name FROM substances WHERE category = 'narcotic'", 'idx_substances_category_name'),
+    ("SELECT id, name FROM substances WHERE cas_number = '50-36-2'", 'idx_substances_cas_number'),
+    ("SELECT * FROM metabolites WHERE substance_id IN (SELECT value FROM json_each('[1, 2, 3]')) "
+     "ORDER BY substance_id, id", 'idx_metabolites_substance_id'),
+)
+
+
+def plan(execute, query):
+    return ' | '.join(row[-1] for row in execute(f'EXPLAIN QUERY PLAN {query}'))
+
+
+def assert_uses_index(execute, query, index):
+    details = plan(execute, query)
+    assert f'USING INDEX {index}' in details or f'USING COVERING INDEX {index}' in details, details
+    # Sorted category listings come straight from the (category, name) index
+    assert 'TEMP B-TREE FOR ORDER BY' not in details, details
+
+
+def flask_execute(flask_app):
+    # A fresh connection: a cached EXPLAIN statement is not re-planned after a schema change
+    def execute(sql):
+        with closing(sqlite3.connect(flask_app.db.engine.url.database)) as conn:
+            return conn.execute(sql).fetchall()
+    return execute
+
+
+@pytest.mark.parametrize('query, index', FLASK_QUERIES)
+def test_flask_schema_uses_indexes(flask_db, query, index):
+    assert_uses_index(flask_execute(flask_db), query, index)
+
+
+@pytest.mark.parametrize('query, index', FLASK_QUERIES)
+def test_flask_migration_adds_indexes(flask_db, query, index):
+    # A database from before the indexes, brought up to date by the migration
+    flask_db.db.session.execute(text('DROP TABLE IF EXISTS alembic_version'))
+    for name in ('ix_substance_category_name', 'ix_substance_cas_number', 'ix_metabolite_substance_id'):
+        flask_db.db.session.execute(text(f'DROP INDEX {name}'))
+    flask_db.db.session.commit()
+    assert f'INDEX {index}' not in plan(flask_execute(flask_db), query)
+
+    flask_migrate.upgrade(directory=MIGRATIONS, revision='2c8bf1114a73')
+
+    assert_uses_index(flask_execute(flask_db), query, index)
+
+
+@pytest.mark.parametrize('query, index', SIMPLE_QUERIES)
+def test_simple_schema_uses_indexes(simple_db, query, index):
+    assert_uses_index(simple_db.DB_POOL.connection().execute, query, index)
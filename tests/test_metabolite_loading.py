@@ -0,0 +1,133 @@
+"""
+Batched metabolite loading of the substance list (user-001): the number of
+statements does not grow with the number of substances, and the batched
+metabolites are the ones a per-substance query returns
+"""
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+def metabolite_count(index):
+    # Some substances have no metabolites at all
+    return index % 4
+
+
+def add_flask_substances(app, start, stop):
+    for index in range(start, stop):
+        substance = app.Substance(name=f'Substance {index:04d}', category='synthetic', toxic_dose=index + 1.0)
+        substance.metabolites = [app.Metabolite(name=f'Metabolite {index:04d}-{number}', toxic_level=number + 0.5,
+                                                unit='mg/L')
+                                 for number in range(metabolite_count(index))]
+        app.db.session.add(substance)
+    app.db.session.commit()
+
+
+def add_simple_substances(simple_app, start, stop):
+    conn = simple_app.DB_POOL.connection()
+    for index in range(start, stop):
+        substance_id = conn.execute("INSERT INTO substances (name, category, toxic_dose) VALUES (?, ?, ?)",
+                                    (f'Substance {index:04d}', 'synthetic', index + 1.0)).lastrowid
+        conn.executemany("INSERT INTO metabolites (substance_id, name, toxic_level, unit) VALUES (?, ?, ?, ?)",
+                         [(substance_id, f'Metabolite {index:04d}-{number}', number + 0.5, 'mg/L')
+                          for number in range(metabolite_count(index))])
+    conn.commit()
+    simple_app.invalidate_catalog()
+
+
+@contextmanager
+def recorded_statements(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+@contextmanager
+def recorded_sqlite_statements(simple_app, monkeypatch):
+    # Trace every connection the pool opens, whichever worker thread opens it
+    statements = []
+    open_connection = simple_app.ConnectionPool._open
+
+    def traced_open(pool):
+        conn = open_connection(pool)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    simple_app.DB_POOL.close_all()
+    monkeypatch.setattr(simple_app.ConnectionPool, '_open', traced_open)
+    yield statements
+
+
+def test_flask_listing_runs_a_fixed_number_of_statements(client, flask_db):
+    counts = []
+    for start, stop in ((0, 10), (10, 300)):
+        add_flask_substances(flask_db, start, stop)
+        with recorded_statements(flask_db.db.engine) as statements:
+            response = client.get('/api/substances')
+        assert response.status_code == 200
+        assert len(response.get_json()) == stop
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
+
+
+def test_flask_page_runs_a_fixed_number_of_statements(client, flask_db):
+    counts = []
+    for start, stop in ((0, 10), (10, 300)):
+        add_flask_substances(flask_db, start, stop)
+        with recorded_statements(flask_db.db.engine) as statements:
+            response = client.get(f'/api/substances?limit={stop}')
+        assert len(response.get_json()['items']) == stop
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
+
+
+def test_flask_listing_matches_per_substance_metabolites(client, flask_db):
+    add_flask_substances(flask_db, 0, 40)
+    listing = client.get('/api/substances').get_json()
+    assert len(listing) == 40
+    Metabolite = flask_db.Metabolite
+    for substance in listing:
+        metabolites = Metabolite.query.filter_by(substance_id=substance['id']).order_by(Metabolite.id)
+        assert substance['metabolites'] == [flask_db.metabolite_to_dict(m) for m in metabolites]
+
+
+def test_simple_listing_runs_a_fixed_number_of_statements(simple_db, simple_server, monkeypatch):
+    counts = []
+    for start, stop in ((0, 10), (10, 300)):
+        add_simple_substances(simple_db, start, stop)
+        with recorded_sqlite_statements(simple_db, monkeypatch) as statements:
+            listing = simple_server.get_json('/api/substances')
+        assert len(listing) == stop
+        counts.append(len([statement for statement in statements if not statement.startswith('PRAGMA')]))
+    assert counts[0] == counts[1]
+
+
+def test_simple_listing_matches_per_substance_metabolites(simple_db, simple_server):
+    add_simple_substances(simple_db, 0, 40)
+    listing = simple_server.get_json('/api/substances')
+    assert len(listing) == 40
+    conn = simple_db.DB_POOL.connection()
+    columns = ', '.join(simple_db.METABOLITE_FIELDS)
+    for substance in listing:
+        metabolites = conn.execute(f"SELECT {columns} FROM metabolites WHERE substance_id = ? ORDER BY id",
+                                   (substance['id'],))
+        assert substance['metabolites'] == [dict(metabolite) for metabolite in metabolites]
+
+
+def test_simple_listing_leaves_out_lookup_and_derived_columns(simple_db, simple_server, monkeypatch):
+    add_simple_substances(simple_db, 0, 4)
+    queried = simple_server.get_json('/api/substances')
+    monkeypatch.setattr(simple_db.CATALOG_SNAPSHOT, 'enabled', True)
+    simple_db.CATALOG_SNAPSHOT.invalidate()
+    for listing in (queried, simple_server.get_json('/api/substances')):
+        metabolites = [metabolite for substance in listing for metabolite in substance['metabolites']]
+        assert metabolites
+        assert all(tuple(metabolite) == simple_db.METABOLITE_FIELDS for metabolite in metabolites)
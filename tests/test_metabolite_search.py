@@ -0,0 +1,63 @@
+"""
+Parent lookup by detected metabolite names (user-020): names match regardless
+of case, spaces and punctuation, but distinct metabolites never share a key
+"""
+
+import metabolite_search
+
+# Parent: metabolites; HMA and HMMA fold to the same autocomplete key
+CATALOG = {
+    'MDMA': ('HMMA', '6-Mono Acetyl'),
+    'MDA': ('HMA',),
+}
+
+
+def parents(results):
+    return [result['name'] for result in results]
+
+
+def test_keys_ignore_case_spaces_and_punctuation_only():
+    assert metabolite_search.normalize_name(' 6-Monoacetyl morphine ') == '6monoacetylmorphine'
+    assert metabolite_search.normalize_name('HMA') != metabolite_search.normalize_name('HMMA')
+
+
+def test_flask_search_keeps_distinct_metabolites_apart(client, flask_db):
+    for name, metabolites in CATALOG.items():
+        flask_db.db.session.add(flask_db.Substance(name=name, category='synthetic', metabolites=[
+            flask_db.Metabolite(name=metabolite, normalized_name=metabolite_search.normalize_name(metabolite))
+            for metabolite in metabolites]))
+    flask_db.db.session.commit()
+
+    assert parents(client.get('/api/metabolites/search?name=hma').get_json()) == ['MDA']
+    assert parents(client.get('/api/metabolites/search?name=HMMA').get_json()) == ['MDMA']
+    assert parents(client.get('/api/metabolites/search?name=6-monoacetyl').get_json()) == ['MDMA']
+
+
+def test_simple_search_keeps_distinct_metabolites_apart(simple_db, simple_server):
+    conn = simple_db.DB_POOL.connection()
+    for name, metabolites in CATALOG.items():
+        substance_id = conn.execute("INSERT INTO substances (name, category) VALUES (?, 'synthetic')",
+                                    (name,)).lastrowid
+        conn.executemany("INSERT INTO metabolites (substance_id, name) VALUES (?, ?)",
+                         [(substance_id, metabolite) for metabolite in metabolites])
+    simple_db.store_metabolite_keys(conn)
+    conn.commit()
+    simple_db.invalidate_catalog()
+
+    assert parents(simple_server.get_json('/api/metabolites/search?name=hma')) == ['MDA']
+    assert parents(simple_server.get_json('/api/metabolites/search?name=HMMA')) == ['MDMA']
+    assert parents(simple_server.get_json('/api/metabolites/search?name=6%20MONOACETYL')) == ['MDMA']
+
+
+def test_simple_schema_rekeys_names_stored_by_an_older_version(simple_db):
+    conn = simple_db.DB_POOL.connection()
+    substance_id = conn.execute("INSERT INTO substances (name, category) VALUES ('MDA', 'synthetic')").lastrowid
+    conn.execute("INSERT INTO metabolites (substance_id, name, normalized_name) VALUES (?, 'HMA', 'old key')",
+                 (substance_id,))
+    conn.execute("PRAGMA user_version = 0")
+    conn.commit()
+
+    simple_db.create_schema(conn)
+
+    assert conn.execute("SELECT normalized_name FROM metabolites").fetchone()[0] == 'hma'
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == simple_db.METABOLITE_KEY_VERSION
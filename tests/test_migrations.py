@@ -0,0 +1,28 @@
+"""
+Flask-Migrate revisions (user-011): `flask db upgrade` builds the schema of
+app.py's models on an empty database, as README.md tells users to run it
+"""
+
+import os
+
+import flask_migrate
+import sqlalchemy as sa
+from sqlalchemy import text
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+def test_upgrade_builds_the_model_schema_from_an_empty_database(flask_db):
+    flask_db.db.drop_all()
+    flask_db.db.session.execute(text('DROP TABLE IF EXISTS alembic_version'))
+    flask_db.db.session.commit()
+    assert not set(flask_db.db.metadata.tables) & set(sa.inspect(flask_db.db.engine).get_table_names())
+
+    flask_migrate.upgrade(directory=MIGRATIONS)
+
+    # Pooled connections answer PRAGMA index_list from statements prepared before the upgrade
+    flask_db.db.engine.dispose()
+    inspector = sa.inspect(flask_db.db.engine)
+    for name, table in flask_db.db.metadata.tables.items():
+        assert {column['name'] for column in inspector.get_columns(name)} == {column.name for column in table.columns}
+        assert {index['name'] for index in inspector.get_indexes(name)} >= {index.name for index in table.indexes}
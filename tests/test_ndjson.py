@@ -0,0 +1,67 @@
+"""
+NDJSON listings (user-015): the database query path and the snapshot and
+catalog-file paths (user-024) serve the same bytes for the same catalog
+"""
+
+import catalog_mmap
+
+NDJSON = {'Accept': 'application/x-ndjson'}
+PATHS = ('/api/substances', '/api/substances?fields=name,toxic_dose', '/api/substances?category=narcotic')
+
+
+def add_flask_substances(app):
+    for index, category in enumerate(('narcotic', 'synthetic', 'narcotic')):
+        substance = app.Substance(name=f'Substance {index}', category=category, toxic_dose=index + 0.5,
+                                  common_names='["Ünïcode"]')
+        substance.metabolites = [app.Metabolite(name=f'Metabolite {index}', toxic_level=0.25, unit='mg/L')]
+        app.db.session.add(substance)
+    app.db.session.commit()
+
+
+def flask_bodies(client):
+    return [client.get(path, headers=NDJSON).data for path in PATHS]
+
+
+def test_flask_query_and_snapshot_lines_match(client, flask_db, tmp_path, monkeypatch):
+    add_flask_substances(flask_db)
+    queried = flask_bodies(client)
+    assert queried[0].count(b'\n') == 3
+
+    monkeypatch.setattr(flask_db.snapshot_loader, 'enabled', True)
+    flask_db.snapshot_loader.invalidate()
+    assert flask_bodies(client) == queried
+
+    path = str(tmp_path / 'catalog.bin')
+    catalog_mmap.write(path, flask_db.build_catalog_snapshot(), 'flask')
+    mapped = catalog_mmap.MappedCatalog(path, flask_db.encode_json, 'flask')
+    try:
+        assert b''.join(mapped.ndjson_lines(flask_db.SUBSTANCE_FIELDS, True)) == queried[0]
+    finally:
+        mapped.close()
+
+
+def test_asgi_query_lines_match_flask(client, flask_db):
+    import asgi
+
+    add_flask_substances(flask_db)
+    body, after_id = asgi.substance_lines({}, flask_db.SUBSTANCE_FIELDS, True, 0)
+    assert after_id is None
+    assert body == client.get('/api/substances', headers=NDJSON).data
+
+
+def test_simple_query_and_snapshot_lines_match(simple_db, simple_server, monkeypatch):
+    conn = simple_db.DB_POOL.connection()
+    for index, category in enumerate(('narcotic', 'synthetic', 'narcotic')):
+        substance_id = conn.execute(
+            "INSERT INTO substances (name, category, toxic_dose, common_names) VALUES (?, ?, ?, ?)",
+            (f'Substance {index}', category, index + 0.5, '["Ünïcode"]')).lastrowid
+        conn.execute("INSERT INTO metabolites (substance_id, name, toxic_level, unit) VALUES (?, ?, 0.25, 'mg/L')",
+                     (substance_id, f'Metabolite {index}'))
+    conn.commit()
+    simple_db.invalidate_catalog()
+    queried = [simple_server.request('GET', path, headers=NDJSON)[2] for path in PATHS]
+    assert queried[0].count(b'\n') == 3
+
+    monkeypatch.setattr(simple_db.CATALOG_SNAPSHOT, 'enabled', True)
+    simple_db.CATALOG_SNAPSHOT.invalidate()
+    assert [simple_server.request('GET', path, headers=NDJSON)[2] for path in PATHS] == queried
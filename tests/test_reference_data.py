@@ -0,0 +1,35 @@
+"""
+Resumable reference-data import (user-013): chunks are committed with
+durable settings, unlike the one-shot bulk rebuild
+"""
+
+import json
+
+import pytest
+
+
+@pytest.fixture
+def reference_data(flask_db):
+    # Imported after flask_app has pointed app.py at the test database
+    import reference_data
+    return reference_data
+
+
+def test_import_commits_chunks_in_wal_mode_with_normal_sync(flask_db, reference_data, tmp_path, monkeypatch):
+    path = tmp_path / 'substances.jsonl'
+    path.write_text(''.join(json.dumps({'name': f'Substance {index}', 'category': 'synthetic'}) + '\n'
+                            for index in range(5)))
+    settings = []
+    load_chunk = reference_data.load_substance_chunk
+
+    def recording_load_chunk(connection, chunk):
+        settings.append((connection.exec_driver_sql('PRAGMA journal_mode').scalar(),
+                         connection.exec_driver_sql('PRAGMA synchronous').scalar()))
+        return load_chunk(connection, chunk)
+
+    monkeypatch.setattr(reference_data, 'load_substance_chunk', recording_load_chunk)
+    reference_data.load_reference_data(substances_file=str(path), chunk_size=2)
+
+    # synchronous: 1 is NORMAL, 0 would be OFF
+    assert settings == [('wal', 1)] * 3
+    assert flask_db.Substance.query.count() == 5
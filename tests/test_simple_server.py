@@ -0,0 +1,38 @@
+"""
+The pooled standalone server (user-009): closing it releases the listening
+socket, the selector and the keep-alive connections parked in it
+"""
+
+import http.client
+import os
+import threading
+import time
+
+
+def open_descriptors():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def test_server_close_releases_parked_connections(simple_db):
+    before = open_descriptors()
+    httpd = simple_db.make_server('127.0.0.1', 0, threads=2)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    clients = [http.client.HTTPConnection('127.0.0.1', httpd.server_address[1], timeout=10) for _ in range(3)]
+    for client in clients:
+        client.request('GET', '/api/categories')
+        assert client.getresponse().read() == b'[]'
+    deadline = time.monotonic() + 5
+    while len(httpd.idle) < len(clients) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(httpd.idle) == len(clients)
+
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+    for client in clients:
+        client.close()
+    simple_db.DB_POOL.close_all()
+
+    assert open_descriptors() == before
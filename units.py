@@ -0,0 +1,84 @@
+"""
+Concentration units and their conversion to ng/mL
+
+Thresholds are stored in the unit they were published in (`dose_unit` on
+substances, `unit` on metabolites): mg/L, µg/L, ng/mL and so on. Both servers
+also store every threshold converted to ng/mL in a `<column>_ng_ml` shadow
+column, filled when the row is written, so comparisons across substances such
+as "toxic at 500 ng/mL" are plain indexed SQL comparisons.
+"""
+
+from functools import lru_cache
+
+CANONICAL_UNIT = 'ng/mL'
+CANONICAL_SUFFIX = '_ng_ml'
+
+# Powers of ten of grams per mass unit and of litres per volume unit, kept as
+# exponents so conversions between the usual units are exact
+MASS_UNITS = {'g': 0, 'mg': -3, 'µg': -6, 'ng': -9, 'pg': -12}
+VOLUME_UNITS = {'l': 0, 'dl': -1, 'ml': -3}
+MICRO_SPELLINGS = ('μg', 'ug', 'mcg')  # Greek mu, ASCII and pharmacy spellings of µg
+
+SUBSTANCE_THRESHOLDS = ('therapeutic_dose_min', 'therapeutic_dose_max', 'toxic_dose', 'lethal_dose')
+METABOLITE_THRESHOLDS = ('therapeutic_range_min', 'therapeutic_range_max', 'toxic_level')
+
+
+@lru_cache(maxsize=64)
+def factor(unit):
+    """Multiplier taking a value in `unit` to ng/mL; raises ValueError for anything but mass per volume"""
+    mass, slash, volume = (unit or '').strip().lower().partition('/')
+    if mass in MICRO_SPELLINGS:
+        mass = 'µg'
+    if not slash or mass not in MASS_UNITS or volume not in VOLUME_UNITS:
+        raise ValueError(f'Unknown concentration unit: {unit!r}')
+    # 1 ng/mL is 10^-6 g/L
+    return 10 ** (MASS_UNITS[mass] - VOLUME_UNITS[volume] + 6)
+
+
+def is_known(unit):
+    try:
+        factor(unit)
+    except ValueError:
+        return False
+    return True
+
+
+def convert(value, from_unit, to_unit):
+    """`value` in `from_unit` expressed in `to_unit`; raises ValueError for unknown units"""
+    if from_unit == to_unit:
+        return value
+    return value * factor(from_unit) / factor(to_unit)
+
+
+def canonical_columns(row, columns, unit):
+    """The `<column>_ng_ml` values for threshold `columns` of a row stored in `unit`.
+
+    Missing thresholds stay None, and so does every value of a row whose unit
+    is not a known concentration unit.
+    """
+    scale = factor(unit) if is_known(unit) else None
+    return {column + CANONICAL_SUFFIX: (row.get(column) * scale
+                                        if row.get(column) is not None and scale is not None else None)
+            for column in columns}
+
+
+def parse_threshold_filter(minimum, maximum, unit):
+    """Validate the toxic_min=, toxic_max= and unit= query parameters; returns (min, max) in ng/mL.
+
+    Either bound may be missing (None). `unit` defaults to ng/mL. Raises
+    ValueError for bounds that are not numbers and for unknown units.
+    """
+    scale = factor(unit or CANONICAL_UNIT)
+    bounds = []
+    for name, value in (('toxic_min', minimum), ('toxic_max', maximum)):
+        if value is None:
+            bounds.append(None)
+            continue
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError(f'{name} must be a number')
+        if value != value or value in (float('inf'), float('-inf')):
+            raise ValueError(f'{name} must be a finite number')
+        bounds.append(value * scale)
+    return tuple(bounds)
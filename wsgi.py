@@ -0,0 +1,22 @@
+"""
+WSGI entry point of the Flask application for production servers
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Importing this module builds the catalog caches (catalog version, snapshot
+when enabled, autocomplete and mass indexes, dose thresholds). With
+gunicorn's preload_app the import happens once in the master, so the caches
+are built once and every forked worker shares them copy-on-write.
+"""
+
+import gc
+
+from app import app, build_catalog_caches, db
+
+with app.app_context():
+    build_catalog_caches()
+    # Pooled connections opened while building belong to this process; workers open their own after the fork
+    db.engine.dispose()
+
+# Keep the cyclic collector of the workers from touching, and so copying, the objects built above
+gc.freeze()